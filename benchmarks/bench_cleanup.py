@@ -0,0 +1,93 @@
+"""
+Compares the time taken to clean up old data using the anti-join cleanup against the NOT IN
+subqueries it replaced, on a seeded SQLite database.
+
+Run from the root of the repository with:
+    python -m benchmarks.bench_cleanup
+"""
+
+import argparse
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from exp_db_populator.database_model import Experiment, Experimentteams, User, bind_database
+from exp_db_populator.populator import AGE_OF_EXPIRATION, cleanup_old_data
+
+from benchmarks.synthetic import count_rows, create_database, seed_database, timed
+
+
+def not_in_cleanup(database):
+    """
+    The cleanup as it was before, using NOT IN subqueries over the whole of each table.
+    """
+    with bind_database(database):
+        date = datetime.now() - timedelta(days=AGE_OF_EXPIRATION)
+        Experimentteams.delete().where(Experimentteams.startdate < date).execute()
+        all_team_experiments = Experimentteams.select(Experimentteams.experimentid)
+        Experiment.delete().where(Experiment.experimentid.not_in(all_team_experiments)).execute()
+        all_team_user_ids = Experimentteams.select(Experimentteams.userid)
+        User.delete().where(User.userid.not_in(all_team_user_ids)).execute()
+
+
+CLEANUPS = {
+    "not_in": not_in_cleanup,
+    "anti_join": cleanup_old_data,
+    "anti_join_full": lambda database: cleanup_old_data(database, full=True),
+}
+
+
+def run(experiments, team_size, users, expired_fraction, repeat):
+    """
+    Runs each cleanup on freshly seeded copies of the same database. Each cleanup is timed twice,
+    once when there is expired data to remove and again straight afterwards when there is none,
+    which is what most of the hourly runs look like.
+    Returns:
+        dict: The best times in seconds and the rows left afterwards, keyed by cleanup name.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name, cleanup in CLEANUPS.items():
+            first_times, repeat_times = [], []
+            for _ in range(repeat):
+                database = create_database(os.path.join(temp_dir, "{}.db".format(name)))
+                seed_database(database, experiments, team_size, users, expired_fraction)
+                with database.connection_context():
+                    first_times.append(timed(cleanup, database)[0])
+                    repeat_times.append(timed(cleanup, database)[0])
+                rows = count_rows(database)
+                database.close()
+            results[name] = {"first": min(first_times), "repeat": min(repeat_times), "rows": rows}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(), formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--experiments", type=int, default=20000)
+    parser.add_argument("--team_size", type=int, default=4)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--expired_fraction", type=float, default=0.02)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    results = run(args.experiments, args.team_size, args.users, args.expired_fraction, args.repeat)
+    baseline = results["not_in"]
+    print("{:<16}{:>18}{:>18}".format("", "with expired data", "without"))
+    for name, result in results.items():
+        print(
+            "{:<16}{:>10.4f}s{:>6.1f}x{:>10.4f}s{:>6.1f}x".format(
+                name,
+                result["first"],
+                baseline["first"] / result["first"],
+                result["repeat"],
+                baseline["repeat"] / result["repeat"],
+            )
+        )
+    if len({str(result["rows"]) for result in results.values()}) != 1:
+        print("WARNING: the cleanups left different data behind")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Compares the time taken to get the database credentials for every instrument at startup with and
+without the credentials cache. Opening a KeePass database is simulated by the same kind of slow
+key derivation.
+
+Run from the root of the repository with:
+    python -m benchmarks.bench_credentials
+"""
+
+import argparse
+import hashlib
+import os
+import tempfile
+
+from exp_db_populator.credentials import CredentialsCache
+from exp_db_populator.data_types import CREDS_GROUP
+
+from benchmarks.synthetic import timed
+
+
+def create_slow_reader(iterations):
+    """
+    Creates a credentials reader that takes about as long as decrypting a KeePass database.
+    Args:
+        iterations: The number of key derivation iterations to do on each read.
+    """
+
+    def read_credentials(group, entry):
+        hashlib.pbkdf2_hmac("sha256", b"master password", b"salt", iterations)
+        return "user", "password"
+
+    return read_credentials
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(), formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--instruments", type=int, default=40)
+    parser.add_argument("--iterations", type=int, default=500000)
+    args = parser.parse_args()
+
+    reader = create_slow_reader(args.iterations)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with open(os.path.join(temp_dir, "passwords.kdbx"), "w") as password_file:
+            password_file.write("encrypted")
+        cache = CredentialsCache(reader, temp_dir)
+
+        uncached, _ = timed(
+            lambda: [reader(CREDS_GROUP, "ExpDatabaseWrite") for _ in range(args.instruments)]
+        )
+        cached, _ = timed(
+            lambda: [cache.get(CREDS_GROUP, "ExpDatabaseWrite") for _ in range(args.instruments)]
+        )
+
+    print("{} instruments".format(args.instruments))
+    print("{:<10}{:>10.3f}s".format("uncached", uncached))
+    print("{:<10}{:>10.3f}s{:>8.1f}x".format("cached", cached, uncached / cached))
+
+
+if __name__ == "__main__":
+    main()
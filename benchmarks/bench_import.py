@@ -0,0 +1,78 @@
+"""
+Times importing the command line entry point and the rest of the populator, using python's
+-X importtime, and lists the modules that take the longest.
+
+Run from the root of the repository with:
+    python -m benchmarks.bench_import
+"""
+
+import argparse
+import subprocess
+import sys
+
+MODULES = ["exp_db_populator.cli", "exp_db_populator.runner", "exp_db_populator.gatherer"]
+# Longest time in seconds importing the command line entry point should take, enforced by the tests
+IMPORT_TIME_BUDGET = 0.1
+# Modules that should only be imported by the code paths that need them, not by the entry point
+HEAVY_MODULES = ["epics", "suds", "mock", "requests", "peewee"]
+
+
+def measure_imports(module):
+    """
+    Imports a module in a new interpreter and records how long each module it imports takes.
+    Args:
+        module: The name of the module to import.
+    Returns:
+        dict: The time in seconds each module took to import, including the modules it imported,
+            keyed by module name.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def best_import_time(module, repeats=3):
+    """
+    Gets the quickest of several imports of a module, which is the least affected by whatever
+    else the machine is doing.
+    Args:
+        module: The name of the module to import.
+        repeats: The number of times to import it.
+    Returns:
+        float: The time in seconds.
+    """
+    return min(measure_imports(module)[module] for _ in range(repeats))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(), formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--top", type=int, default=10, help="The number of slowest to list")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        times = measure_imports(module)
+        print("{}: {:.3f}s".format(module, best_import_time(module)))
+        slowest = sorted(
+            (name for name in times if "." not in name and name != "exp_db_populator"),
+            key=times.get,
+            reverse=True,
+        )
+        for name in slowest[: args.top]:
+            print("    {:<30} {:.3f}s".format(name, times[name]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Times each stage of gathering, reformatting, populating and cleaning up a synthetic schedule, saves
+the results as JSON and compares them with a baseline saved by an earlier run.
+
+Run from the root of the repository with:
+    python -m benchmarks.bench_pipeline --output results.json
+    python -m benchmarks.bench_pipeline --baseline results.json
+
+The exit code is 1 if any stage is slower than the baseline by more than the tolerance, so it can be
+used to check for regressions before deploying. By default the stages run against a temporary
+SQLite database, use --mysql_host to run them against a local MySQL server instead. The tables of
+the exp_data database on that server are dropped and recreated.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from datetime import datetime
+
+from exp_db_populator.database_model import bind_database
+from exp_db_populator.gatherer import get_instrument_data, index_by_instrument
+from exp_db_populator.populator import cleanup_old_data, create_database, populate
+from exp_db_populator.webservices_reader import reformat_data
+
+from benchmarks.synthetic import create_database as create_sqlite_database
+from benchmarks.synthetic import (
+    create_schedule,
+    get_instrument_name,
+    reset_tables,
+    seed_database,
+    timed,
+)
+
+RESULTS_VERSION = 1
+DEFAULT_TOLERANCE = 0.25  # The fraction a stage can be slower than the baseline by
+
+
+def open_database(args, temp_dir):
+    """
+    Opens the database to run the benchmarks against, with empty tables.
+    Returns:
+        The database.
+    """
+    if args.mysql_host is None:
+        return create_sqlite_database(os.path.join(temp_dir, "bench.db"))
+    credentials = (args.mysql_user, args.mysql_password) if args.mysql_user else None
+    database = create_database(args.mysql_host, credentials)
+    reset_tables(database)
+    return database
+
+
+def populate_instrument(database, experiments, experiment_teams):
+    with bind_database(database), database.atomic():
+        return populate(experiments, experiment_teams)
+
+
+def run_stages(args, database):
+    """
+    Runs each stage the requested number of times.
+    Returns:
+        dict: The best time in seconds for each stage, keyed by stage name.
+    """
+    raw_data = create_schedule(args.instruments, args.experiments, args.team_size, args.users)
+    inst_name = get_instrument_name(0)
+    inst_data = get_instrument_data(index_by_instrument(raw_data), inst_name)
+    experiments, experiment_teams = reformat_data(inst_data)
+
+    times = {}
+
+    def record(stage, seconds):
+        times[stage] = min(times.get(stage, seconds), seconds)
+
+    for _ in range(args.repeat):
+        record("index_by_instrument", timed(index_by_instrument, raw_data)[0])
+        record("reformat_data", timed(reformat_data, inst_data)[0])
+
+        reset_tables(database)
+        record(
+            "populate_new", timed(populate_instrument, database, experiments, experiment_teams)[0]
+        )
+        record(
+            "populate_unchanged",
+            timed(populate_instrument, database, experiments, experiment_teams)[0],
+        )
+
+        reset_tables(database)
+        seed_database(database, args.experiments, args.team_size, args.users, args.expired_fraction)
+        record("cleanup_old_data", timed(cleanup_old_data, database)[0])
+        record("cleanup_old_data_clean", timed(cleanup_old_data, database)[0])
+    return times
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the results next to the baseline.
+    Args:
+        results (dict): The results of this run.
+        baseline (dict): The results of an earlier run.
+        tolerance (float): The fraction a stage can be slower than the baseline by.
+    Returns:
+        list[str]: The stages that are slower than the baseline by more than the tolerance.
+    """
+    if baseline["parameters"] != results["parameters"]:
+        print("WARNING: the baseline was run with different parameters, {}".format(baseline))
+
+    regressions = []
+    print("{:<26}{:>12}{:>12}{:>10}".format("stage", "baseline", "now", "ratio"))
+    for stage, seconds in results["times"].items():
+        previous = baseline["times"].get(stage)
+        if previous is None:
+            print("{:<26}{:>12}{:>11.4f}s".format(stage, "-", seconds))
+            continue
+        ratio = seconds / previous
+        regressed = ratio > 1 + tolerance
+        if regressed:
+            regressions.append(stage)
+        print(
+            "{:<26}{:>11.4f}s{:>11.4f}s{:>9.2f}x{}".format(
+                stage, previous, seconds, ratio, "  REGRESSION" if regressed else ""
+            )
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(), formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--instruments", type=int, default=10)
+    parser.add_argument("--experiments", type=int, default=2000, help="Per instrument")
+    parser.add_argument("--team_size", type=int, default=4)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--expired_fraction", type=float, default=0.02)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="The file to save the results to as JSON")
+    parser.add_argument("--baseline", help="A file of results from an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--mysql_host", help="Run against a MySQL server rather than SQLite")
+    parser.add_argument("--mysql_user")
+    parser.add_argument("--mysql_password")
+    args = parser.parse_args()
+
+    parameters = {
+        name: getattr(args, name)
+        for name in ["instruments", "experiments", "team_size", "users", "expired_fraction"]
+    }
+    parameters["database"] = "sqlite" if args.mysql_host is None else "mysql"
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        database = open_database(args, temp_dir)
+        with database.connection_context():
+            times = run_stages(args, database)
+        database.close()
+
+    results = {
+        "version": RESULTS_VERSION,
+        "created": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "parameters": parameters,
+        "times": times,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Slower than the baseline: {}".format(", ".join(regressions)))
+            sys.exit(1)
+    else:
+        for stage, seconds in times.items():
+            print("{:<26}{:>11.4f}s".format(stage, seconds))
+
+
+if __name__ == "__main__":
+    main()
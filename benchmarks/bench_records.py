@@ -0,0 +1,105 @@
+"""
+Measures the memory used by the reformatted experiment teams, compared with records that have
+an instance dictionary and aren't shared between experiments.
+
+Run from the root of the repository with:
+    python -m benchmarks.bench_records
+"""
+
+import argparse
+import gc
+import tracemalloc
+
+from exp_db_populator import webservices_reader
+from exp_db_populator.webservices_reader import reformat_data
+
+from benchmarks.synthetic import create_web_data
+
+
+class DictUserData:
+    """
+    A user record as it was, with an instance dictionary.
+    """
+
+    def __init__(self, name, organisation):
+        self.name = name
+        self.organisation = organisation
+
+
+class DictExperimentTeamData:
+    """
+    An experiment team record as it was, with an instance dictionary.
+    """
+
+    def __init__(self, user, role, rb_number, start_date):
+        self.user = user
+        self.role = role
+        self.rb_number = rb_number
+        self.start_date = start_date
+
+
+def measure(function, *args):
+    """
+    Measures the memory still allocated by the result of a function.
+    Returns:
+        tuple (int, object): The size in bytes and the result of the function.
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = function(*args)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, result
+
+
+def reformat_with_dict_records(web_data):
+    """
+    Reformats the data using the old records, creating a new user record for every team member.
+    """
+    originals = (
+        webservices_reader.UserData,
+        webservices_reader.ExperimentTeamData,
+        webservices_reader.intern_user,
+    )
+    webservices_reader.UserData = DictUserData
+    webservices_reader.ExperimentTeamData = DictExperimentTeamData
+    webservices_reader.intern_user = lambda users, name, organisation: DictUserData(
+        name, organisation
+    )
+    try:
+        return reformat_data(web_data)
+    finally:
+        (
+            webservices_reader.UserData,
+            webservices_reader.ExperimentTeamData,
+            webservices_reader.intern_user,
+        ) = originals
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(), formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--experiments", type=int, default=20000)
+    parser.add_argument("--team_size", type=int, default=4)
+    parser.add_argument("--users", type=int, default=5000)
+    args = parser.parse_args()
+
+    web_data = create_web_data(args.experiments, args.team_size, args.users)
+    rows = args.experiments * (args.team_size + 1)
+    print("{} experiments, {} experiment team rows".format(args.experiments, rows))
+    baseline = None
+    for name, function in [("dict", reformat_with_dict_records), ("slots", reformat_data)]:
+        size, (experiments, experiment_teams) = measure(function, web_data)
+        distinct_users = len({id(exp_team.user) for exp_team in experiment_teams})
+        baseline = baseline or size
+        print(
+            "{:<8}{:>12,} bytes{:>8.0f} bytes/row{:>8.2f}x{:>8} user records".format(
+                name, size, size / rows, baseline / size, distinct_users
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
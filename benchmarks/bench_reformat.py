@@ -0,0 +1,108 @@
+"""
+Times reformatting the website data into experiment rows and building the insert queries for them,
+compared with the old rows, which were a dictionary keyed by field per experiment.
+
+Run from the root of the repository with:
+    python -m benchmarks.bench_reformat
+"""
+
+import argparse
+import math
+import random
+from datetime import timedelta
+
+from exp_db_populator.data_types import EXPERIMENT_FIELDS, ExperimentData
+from exp_db_populator.database_model import Experiment, bind_database
+from exp_db_populator.populator import SQLITE_MAX_VARIABLES
+from exp_db_populator.webservices_test_data import TEST_DATE, create_data
+from peewee import SqliteDatabase, chunked
+
+from benchmarks.synthetic import timed
+
+SIZES = [10000, 30000, 100000]
+BATCH_SIZE = SQLITE_MAX_VARIABLES // len(EXPERIMENT_FIELDS)
+
+
+def create_records(count, team_size=4, seed=0):
+    """
+    Creates website records for an instrument from the test data.
+    Args:
+        count: The number of records to create.
+        team_size: The number of experimenters in each record, besides the local contact.
+        seed: The seed for the random number generator.
+    Returns:
+        list[dict]: The records.
+    """
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        record = create_data(
+            str(1000000 + i), TEST_DATE + timedelta(days=rng.randint(0, 99)), rng.randint(1, 10)
+        )
+        record["experimenters"] = [
+            {"name": "User {}".format(j), "organisation": "Org", "role": "User"}
+            for j in rng.sample(range(max(count, team_size)), team_size)
+        ]
+        records.append(record)
+    return records
+
+
+def reformat_experiments_as_dicts(records):
+    """
+    Reformats the experiments the old way, with a dictionary for each row.
+    """
+    return [
+        {
+            Experiment.experimentid: data["rbNumber"],
+            Experiment.startdate: data["scheduledDate"],
+            Experiment.duration: math.ceil(data["timeAllocated"]),
+        }
+        for data in records
+    ]
+
+
+def reformat_experiments_as_tuples(records):
+    """
+    Reformats the experiments the way reformat_data does, with a tuple for each row.
+    """
+    return [
+        ExperimentData(data["rbNumber"], data["scheduledDate"], math.ceil(data["timeAllocated"]))
+        for data in records
+    ]
+
+
+def build_dict_queries(records):
+    experiments = reformat_experiments_as_dicts(records)
+    return [Experiment.insert_many(batch).sql() for batch in chunked(experiments, BATCH_SIZE)]
+
+
+def build_tuple_queries(records):
+    experiments = reformat_experiments_as_tuples(records)
+    return [
+        Experiment.insert_many(batch, fields=EXPERIMENT_FIELDS).sql()
+        for batch in chunked(experiments, BATCH_SIZE)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(), formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    args = parser.parse_args()
+
+    with bind_database(SqliteDatabase(":memory:")):
+        for size in args.sizes:
+            records = create_records(size)
+            dict_time, dict_queries = timed(build_dict_queries, records)
+            tuple_time, tuple_queries = timed(build_tuple_queries, records)
+            assert len(dict_queries) == len(tuple_queries)
+            print(
+                "{:>7} records: dicts {:.3f}s, tuples {:.3f}s, {:.2f}x".format(
+                    size, dict_time, tuple_time, dict_time / tuple_time
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Creates synthetic instrument databases for the benchmarks, seeded so that every run produces the
+same data.
+"""
+
+import os
+import random
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from exp_db_populator.database_model import (
+    Experiment,
+    Experimentteams,
+    Role,
+    User,
+    bind_database,
+)
+from exp_db_populator.populator import AGE_OF_EXPIRATION
+from exp_db_populator.webservices_test_data import create_data
+from peewee import SqliteDatabase, chunked
+
+MODELS = [User, Role, Experiment, Experimentteams]
+ROLES = ["PI", "Contact", "User"]
+
+
+def create_database(path):
+    """
+    Creates an empty SQLite database with the instrument database tables and the usual roles.
+    Args:
+        path: The file to create the database in, any existing file is replaced.
+    Returns:
+        SqliteDatabase: The database.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    database = SqliteDatabase(path, pragmas={"journal_mode": "wal", "foreign_keys": 0})
+    reset_tables(database)
+    return database
+
+
+def reset_tables(database):
+    """
+    Drops and recreates the instrument database tables, leaving just the usual roles.
+    Args:
+        database: The database to reset.
+    """
+    with bind_database(database):
+        database.drop_tables(MODELS)
+        database.create_tables(MODELS)
+        for priority, name in enumerate(ROLES):
+            Role.create(name=name, priority=priority)
+
+
+def seed_database(
+    database, experiments=20000, team_size=4, users=5000, expired_fraction=0.1, seed=0
+):
+    """
+    Fills a database with experiments, users and teams.
+    Args:
+        database: The database to fill.
+        experiments: The number of experiments to create.
+        team_size: The number of users in each experiment's team.
+        users: The number of users to create.
+        expired_fraction: The fraction of experiments that are old enough to be cleaned up.
+        seed: The seed for the random number generator.
+    """
+    rng = random.Random(seed)
+    now = datetime.now().replace(microsecond=0)
+    with bind_database(database), database.atomic():
+        for batch in chunked(range(users), 500):
+            User.insert_many(
+                [("User {}".format(i), "Org {}".format(i % 50)) for i in batch],
+                fields=[User.name, User.organisation],
+            ).execute()
+        user_ids = [userid for (userid,) in User.select(User.userid).tuples()]
+        role_ids = [roleid for (roleid,) in Role.select(Role.roleid).tuples()]
+
+        experiment_rows, team_rows = [], []
+        for i in range(experiments):
+            if rng.random() < expired_fraction:
+                age = rng.randint(AGE_OF_EXPIRATION + 1, 2 * AGE_OF_EXPIRATION)
+            else:
+                age = rng.randint(-AGE_OF_EXPIRATION, AGE_OF_EXPIRATION - 1)
+            start_date = now - timedelta(days=age)
+            rb_number = str(1000000 + i)
+            experiment_rows.append((rb_number, start_date, rng.randint(1, 10)))
+            for user_id in rng.sample(user_ids, team_size):
+                team_rows.append((rb_number, start_date, rng.choice(role_ids), user_id))
+
+        for batch in chunked(experiment_rows, 500):
+            Experiment.insert_many(
+                batch, fields=[Experiment.experimentid, Experiment.startdate, Experiment.duration]
+            ).execute()
+        for batch in chunked(team_rows, 500):
+            Experimentteams.insert_many(
+                batch,
+                fields=[
+                    Experimentteams.experimentid,
+                    Experimentteams.startdate,
+                    Experimentteams.roleid,
+                    Experimentteams.userid,
+                ],
+            ).execute()
+
+
+def count_rows(database):
+    """
+    Counts the rows in each table of a database.
+    Returns:
+        dict: The number of rows keyed by table name.
+    """
+    with bind_database(database):
+        return {model._meta.table_name: model.select().count() for model in MODELS}
+
+
+def timed(function, *args, **kwargs):
+    """
+    Calls a function and times it.
+    Returns:
+        tuple (float, object): The time taken in seconds and the result of the function.
+    """
+    start = perf_counter()
+    result = function(*args, **kwargs)
+    return perf_counter() - start, result
+
+
+def create_web_data(experiments=2000, team_size=4, users=5000, seed=0):
+    """
+    Creates data in the form the website returns it, for a single instrument.
+    Args:
+        experiments: The number of experiments to create.
+        team_size: The number of experimenters in each experiment, besides the local contact.
+        users: The number of distinct users to choose the experimenters from.
+        seed: The seed for the random number generator.
+    Returns:
+        list[dict]: The data.
+    """
+    rng = random.Random(seed)
+    now = datetime.now().replace(microsecond=0)
+    people = [
+        {"name": "User {}".format(i), "organisation": "Org {}".format(i % 50)} for i in range(users)
+    ]
+    contacts = ["Contact {}".format(i) for i in range(20)]
+    data = []
+    for i in range(experiments):
+        data.append(
+            {
+                "instrument": "TEST",
+                "rbNumber": str(1000000 + i),
+                "part": 1,
+                "scheduledDate": now + timedelta(days=rng.randint(-AGE_OF_EXPIRATION, 99)),
+                "timeAllocated": rng.randint(1, 10) + 0.5,
+                "lcName": rng.choice(contacts),
+                "experimenters": [
+                    dict(person, role=rng.choice(ROLES)) for person in rng.sample(people, team_size)
+                ],
+            }
+        )
+    return data
+
+
+def create_schedule(instruments=10, experiments=2000, team_size=4, users=5000, seed=0):
+    """
+    Creates a schedule for several instruments in the form the website returns it, by scaling up
+    the records in webservices_test_data.
+    Args:
+        instruments: The number of instruments in the schedule.
+        experiments: The number of experiments on each instrument.
+        team_size: The number of experimenters in each experiment, besides the local contact.
+        users: The number of distinct users to choose the experimenters from.
+        seed: The seed for the random number generator.
+    Returns:
+        list[dict]: The data, with the instruments interleaved as they are on the website.
+    """
+    rng = random.Random(seed)
+    now = datetime.now().replace(microsecond=0)
+    people = [
+        {"name": "User {}".format(i), "organisation": "Org {}".format(i % 50)} for i in range(users)
+    ]
+    contacts = ["Contact {}".format(i) for i in range(20)]
+    data = []
+    for i in range(experiments):
+        for instrument in range(instruments):
+            record = create_data(
+                str(1000000 + i * instruments + instrument),
+                now + timedelta(days=rng.randint(-AGE_OF_EXPIRATION, 99)),
+                rng.randint(1, 10) + 0.5,
+            )
+            record["instrument"] = get_instrument_name(instrument)
+            record["lcName"] = rng.choice(contacts)
+            record["experimenters"] = [
+                dict(person, role=rng.choice(ROLES)) for person in rng.sample(people, team_size)
+            ]
+            data.append(record)
+    return data
+
+
+def get_instrument_name(index):
+    return "INST{}".format(index)
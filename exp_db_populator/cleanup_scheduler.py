@@ -0,0 +1,99 @@
+from datetime import timedelta
+from time import time
+
+from exp_db_populator.populator import AGE_OF_EXPIRATION
+from exp_db_populator.state_store import StateStore
+
+CLEANUP_INTERVAL = 24 * 60 * 60  # Maximum time in seconds between cleaning up an instrument
+# Time in seconds between checking every experiment and user on an instrument for ones that are no
+# longer referenced, rather than just those in the teams that have expired
+FULL_CLEANUP_INTERVAL = 24 * 60 * 60
+
+
+def expiry_time(start_date):
+    """
+    Gets the time at which an experiment team will be old enough to be removed.
+    Args:
+        start_date (datetime): The start date of the experiment team, or None.
+    Returns:
+        float: The time as a timestamp, or None if there is no start date.
+    """
+    if start_date is None:
+        return None
+    return (start_date + timedelta(days=AGE_OF_EXPIRATION)).timestamp()
+
+
+class CleanupScheduler(StateStore):
+    """
+    Keeps track of when each instrument was last cleaned up and when its oldest experiment team
+    will expire, so that old data is only looked for when there could be some to remove.
+    """
+
+    def is_due(self, instrument_host):
+        """
+        Checks whether an instrument needs cleaning up.
+        Args:
+            instrument_host: The host name of the instrument.
+        Returns:
+            bool: True if the instrument hasn't been cleaned up recently or some of its data has
+                expired since it was.
+        """
+        with self.lock:
+            entry = self.entries.get(instrument_host)
+        if entry is None:
+            return True
+        now = time()
+        expires = entry["expires"]
+        return now - entry["cleaned"] >= CLEANUP_INTERVAL or (
+            expires is not None and now >= expires
+        )
+
+    def is_full_cleanup_due(self, instrument_host):
+        """
+        Checks whether the next cleanup of an instrument should check every experiment and user,
+        so that ones left unreferenced other than by teams expiring are still removed.
+        Args:
+            instrument_host: The host name of the instrument.
+        Returns:
+            bool: True if the instrument hasn't had a full cleanup recently.
+        """
+        with self.lock:
+            entry = self.entries.get(instrument_host)
+        return entry is None or time() - entry.get("full_cleaned", 0) >= FULL_CLEANUP_INTERVAL
+
+    def record_cleanup(self, instrument_host, oldest_start_date, full=False):
+        """
+        Records that an instrument has been cleaned up.
+        Args:
+            instrument_host: The host name of the instrument.
+            oldest_start_date (datetime): The start date of the oldest experiment team left on
+                the instrument, or None if there are none.
+            full: Whether every experiment and user was checked.
+        """
+        now = time()
+        with self.lock:
+            entry = {"cleaned": now, "expires": expiry_time(oldest_start_date)}
+            previous = self.entries.get(instrument_host, {})
+            if full:
+                entry["full_cleaned"] = now
+            elif "full_cleaned" in previous:
+                entry["full_cleaned"] = previous["full_cleaned"]
+            self.entries[instrument_host] = entry
+            self.save()
+
+    def record_start_date(self, instrument_host, start_date):
+        """
+        Records that an experiment team with the given start date has been written to an
+        instrument, in case it will expire before the ones already there.
+        Args:
+            instrument_host: The host name of the instrument.
+            start_date (datetime): The start date of the experiment team.
+        """
+        with self.lock:
+            entry = self.entries.get(instrument_host)
+            if entry is None:
+                return
+            expires = expiry_time(start_date)
+            if entry["expires"] is None or expires < entry["expires"]:
+                entry["expires"] = expires
+                self.save()
@@ -1,13 +1,7 @@
 import logging
 import os
-from datetime import datetime
 from logging.handlers import TimedRotatingFileHandler
 
-from exp_db_populator.webservices_test_data import (
-    TEST_USER_1,
-    create_web_data_with_experimenters_and_other_date,
-)
-
 # Loging must be handled here as some imports might log errors
 log_folder = os.path.join(os.path.dirname(os.path.realpath(__file__)), "logs")
 if not os.path.exists(log_folder):
@@ -23,91 +17,8 @@ logging.basicConfig(
 )
 
 import argparse
-import json
-import threading
-import zlib
-
-import epics
-
-from exp_db_populator.gatherer import Gatherer
-from exp_db_populator.populator import update
-from exp_db_populator.webservices_reader import reformat_data
-
-# PV that contains the instrument list
-INST_LIST_PV = "CS:INSTLIST"
-
-
-def convert_inst_list(value_from_pv):
-    """
-    Converts the instrument list coming from the PV into a dictionary.
-    Args:
-        value_from_pv: The raw value from the PV.
-    Returns:
-        dict: The instrument information.
-    """
-    json_string = zlib.decompress(bytes.fromhex(value_from_pv)).decode("utf-8")
-    return json.loads(json_string)
-
-
-class InstrumentPopulatorRunner:
-    """
-    Responsible for managing the thread that will gather the data and populate each instrument.
-    """
-
-    gatherer = None
-    prev_inst_list = None
-    db_lock = threading.RLock()
-
-    def __init__(self, run_continuous=False):
-        self.run_continuous = run_continuous
-
-    def start_inst_list_monitor(self):
-        logging.info("Setting up monitors on {}".format(INST_LIST_PV))
-        self.inst_list_callback(char_value=epics.caget(INST_LIST_PV, as_string=True))
-        epics.camonitor(INST_LIST_PV, callback=self.inst_list_callback)
-
-    def inst_list_callback(self, char_value, **kw):
-        """
-        Called when the instrument list PV changes value.
-        Args:
-            char_value: The string representation of the PV data.
-            **kw: The module will also send other info about the PV, we capture this and don't
-                use it.
-        """
-        new_inst_list = convert_inst_list(char_value)
-        if new_inst_list != self.prev_inst_list:
-            self.prev_inst_list = new_inst_list
-            self.inst_list_changes(new_inst_list)
-
-    def remove_gatherer(self):
-        """
-        Stops the gatherer and clears the cache.
-        """
-        # Faster if thread is stopped first, then joined after.
-        if self.gatherer is not None:
-            self.gatherer.running = False
-            self.wait_for_gatherer_to_finish()
-            self.gatherer = None
-
-    def inst_list_changes(self, inst_list):
-        """
-        Starts a new gatherer thread.
-        Args:
-            inst_list (list): Information about all instruments.
-        """
-
-        # Easiest way to make sure gatherer is up to date is to restart it
-        self.remove_gatherer()
-
-        new_gatherer = Gatherer(inst_list, self.db_lock, self.run_continuous)
-        new_gatherer.start()
-        self.gatherer = new_gatherer
-
-    def wait_for_gatherer_to_finish(self):
-        """
-        Blocks until gatherer is finished.
-        """
-        self.gatherer.join()
+from datetime import datetime
+from functools import partial
 
 
 def main_cli():
@@ -117,6 +28,12 @@ def main_cli():
         action="store_true",
         help="Runs the populator continually, updating periodically. Otherwise run once.",
     )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Runs the populator continually without the interactive menu, for running as a "
+        "service. SIGTERM stops it and SIGHUP rereads the credentials and instrument list",
+    )
     parser.add_argument(
         "--test_data", action="store_true", help="Puts test data into the local database"
     )
@@ -132,9 +49,112 @@ def main_cli():
     parser.add_argument(
         "--db_pass", type=str, default=None, help="The password to use for writing to the database"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="The number of instruments to update at the same time",
+    )
+    parser.add_argument(
+        "--digest_file",
+        type=str,
+        default=None,
+        help="A file to keep a digest of the data sent to each instrument in, so that "
+        "instruments whose data hasn't changed are not updated on the next run",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Fetches the schedule in windows of dates, only refreshing distant windows "
+        "occasionally. Most useful with --cont",
+    )
+    parser.add_argument(
+        "--cleanup_file",
+        default=None,
+        help="A file to keep track of when each instrument was last cleaned up in, so that old "
+        "data is not looked for on every run",
+    )
+    parser.add_argument(
+        "--upsert",
+        action="store_true",
+        help="Writes new and changed experiments together using INSERT ... ON DUPLICATE KEY "
+        "UPDATE, rather than updating each changed experiment separately",
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        default=None,
+        help="Serves timings and counts for each stage of the populator on this port, in the "
+        "Prometheus text format at /metrics and as JSON at /metrics.json. A POST to "
+        "/refresh?instrument=<name> from this machine updates that instrument straight away "
+        "and /health reports whether the populator is running",
+    )
+    parser.add_argument(
+        "--metrics_host",
+        default="localhost",
+        help="The address to serve the metrics on. Only this machine can reach them by default, "
+        'use "" to serve them on every interface. Refreshes are only accepted from this machine',
+    )
+    parser.add_argument(
+        "--metrics_file",
+        default=None,
+        help="A file to write the timings and counts to as JSON after each cycle",
+    )
+    parser.add_argument(
+        "--metrics_pv",
+        default=None,
+        help="A PV to write the timings and counts to after each cycle, compressed in the same "
+        "way as the instrument list",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Polls the website again 10 minutes after the schedule changes, and less often "
+        "while it stays the same, rather than every hour. It is polled at least hourly while an "
+        "experiment whose start date has just changed is about to start",
+    )
+    parser.add_argument(
+        "--snapshot_file",
+        default=None,
+        help="A file to keep a compressed copy of the last schedule gathered from the website in. "
+        "It is used if the website can't be reached, and to update the instruments straight away "
+        "when starting with --cont",
+    )
     args = parser.parse_args()
-
-    main = InstrumentPopulatorRunner(args.cont)
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.daemon:
+        args.cont = True
+
+    # The rest of the populator, and the web service, database and EPICS libraries it uses, are
+    # only imported now so that e.g. --help isn't held up by them
+    from exp_db_populator.gatherer import DEFAULT_MAX_WORKERS
+    from exp_db_populator.metrics import MetricsServer, metrics, write_json
+    from exp_db_populator.runner import InstrumentPopulatorRunner, publish_metrics_to_pv
+
+    if args.metrics_file:
+        metrics.add_exporter(partial(write_json, args.metrics_file))
+    if args.metrics_pv:
+        metrics.add_exporter(partial(publish_metrics_to_pv, args.metrics_pv))
+
+    main = InstrumentPopulatorRunner(
+        args.cont,
+        DEFAULT_MAX_WORKERS if args.workers is None else args.workers,
+        args.digest_file,
+        args.incremental,
+        args.cleanup_file,
+        args.upsert,
+        args.adaptive,
+        args.snapshot_file,
+    )
+    if args.metrics_port is not None:
+        MetricsServer(
+            metrics,
+            args.metrics_port,
+            args.metrics_host,
+            refresh=main.request_refresh,
+            health=main.get_health,
+        ).start()
     if args.as_instrument:
         debug_inst_list = [
             {"name": args.as_instrument, "hostName": "localhost", "isScheduled": True}
@@ -142,22 +162,36 @@ def main_cli():
         main.prev_inst_list = debug_inst_list
         main.inst_list_changes(debug_inst_list)
     elif args.test_data:
+        from exp_db_populator.populator import update
+        from exp_db_populator.webservices_reader import reformat_data
+        from exp_db_populator.webservices_test_data import (
+            TEST_USER_1,
+            create_web_data_with_experimenters_and_other_date,
+        )
+
         data = [create_web_data_with_experimenters_and_other_date([TEST_USER_1], datetime.now())]
         if not args.db_user or not args.db_pass:
             raise ValueError("Must specify a username and password if using test data")
         update(
             "localhost",
             "localhost",
-            threading.RLock(),
             reformat_data(data),
             credentials=(args.db_user, args.db_pass),
+            upsert=args.upsert,
         )
+    elif args.daemon:
+        from exp_db_populator.daemon import PopulatorDaemon
+
+        PopulatorDaemon(main).run()
     else:
         main.start_inst_list_monitor()
 
         if args.cont:
             running = True
-            menu_string = "Enter U to force update from instrument list or Q to Quit\n "
+            menu_string = (
+                "Enter U to force update from instrument list, R <instrument> to refresh an "
+                "instrument or Q to Quit\n "
+            )
 
             while running:
                 menu_input = input(menu_string).upper()
@@ -167,7 +201,9 @@ def main_cli():
                         main.remove_gatherer()
                         running = False
                     elif menu_input == "U":
-                        main.inst_list_changes(main.prev_inst_list)
+                        main.start_gatherer(main.prev_inst_list)
+                    elif menu_input.startswith("R "):
+                        main.request_refresh(menu_input[2:].strip())
                     else:
                         logging.warning("Command not recognised: {}".format(menu_input))
         else:
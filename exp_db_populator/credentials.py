@@ -0,0 +1,103 @@
+import logging
+import os
+import threading
+
+try:
+    from exp_db_populator.passwords.password_reader import get_credentials as read_credentials
+except ImportError:
+    read_credentials = None
+    logging.warning(
+        "Password submodule not found, will not be able to read from web or write to databases, "
+        "unless username/password are specified manually"
+    )
+
+PASSWORDS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "passwords")
+PASSWORD_FILE_EXTENSION = ".kdbx"
+
+
+def get_password_files_state(folder=PASSWORDS_FOLDER):
+    """
+    Gets the modification times of the password files, which change whenever the credentials
+    stored in them might have.
+    Args:
+        folder: The folder containing the password files.
+    Returns:
+        tuple: The path and modification time of each password file.
+    """
+    state = []
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
+        for name in files:
+            if name.endswith(PASSWORD_FILE_EXTENSION):
+                path = os.path.join(root, name)
+                try:
+                    state.append((path, os.stat(path).st_mtime_ns))
+                except OSError:
+                    pass
+    return tuple(sorted(state))
+
+
+class CredentialsCache:
+    """
+    Keeps the credentials read from the password files, as reading them means decrypting the
+    KeePass database, which is deliberately slow. The credentials are read again if any of the
+    password files change, or if the cache is invalidated.
+    """
+
+    def __init__(self, reader=read_credentials, folder=PASSWORDS_FOLDER):
+        """
+        Args:
+            reader: Called with the group and entry to read credentials from the password files.
+            folder: The folder containing the password files.
+        """
+        self.reader = reader
+        self.folder = folder
+        self.credentials = {}
+        self.files_state = None
+        # Held while reading so that several threads wanting credentials only decrypt once
+        self.lock = threading.Lock()
+
+    def get(self, group, entry):
+        """
+        Gets a username and password.
+        Args:
+            group: The group in the password files containing the entry.
+            entry: The name of the entry.
+        Returns:
+            tuple: The username and password.
+        """
+        with self.lock:
+            files_state = get_password_files_state(self.folder)
+            if files_state != self.files_state:
+                self.credentials.clear()
+                self.files_state = files_state
+
+            if (group, entry) not in self.credentials:
+                if self.reader is None:
+                    raise IOError("Password submodule not found, unable to get credentials")
+                self.credentials[(group, entry)] = self.reader(group, entry)
+            return self.credentials[(group, entry)]
+
+    def invalidate(self):
+        """
+        Forgets all of the credentials so that they are read again when next needed.
+        """
+        with self.lock:
+            self.credentials.clear()
+            self.files_state = None
+
+
+credentials_cache = CredentialsCache()
+
+
+def get_credentials(group, entry):
+    """
+    Gets a username and password from the password files, reading them only if they have changed
+    since they were last read.
+    Args:
+        group: The group in the password files containing the entry.
+        entry: The name of the entry.
+    Returns:
+        tuple: The username and password.
+    """
+    return credentials_cache.get(group, entry)
@@ -0,0 +1,86 @@
+import logging
+import signal
+import threading
+from time import time
+
+from exp_db_populator.metrics import metrics
+
+SHUTDOWN_TIMEOUT = 30  # Time in seconds to wait for the gatherer to stop when shutting down
+RESTART_DELAY = 5 * 60  # Shortest time in seconds between restarts of a gatherer that has stopped
+
+
+class PopulatorDaemon:
+    """
+    Runs the populator continuously without the interactive menu, for running under a service
+    manager. SIGTERM or SIGINT stops it cleanly and SIGHUP reloads the credentials and the
+    instrument list. The gatherer is restarted if it stops unexpectedly.
+    """
+
+    def __init__(self, runner):
+        """
+        Args:
+            runner (exp_db_populator.runner.InstrumentPopulatorRunner): The runner to keep running.
+        """
+        self.runner = runner
+        self.stopping = False
+        self.reload_requested = False
+        self.last_restart = None
+        # Set from the signal handlers to wake up the main thread
+        self.wake = threading.Event()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        # SIGHUP doesn't exist on Windows
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self.handle_reload)
+
+    def handle_stop(self, signum, frame):
+        logging.info("Received signal {}, stopping".format(signum))
+        self.stopping = True
+        self.wake.set()
+
+    def handle_reload(self, signum, frame):
+        logging.info("Received signal {}, reloading".format(signum))
+        self.reload_requested = True
+        self.wake.set()
+
+    def check_gatherer(self):
+        """
+        Restarts the gatherer if it has stopped, e.g. because the website couldn't be reached,
+        waiting at least RESTART_DELAY between restarts.
+        """
+        gatherer = self.runner.gatherer
+        if gatherer is None or gatherer.is_alive() or self.runner.prev_inst_list is None:
+            return
+        if self.last_restart is not None and time() - self.last_restart < RESTART_DELAY:
+            return
+        logging.error("Gatherer stopped unexpectedly, restarting it")
+        metrics.increment("gatherer_restarts")
+        self.last_restart = time()
+        self.runner.start_gatherer(self.runner.prev_inst_list)
+
+    def run(self):
+        """
+        Starts the populator and blocks until it is asked to stop. Must be called from the main
+        thread, as that is where signals are handled.
+        """
+        self.install_signal_handlers()
+        self.runner.start_inst_list_monitor()
+        logging.info("Populator daemon started")
+
+        while not self.stopping:
+            # Signal handlers run between waits, so don't wait for long
+            self.wake.wait(1)
+            self.wake.clear()
+            if self.reload_requested and not self.stopping:
+                self.reload_requested = False
+                try:
+                    self.runner.reload()
+                except Exception:
+                    logging.exception("Unable to reload")
+            if not self.stopping:
+                self.check_gatherer()
+
+        self.runner.stop(SHUTDOWN_TIMEOUT)
+        logging.info("Populator daemon stopped")
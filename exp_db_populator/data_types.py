@@ -1,61 +1,41 @@
-from exp_db_populator.database_model import Role, User
+from collections import namedtuple
+
+from exp_db_populator.database_model import Experiment
 
 # The group in which the credentials are stored
 CREDS_GROUP = "ExpDatabasePopulator"
 
 
-class UserData:
+# The columns of the experiment table, in the order of the values in ExperimentData
+EXPERIMENT_FIELDS = [Experiment.experimentid, Experiment.startdate, Experiment.duration]
+
+
+class ExperimentData(namedtuple("ExperimentData", ["experimentid", "startdate", "duration"])):
     """
-    A class for holding all the data required for a row in the user table.
+    The data for a row in the experiment table, in the column order used to insert it.
     """
 
-    def __init__(self, name, organisation):
-        self.name = name
-        self.organisation = organisation
+    __slots__ = ()
 
-    def __str__(self):
-        return "User {} is from {}".format(self.name, self.organisation)
 
-    @property
-    def user_id(self):
-        """
-        Gets the user id for the user. Will create an entry for the user in
-        the database if one doesn't exist.
+class UserData(namedtuple("UserData", ["name", "organisation"])):
+    """
+    The data required for a row in the user table. Immutable and hashable, so that one record
+    can be shared by every experiment the user is in and users can be collected into sets.
+    """
 
-        Returns: the user's id.
-        """
-        return User.get_or_create(name=self.name, organisation=self.organisation)[0].userid
+    __slots__ = ()
 
-    def __eq__(self, other):
-        return self.name == other.name and self.organisation == other.organisation
+    def __str__(self):
+        return "User {} is from {}".format(self.name, self.organisation)
 
 
-class ExperimentTeamData:
+class ExperimentTeamData(
+    namedtuple("ExperimentTeamData", ["user", "role", "rb_number", "start_date"])
+):
     """
-    A class for holding all the data required for a row in the experiment team table.
+    The data required for a row in the experiment team table. Immutable and hashable, so that
+    teams can be compared as sets.
     """
 
-    def __init__(self, user, role, rb_number, start_date):
-        self.user = user
-        self.role = role
-        self.rb_number = rb_number
-        self.start_date = start_date
-
-    @property
-    def role_id(self):
-        """
-        Gets the role id for the user based on the roles in the database.
-        Will raise an exception if role is not found.
-
-        Returns: the role id.
-
-        """
-        return Role.get(Role.name == self.role).roleid
-
-    def __eq__(self, other):
-        return (
-            self.user == other.user
-            and self.role == other.role
-            and self.rb_number == other.rb_number
-            and self.start_date == other.start_date
-        )
+    __slots__ = ()
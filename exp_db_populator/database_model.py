@@ -1,3 +1,6 @@
+import threading
+from contextlib import contextmanager
+
 from peewee import (
     AutoField,
     CharField,
@@ -9,9 +12,45 @@ from peewee import (
     Proxy,
 )
 
+
+class ThreadLocalProxy(Proxy):
+    """
+    A proxy whose underlying database is set per thread. This allows several threads to each
+    write to a different instrument database at the same time.
+    """
+
+    def __init__(self):
+        object.__setattr__(self, "_local", threading.local())
+        super().__init__()
+
+    @property
+    def obj(self):
+        return getattr(self._local, "obj", None)
+
+    @obj.setter
+    def obj(self, value):
+        self._local.obj = value
+
+
 # Model built using peewiz
 
-database_proxy = Proxy()
+database_proxy = ThreadLocalProxy()
+
+
+@contextmanager
+def bind_database(database):
+    """
+    Binds the models to a database for the current thread only, for the duration of the context.
+    Args:
+        database: The database to bind to, if None the current binding is used.
+    """
+    previous_database = database_proxy.obj
+    if database is not None:
+        database_proxy.initialize(database)
+    try:
+        yield
+    finally:
+        database_proxy.initialize(previous_database)
 
 
 class BaseModel(Model):
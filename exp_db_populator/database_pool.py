@@ -0,0 +1,117 @@
+import logging
+import threading
+from time import time
+
+from playhouse.pool import PooledMySQLDatabase
+
+from exp_db_populator.populator import DB_CONNECT_TIMEOUT, POLLING_TIME, create_database
+
+# Maximum number of connections to keep open to each instrument. An instrument is updated and
+# cleaned up one after the other, so one connection is enough.
+CONNECTIONS_PER_HOST = 1
+# Maximum number of connections to keep open across all instruments. This is well above the number
+# of scheduled instruments, as every cycle visits the instruments in the same order, so evicting
+# the least recently used one would close each instrument's connection before it is used again.
+MAX_CONNECTIONS = 128
+# Time in seconds after which a connection is replaced. This is kept well below MySQL's default
+# wait_timeout of 8 hours so that the server doesn't close connections before they are reused.
+STALE_TIMEOUT = 4 * 60 * 60
+IDLE_TIMEOUT = 2 * POLLING_TIME  # Time in seconds after which an unused instrument is forgotten
+
+
+class DatabasePool:
+    """
+    Keeps a pool of connections to each instrument's database, so that connecting and
+    authenticating is done once rather than on every update. Connections are checked with a
+    ping before they are reused and are replaced once they are old.
+    """
+
+    def __init__(
+        self,
+        credentials=None,
+        connections_per_host=CONNECTIONS_PER_HOST,
+        max_connections=MAX_CONNECTIONS,
+    ):
+        """
+        Args:
+            credentials: The credentials to write to the databases with, in the form
+                (user, password). If None then the credentials are received from the stored git
+                repo.
+            connections_per_host: The maximum number of connections to each instrument.
+            max_connections: The maximum number of connections across all instruments.
+        """
+        self.credentials = credentials
+        self.connections_per_host = connections_per_host
+        self.max_hosts = max(1, max_connections // connections_per_host)
+        self.databases = {}
+        self.last_used = {}
+        self.lock = threading.Lock()
+
+    def get(self, instrument_host):
+        """
+        Gets the pooled database for an instrument, creating it if needed.
+        Args:
+            instrument_host: The host name of the instrument.
+        Returns:
+            PooledMySQLDatabase: The database.
+        """
+        with self.lock:
+            database = self.databases.get(instrument_host)
+            if database is None:
+                if len(self.databases) >= self.max_hosts:
+                    least_recently_used = min(self.last_used, key=self.last_used.get)
+                    self.remove(least_recently_used)
+                database = create_database(
+                    instrument_host,
+                    self.credentials,
+                    database_class=PooledMySQLDatabase,
+                    max_connections=self.connections_per_host,
+                    stale_timeout=STALE_TIMEOUT,
+                    timeout=DB_CONNECT_TIMEOUT,
+                )
+                self.databases[instrument_host] = database
+            self.last_used[instrument_host] = time()
+            return database
+
+    def remove(self, instrument_host):
+        """
+        Closes the idle connections to an instrument and forgets about it. Should be called with
+        the lock held.
+        Args:
+            instrument_host: The host name of the instrument.
+        """
+        logging.info("Closing connections to {}".format(instrument_host))
+        del self.last_used[instrument_host]
+        database = self.databases.pop(instrument_host)
+        database.close_idle()
+
+    def discard(self, instrument_host):
+        """
+        Closes the idle connections to an instrument that is no longer needed, if there are any.
+        Args:
+            instrument_host: The host name of the instrument.
+        """
+        with self.lock:
+            if instrument_host in self.databases:
+                self.remove(instrument_host)
+
+    def remove_idle(self, idle_timeout=IDLE_TIMEOUT):
+        """
+        Closes the connections to instruments that haven't been used recently, for example
+        because they are no longer scheduled.
+        Args:
+            idle_timeout: The time in seconds since an instrument was last used.
+        """
+        with self.lock:
+            cutoff = time() - idle_timeout
+            for instrument_host, last_used in list(self.last_used.items()):
+                if last_used < cutoff:
+                    self.remove(instrument_host)
+
+    def close_all(self):
+        """
+        Closes all idle connections to all instruments.
+        """
+        with self.lock:
+            for instrument_host in list(self.databases):
+                self.remove(instrument_host)
@@ -0,0 +1,80 @@
+import hashlib
+import json
+from time import time
+
+from exp_db_populator.state_store import StateStore
+
+# Time in seconds after which an instrument is updated even if its data hasn't changed, so that an
+# instrument database that has been wiped, restored or edited by hand is put right
+FORCE_UPDATE_INTERVAL = 24 * 60 * 60
+
+
+def compute_digest(instrument_data):
+    """
+    Computes a digest of an instrument's data that is the same whenever the data is the same,
+    regardless of the order it came from the website in.
+    Args:
+        instrument_data: The reformatted experiments and experiment teams, or None if there is no
+            data for the instrument.
+    Returns:
+        str: The digest of the data.
+    """
+    if instrument_data is None:
+        return None
+
+    experiments, experiment_teams = instrument_data
+    experiment_rows = sorted(
+        [
+            str(exp.experimentid),
+            str(exp.startdate),
+            str(exp.duration),
+        ]
+        for exp in experiments
+    )
+    team_rows = sorted(
+        [
+            str(exp_team.rb_number),
+            str(exp_team.start_date),
+            str(exp_team.role),
+            str(exp_team.user.name),
+            str(exp_team.user.organisation),
+        ]
+        for exp_team in experiment_teams
+    )
+    serialised = json.dumps([experiment_rows, team_rows], separators=(",", ":"))
+    return hashlib.sha256(serialised.encode("utf-8")).hexdigest()
+
+
+class DigestStore(StateStore):
+    """
+    Keeps track of the digest of the data last sent to each instrument, so that instruments whose
+    data hasn't changed don't need to be written to.
+    """
+
+    def needs_update(self, instrument_host, digest):
+        """
+        Checks whether an instrument needs to be written to.
+        Args:
+            instrument_host: The host name of the instrument.
+            digest: The digest of the data that would be sent to the instrument.
+        Returns:
+            bool: True if the data has changed or the instrument hasn't been updated recently.
+        """
+        with self.lock:
+            entry = self.entries.get(instrument_host)
+        return (
+            entry is None
+            or entry["digest"] != digest
+            or time() - entry["updated"] > FORCE_UPDATE_INTERVAL
+        )
+
+    def record_update(self, instrument_host, digest):
+        """
+        Records that an instrument has been updated successfully.
+        Args:
+            instrument_host: The host name of the instrument.
+            digest: The digest of the data that was sent to the instrument.
+        """
+        with self.lock:
+            self.entries[instrument_host] = {"digest": digest, "updated": time()}
+            self.save()
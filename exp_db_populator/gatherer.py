@@ -1,11 +1,20 @@
 import logging
+import queue
 import threading
-from time import sleep
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+from time import time
 
-from exp_db_populator.populator import update
+from exp_db_populator.cleanup_scheduler import CleanupScheduler
+from exp_db_populator.digest_store import DigestStore, compute_digest
+from exp_db_populator.metrics import metrics
+from exp_db_populator.populator import cleanup, update
 from exp_db_populator.webservices_reader import gather_data, reformat_data
 
 POLLING_TIME = 3600  # Time in seconds between polling the website
+DEFAULT_MAX_WORKERS = 8  # Number of instruments to update at the same time
+UPDATE_TIMEOUT = 900  # Time in seconds to wait for all instruments to be updated or cleaned up
 
 
 def correct_name(old_name):
@@ -19,62 +28,464 @@ def correct_name(old_name):
     return "ENGIN-X" if old_name == "ENGINX" else old_name
 
 
-def filter_instrument_data(raw_data, inst_name):
+def index_by_instrument(raw_data):
     """
-    Gets the data associated with the specified instrument.
+    Groups all of the data by instrument in a single pass, so that each instrument's data can
+    then be looked up without scanning all of the data again.
     Args:
         raw_data: All of the raw data from the website
-        inst_name: The name of the instrument whose data you want to get
+    Returns:
+        dict: The data associated with each instrument, keyed by the web name of the instrument
+    """
+    data_index = defaultdict(list)
+    for data in raw_data:
+        data_index[data["instrument"]].append(data)
+    return dict(data_index)
+
+
+def get_instrument_data(data_index, inst_name):
+    """
+    Gets the data associated with the specified instrument from the indexed data.
+    Args:
+        data_index: All of the data from the website, indexed by instrument
+        inst_name: The IBEX name of the instrument whose data you want to get
     Returns:
         list: The data associated with the specified instrument
     """
-    return [x for x in raw_data if x["instrument"] == inst_name]
+    return data_index.get(correct_name(inst_name), [])
+
+
+def log_results(description, start_time, instrument_count, failed, timed_out):
+    """
+    Logs how a task went across all of the instruments.
+    Args:
+        description: A description of the task.
+        start_time: The time the task was started.
+        instrument_count: The number of instruments the task was run for.
+        failed (list[str]): The names of the instruments the task failed for.
+        timed_out (list[str]): The names of the instruments the task timed out for.
+    """
+    succeeded = instrument_count - len(failed) - len(timed_out)
+    logging.info(
+        "{} took {:.1f} seconds: {} of {} instruments succeeded".format(
+            description, time() - start_time, succeeded, instrument_count
+        )
+    )
+    if failed:
+        logging.warning("{} failed for: {}".format(description, ", ".join(failed)))
+    if timed_out:
+        logging.warning("{} timed out for: {}".format(description, ", ".join(timed_out)))
+
+
+def get_scheduled_hosts(inst_list):
+    """
+    Args:
+        inst_list (list): Information about all instruments.
+    Returns:
+        set: The host names of the scheduled instruments.
+    """
+    return {inst["hostName"] for inst in inst_list if inst["isScheduled"]}
 
 
 class Gatherer(threading.Thread):
     """
     An instance of this class runs on a thread in the background.
-    Every hour, it gathers data from the website and sends it to all of the instruments.
+    Every hour, or as often as its poll scheduler decides, it gathers data from the website and
+    sends it to all of the instruments.
     """
 
     running = True
 
-    def __init__(self, inst_list, db_lock, run_continuous=False):
+    def __init__(
+        self,
+        inst_list,
+        run_continuous=False,
+        max_workers=DEFAULT_MAX_WORKERS,
+        digest_store=None,
+        schedule_cache=None,
+        cleanup_scheduler=None,
+        upsert=False,
+        database_pool=None,
+        poll_scheduler=None,
+        snapshot=None,
+    ):
         threading.Thread.__init__(self)
         self.daemon = True
         self.inst_list = inst_list
         self.run_continuous = run_continuous
-        self.db_lock = db_lock
+        self.max_workers = max_workers
+        self.digest_store = digest_store if digest_store is not None else DigestStore()
+        self.schedule_cache = schedule_cache
+        self.cleanup_scheduler = (
+            cleanup_scheduler if cleanup_scheduler is not None else CleanupScheduler()
+        )
+        self.upsert = upsert
+        self.database_pool = database_pool
+        self.poll_scheduler = poll_scheduler
+        self.snapshot = snapshot
+        # Things to do on this thread before the next cycle, None to start it straight away
+        self.pending_tasks = queue.Queue()
+        # The data gathered in the last cycle, for updating newly scheduled instruments
+        self.last_data = None
+        # Tasks that timed out but may still be writing to an instrument, keyed by its host name
+        self.unfinished_tasks = {}
         logging.info("Starting gatherer")
 
+    def get_database(self, instrument_host):
+        """
+        Gets the pooled database for an instrument.
+        Args:
+            instrument_host: The host name of the instrument.
+        Returns:
+            The database, or None if connections aren't being pooled.
+        """
+        if self.database_pool is None:
+            return None
+        return self.database_pool.get(instrument_host)
+
+    def update_instrument(self, inst, data_index, force=False):
+        """
+        Sends the relevant data to a single instrument.
+        Args:
+            inst: The information about the instrument, as given in the instrument list.
+            data_index: All of the data from the website, indexed by instrument.
+            force: Whether to update the instrument even if its data hasn't changed.
+        Returns:
+            bool: True if the instrument was updated successfully, False otherwise.
+        """
+        name, host = correct_name(inst["name"]), inst["hostName"]
+        instrument_list = get_instrument_data(data_index, inst["name"])
+        if not instrument_list:
+            logging.error(
+                f"Unable to update {name}, no data found. Expired data will still be cleared."
+            )
+            return True
+
+        with metrics.timer("reformat", instrument=name):
+            data_to_populate = reformat_data(instrument_list)
+        digest = compute_digest(data_to_populate)
+        if not force and not self.digest_store.needs_update(host, digest):
+            logging.info("{} data has not changed, skipping update".format(name))
+            metrics.increment("updates_skipped", instrument=name)
+            return True
+
+        try:
+            success = update(
+                name,
+                host,
+                data_to_populate,
+                self.run_continuous,
+                upsert=self.upsert,
+                database=self.get_database(host),
+            )
+        except Exception as e:
+            metrics.increment("failures", stage="update", instrument=name)
+            logging.error("Unable to connect to {}: {}".format(name, e))
+            success = False
+        if success:
+            self.digest_store.record_update(host, digest)
+            experiments = data_to_populate[0]
+            self.cleanup_scheduler.record_start_date(
+                host, min(exp.startdate for exp in experiments)
+            )
+        else:
+            # It's not known what is in the database now, so make sure it is written next time
+            self.digest_store.forget(host)
+        return success
+
+    def cleanup_instrument(self, inst):
+        """
+        Removes old data from a single instrument.
+        Args:
+            inst: The information about the instrument, as given in the instrument list.
+        Returns:
+            bool: True if the instrument was cleaned up successfully, False otherwise.
+        """
+        name, host = correct_name(inst["name"]), inst["hostName"]
+        full = self.cleanup_scheduler.is_full_cleanup_due(host)
+        try:
+            oldest_start_date = cleanup(name, host, database=self.get_database(host), full=full)
+        except Exception:
+            metrics.increment("failures", stage="cleanup", instrument=name)
+            logging.exception("Unable to clean up {}".format(name))
+            self.digest_store.forget(host)
+            return False
+        self.cleanup_scheduler.record_cleanup(host, oldest_start_date, full)
+        return True
+
+    def run_for_instruments(self, task, instruments, description):
+        """
+        Runs a task for each instrument on a pool of workers, so that one slow or unreachable
+        instrument does not hold up the others.
+        Args:
+            task: Called with each instrument, returns True if it succeeded.
+            instruments: The instruments to run the task for.
+            description: A description of the task for logging.
+        """
+        start_time = time()
+        instruments = self.remove_busy_instruments(instruments, description)
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        tasks = {executor.submit(task, inst): inst for inst in instruments}
+        done, not_done = wait(tasks, timeout=UPDATE_TIMEOUT)
+        # Don't wait for any stuck tasks, they will be timed out by the database connection
+        executor.shutdown(wait=False)
+        self.finish_tasks(description, start_time, tasks, done, not_done)
+
+    def remove_busy_instruments(self, instruments, description):
+        """
+        Leaves out the instruments that are still running a task that timed out earlier, so that
+        two tasks are never writing to the same instrument at the same time.
+        Args:
+            instruments: The instruments to run a task for.
+            description: A description of the task for logging.
+        Returns:
+            list: The instruments that aren't busy.
+        """
+        self.unfinished_tasks = {
+            host: future for host, future in self.unfinished_tasks.items() if not future.done()
+        }
+        busy = sorted(
+            correct_name(inst["name"])
+            for inst in instruments
+            if inst["hostName"] in self.unfinished_tasks
+        )
+        if busy:
+            logging.warning(
+                "{} skipped for instruments still busy from before: {}".format(
+                    description, ", ".join(busy)
+                )
+            )
+            metrics.increment("instruments_busy", len(busy))
+        return [inst for inst in instruments if inst["hostName"] not in self.unfinished_tasks]
+
+    def finish_tasks(self, description, start_time, tasks, done, not_done):
+        """
+        Logs how the task went for each instrument. Tasks that raised are counted as failed, and
+        tasks that timed out and can't be cancelled are remembered so that their instrument is left
+        alone until they finish.
+        Args:
+            description: A description of the task for logging.
+            start_time: The time the tasks were started.
+            tasks (dict): The instrument each task was run for, keyed by the future of the task.
+            done: The futures of the tasks that finished.
+            not_done: The futures of the tasks that timed out.
+        """
+        failed = []
+        for future in done:
+            name = correct_name(tasks[future]["name"])
+            if future.exception() is not None:
+                logging.error(
+                    "{} failed for {}".format(description, name), exc_info=future.exception()
+                )
+                failed.append(name)
+            elif not future.result():
+                failed.append(name)
+        for future in not_done:
+            if not future.cancel():
+                self.unfinished_tasks[tasks[future]["hostName"]] = future
+        timed_out = sorted(correct_name(tasks[future]["name"]) for future in not_done)
+        log_results(description, start_time, len(tasks), sorted(failed), timed_out)
+
+    def update_instruments(self, all_data):
+        """
+        Sends the data to all scheduled instruments, then cleans up the instruments that are due
+        it. Cleaning up is done separately so that it doesn't slow down the updates.
+        Args:
+            all_data: All of the raw data from the website.
+        """
+        scheduled = [inst for inst in self.inst_list if inst["isScheduled"]]
+        data_index = index_by_instrument(all_data)
+        with metrics.timer("update_cycle"):
+            self.run_for_instruments(
+                partial(self.update_instrument, data_index=data_index), scheduled, "Update cycle"
+            )
+
+        due = [inst for inst in scheduled if self.cleanup_scheduler.is_due(inst["hostName"])]
+        if due:
+            with metrics.timer("cleanup_cycle"):
+                self.run_for_instruments(self.cleanup_instrument, due, "Cleanup")
+
+    def gather_all_data(self):
+        """
+        Gets all of the data from the website, using the schedule cache if there is one.
+        Returns:
+            list: All of the raw data from the website.
+        """
+        try:
+            with metrics.timer("gather"):
+                if self.schedule_cache is not None:
+                    all_data = self.schedule_cache.gather_data()
+                else:
+                    all_data = list(gather_data())
+        except Exception:
+            all_data = self.snapshot.load() if self.snapshot is not None else None
+            if all_data is None:
+                raise
+            logging.exception("Unable to gather data from the website, using the last snapshot")
+            metrics.increment("snapshot_used")
+        else:
+            if self.snapshot is not None:
+                self.snapshot.save(all_data)
+        self.last_data = all_data
+        return all_data
+
+    def warm_start(self):
+        """
+        Updates the instruments from the snapshot of the last schedule gathered, if there is one,
+        so that they are up to date before the website has responded.
+        """
+        if self.snapshot is None:
+            return
+        all_data = self.snapshot.load()
+        if all_data is None:
+            return
+        self.last_data = all_data
+        scheduled = [inst for inst in self.inst_list if inst["isScheduled"]]
+        self.run_for_instruments(
+            partial(self.update_instrument, data_index=index_by_instrument(all_data)),
+            scheduled,
+            "Update from snapshot",
+        )
+
+    def finish_cycle(self):
+        """
+        Tidies up after a cycle and publishes its metrics.
+        """
+        if self.database_pool is not None:
+            self.database_pool.remove_idle()
+        metrics.set("last_cycle_time", time())
+        metrics.export()
+
+    def get_poll_interval(self, all_data):
+        """
+        Gets how long to wait before the next cycle.
+        Args:
+            all_data: All of the raw data from the website in this cycle.
+        Returns:
+            float: The time in seconds to wait.
+        """
+        if self.poll_scheduler is None:
+            return POLLING_TIME
+        return self.poll_scheduler.next_interval(all_data)
+
+    def request_refresh(self, inst_name=None):
+        """
+        Asks for an instrument to be updated straight away, rather than waiting for the next
+        cycle. Can be called from any thread.
+        Args:
+            inst_name: The IBEX name of the instrument to update, if None the next cycle is
+                started instead.
+        """
+        self.pending_tasks.put(
+            None if inst_name is None else partial(self.refresh_instrument, inst_name)
+        )
+
+    def refresh_instrument(self, inst_name):
+        """
+        Gathers the latest data and sends it to a single instrument, whether or not it has
+        changed.
+        Args:
+            inst_name: The IBEX name of the instrument to update.
+        Returns:
+            bool: True if the instrument was updated successfully, False otherwise.
+        """
+        matching = [
+            inst
+            for inst in self.inst_list
+            if inst["isScheduled"] and inst["name"].upper() == inst_name.upper()
+        ]
+        if not matching:
+            logging.warning(
+                "Unable to refresh {}, it is not a scheduled instrument".format(inst_name)
+            )
+            return False
+
+        logging.info("Refreshing {}".format(inst_name))
+        try:
+            data_index = index_by_instrument(self.gather_all_data())
+        except Exception:
+            logging.exception("Unable to refresh {}".format(inst_name))
+            return False
+        return all(self.update_instrument(inst, data_index, force=True) for inst in matching)
+
+    def set_inst_list(self, inst_list):
+        """
+        Changes the instruments that data is sent to, without starting a new cycle. Newly
+        scheduled instruments are updated from the data gathered in the last cycle, rather than
+        gathering it all again, and instruments that are no longer scheduled are forgotten. Can be
+        called from any thread.
+        Args:
+            inst_list (list): Information about all instruments.
+        """
+        old_hosts = get_scheduled_hosts(self.inst_list)
+        self.inst_list = inst_list
+        new_hosts = get_scheduled_hosts(inst_list)
+
+        for host in old_hosts - new_hosts:
+            logging.info("{} is no longer scheduled".format(host))
+            self.digest_store.forget(host)
+            if self.database_pool is not None:
+                self.database_pool.discard(host)
+
+        added = [
+            inst
+            for inst in inst_list
+            if inst["isScheduled"] and inst["hostName"] in new_hosts - old_hosts
+        ]
+        if added:
+            self.pending_tasks.put(partial(self.update_from_last_data, added))
+
+    def update_from_last_data(self, instruments):
+        """
+        Sends the data gathered in the last cycle to some instruments.
+        Args:
+            instruments: The instruments to update.
+        """
+        if self.last_data is None:
+            logging.info(
+                "No data has been gathered yet, new instruments will be updated next cycle"
+            )
+            return
+        data_index = index_by_instrument(self.last_data)
+        self.run_for_instruments(
+            partial(self.update_instrument, data_index=data_index),
+            instruments,
+            "Update of newly scheduled instruments",
+        )
+
+    def wait_for_next_cycle(self, interval):
+        """
+        Waits until the next cycle is due, doing anything that is asked for in the meantime such
+        as refreshing an instrument.
+        Args:
+            interval: The time in seconds to wait.
+        """
+        deadline = time() + interval
+        while self.running:
+            remaining = deadline - time()
+            if remaining <= 0:
+                return
+            try:
+                task = self.pending_tasks.get(timeout=min(1, remaining))
+            except queue.Empty:
+                continue
+            if task is None:
+                logging.info("Starting the next cycle early as requested")
+                return
+            task()
+
     def run(self):
         """
         Periodically runs to gather new data and populate the databases.
         """
+        if self.run_continuous:
+            self.warm_start()
         while self.running:
-            all_data = gather_data()
-
-            for inst in self.inst_list:
-                if inst["isScheduled"]:
-                    name, host = correct_name(inst["name"]), inst["hostName"]
-                    instrument_list = filter_instrument_data(all_data, name)
-                    if not instrument_list:
-                        logging.error(
-                            f"Unable to update {name}, no data found. "
-                            f"Expired data will still be cleared."
-                        )
-                        data_to_populate = None
-                    else:
-                        data_to_populate = reformat_data(instrument_list)
-                    try:
-                        update(name, host, self.db_lock, data_to_populate, self.run_continuous)
-                    except Exception as e:
-                        logging.error("Unable to connect to {}: {}".format(name, e))
-
-            if self.run_continuous:
-                for i in range(POLLING_TIME):
-                    sleep(1)
-                    if not self.running:
-                        return
-            else:
+            with metrics.timer("cycle"):
+                all_data = self.gather_all_data()
+                self.update_instruments(all_data)
+            self.finish_cycle()
+
+            if not self.run_continuous:
                 break
+            self.wait_for_next_cycle(self.get_poll_interval(all_data))
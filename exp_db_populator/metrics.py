@@ -0,0 +1,312 @@
+import ipaddress
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter, time
+from urllib.parse import parse_qs, urlsplit
+
+METRIC_PREFIX = "exp_db_populator_"
+
+
+def format_labels(labels):
+    """
+    Formats the labels of a metric in the Prometheus text format, e.g. {instrument="LARMOR"}.
+    Args:
+        labels (tuple): The (name, value) pairs of the labels.
+    Returns:
+        str: The formatted labels, or an empty string if there are none.
+    """
+    if not labels:
+        return ""
+    return "{{{}}}".format(
+        ",".join(
+            '{}="{}"'.format(
+                name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            )
+            for name, value in labels
+        )
+    )
+
+
+class Metrics:
+    """
+    Collects the counters, gauges and timings of each stage of the populator, so that it can be
+    seen where the time in each cycle goes. Metrics can have labels, e.g. the instrument they are
+    for.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(int)  # Keyed by (name, labels)
+        self.gauges = {}  # Keyed by (name, labels)
+        self.timings = {}  # The count, total and last duration, keyed by (name, labels)
+        self.exporters = []
+
+    def increment(self, name, amount=1, **labels):
+        """
+        Adds to a counter.
+        Args:
+            name: The name of the counter.
+            amount: The amount to add.
+            labels: The labels of the counter.
+        """
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def set(self, name, value, **labels):
+        """
+        Sets a gauge.
+        Args:
+            name: The name of the gauge.
+            value: The value to set.
+            labels: The labels of the gauge.
+        """
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def get(self, name, **labels):
+        """
+        Gets the value of a gauge.
+        Args:
+            name: The name of the gauge.
+            labels: The labels of the gauge.
+        Returns:
+            The value of the gauge, or None if it hasn't been set.
+        """
+        with self.lock:
+            return self.gauges.get((name, tuple(sorted(labels.items()))))
+
+    def observe(self, name, seconds, **labels):
+        """
+        Records how long something took.
+        Args:
+            name: The name of the timing.
+            seconds: The time it took.
+            labels: The labels of the timing.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            count, total, _ = self.timings.get(key, (0, 0.0, 0.0))
+            self.timings[key] = (count + 1, total + seconds, seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Times the code within the context, whether or not it raises.
+        Args:
+            name: The name of the timing.
+            labels: The labels of the timing.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start, **labels)
+
+    def record_counts(self, counts, **labels):
+        """
+        Adds each of a dictionary of counts to a counter of the same name, e.g. the rows
+        changed by populate.
+        """
+        for name, count in counts.items():
+            self.increment(name, count, **labels)
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timings.clear()
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: A copy of all the metrics, in a form that can be written as JSON.
+        """
+
+        def entry(key, **values):
+            name, labels = key
+            return dict(name=name, labels=dict(labels), **values)
+
+        with self.lock:
+            return {
+                "timestamp": time(),
+                "counters": [entry(key, value=value) for key, value in self.counters.items()],
+                "gauges": [entry(key, value=value) for key, value in self.gauges.items()],
+                "timings": [
+                    entry(key, count=count, total=total, last=last)
+                    for key, (count, total, last) in self.timings.items()
+                ],
+            }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=4, sort_keys=True)
+
+    def to_prometheus(self):
+        """
+        Returns:
+            str: All the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+
+        def add(name, metric_type, samples):
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            for suffix, labels, value in sorted(samples, key=lambda sample: sample[:2]):
+                lines.append("{}{}{} {}".format(name, suffix, format_labels(labels), value))
+
+        def grouped(metrics):
+            groups = defaultdict(list)
+            for (name, labels), value in metrics.items():
+                groups[name].append((labels, value))
+            return sorted(groups.items())
+
+        with self.lock:
+            for name, samples in grouped(self.counters):
+                add(
+                    METRIC_PREFIX + name + "_total",
+                    "counter",
+                    [("", labels, value) for labels, value in samples],
+                )
+            for name, samples in grouped(self.gauges):
+                add(
+                    METRIC_PREFIX + name,
+                    "gauge",
+                    [("", labels, value) for labels, value in samples],
+                )
+            for name, samples in grouped(self.timings):
+                add(
+                    METRIC_PREFIX + name + "_seconds",
+                    "summary",
+                    [("_count", labels, count) for labels, (count, _, _) in samples]
+                    + [("_sum", labels, total) for labels, (_, total, _) in samples],
+                )
+                add(
+                    METRIC_PREFIX + name + "_last_seconds",
+                    "gauge",
+                    [("", labels, last) for labels, (_, _, last) in samples],
+                )
+        return "\n".join(lines) + "\n"
+
+    def add_exporter(self, exporter):
+        """
+        Adds something to send the metrics to at the end of each cycle.
+        Args:
+            exporter: Called with these metrics.
+        """
+        self.exporters.append(exporter)
+
+    def export(self):
+        """
+        Sends the metrics to each of the exporters, logging rather than raising any errors.
+        """
+        for exporter in self.exporters:
+            try:
+                exporter(self)
+            except Exception:
+                logging.exception("Unable to export metrics")
+
+
+def write_json(file_path, registry):
+    """
+    Writes metrics to a JSON file, replacing the file in one go so that it is never read half
+    written.
+    Args:
+        file_path: The file to write to.
+        registry (Metrics): The metrics to write.
+    """
+    temp_path = file_path + ".tmp"
+    with open(temp_path, "w") as f:
+        f.write(registry.to_json())
+    os.replace(temp_path, file_path)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the metrics in the Prometheus text format at /metrics and as JSON at /metrics.json. A
+    POST to /refresh?instrument=<name> asks for that instrument to be updated straight away, or
+    without an instrument for the next cycle to be started, and is only accepted from this machine.
+    /health reports whether the populator is keeping the instruments up to date, with a 503 if it
+    isn't.
+    """
+
+    def do_GET(self):
+        registry = self.server.registry
+        path = urlsplit(self.path).path
+        if path == "/metrics":
+            self.send_body(registry.to_prometheus(), "text/plain; version=0.0.4")
+        elif path == "/metrics.json":
+            self.send_body(registry.to_json(), "application/json")
+        elif path == "/health" and self.server.health is not None:
+            healthy, details = self.server.health()
+            details = dict(details, healthy=healthy)
+            self.send_body(json.dumps(details), "application/json", status=200 if healthy else 503)
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path == "/refresh" and self.server.refresh is not None:
+            # Refreshing writes to the instrument databases, so only allow it from this machine
+            if not ipaddress.ip_address(self.client_address[0]).is_loopback:
+                self.send_error(403)
+                return
+            inst_name = parse_qs(url.query).get("instrument", [None])[0]
+            logging.info("Refresh of {} requested over HTTP".format(inst_name or "all instruments"))
+            self.server.refresh(inst_name)
+            self.send_body("Refresh requested\n", "text/plain", status=202)
+        else:
+            self.send_error(404)
+
+    def send_body(self, body, content_type, status=200):
+        encoded = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type + "; charset=utf-8")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        logging.debug("Metrics request: " + format % args)
+
+
+class MetricsServer:
+    """
+    Serves the metrics over HTTP from a background thread.
+    """
+
+    def __init__(self, registry, port, host="localhost", refresh=None, health=None):
+        """
+        Args:
+            registry (Metrics): The metrics to serve.
+            port: The port to listen on, 0 picks a free one.
+            host: The address to listen on, only this machine by default. "" listens on all of them.
+            refresh: Called with the name of an instrument, or None, when a refresh is requested.
+                If None refreshes can't be requested.
+            health: Returns whether the populator is healthy and a dictionary of details about it.
+                If None there is no health endpoint.
+        """
+        self.http_server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.http_server.daemon_threads = True
+        self.http_server.registry = registry
+        self.http_server.refresh = refresh
+        self.http_server.health = health
+        self.thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.http_server.server_address[1]
+
+    def start(self):
+        logging.info("Serving metrics on port {}".format(self.port))
+        self.thread.start()
+
+    def stop(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+
+# The metrics shared by every part of the populator
+metrics = Metrics()
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+
+from exp_db_populator.populator import POLLING_TIME
+
+MIN_POLL_INTERVAL = 10 * 60  # Time in seconds between polls after the schedule has changed
+BASE_POLL_INTERVAL = POLLING_TIME  # Shortest time in seconds between polls when nothing changes
+MAX_POLL_INTERVAL = 2 * POLLING_TIME  # Longest time in seconds between polls when nothing changes
+BACKOFF_FACTOR = 2  # How much longer to wait each time the schedule is found unchanged
+# Don't back off while an experiment whose start date has just changed starts within this time
+NEAR_START_WINDOW = timedelta(hours=6)
+
+
+def compute_payload_digest(raw_data):
+    """
+    Computes a digest of all of the data from the website, that is the same whenever the data is
+    the same regardless of the order it came in.
+    Args:
+        raw_data: All of the raw data from the website.
+    Returns:
+        str: The digest of the data.
+    """
+    rows = sorted(json.dumps(data, sort_keys=True, default=str) for data in raw_data)
+    return hashlib.sha256("\n".join(rows).encode("utf-8")).hexdigest()
+
+
+def get_start_dates(raw_data):
+    """
+    Gets when each experiment in the schedule starts.
+    Args:
+        raw_data: All of the raw data from the website.
+    Returns:
+        set: The instrument and start date of each experiment.
+    """
+    return {
+        (data["instrument"], data["scheduledDate"])
+        for data in raw_data
+        if isinstance(data["scheduledDate"], datetime)
+    }
+
+
+class PollScheduler:
+    """
+    Decides how long to wait before polling the website again. The website is polled again soon
+    after the schedule changes, and then less often while it stays the same, but never less often
+    than hourly while an experiment whose start date has just changed is about to start, which is
+    when last minute changes are made.
+    """
+
+    def __init__(
+        self,
+        min_interval=MIN_POLL_INTERVAL,
+        max_interval=MAX_POLL_INTERVAL,
+        base_interval=BASE_POLL_INTERVAL,
+    ):
+        """
+        Args:
+            min_interval: The time in seconds to wait after the schedule has changed.
+            max_interval: The longest time in seconds to wait between polls.
+            base_interval: The shortest time in seconds to wait when the schedule hasn't changed.
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.base_interval = base_interval
+        self.interval = min_interval
+        self.last_digest = None
+        self.start_dates = None
+        self.changed_start_dates = set()
+
+    def next_interval(self, raw_data, now=None):
+        """
+        Works out how long to wait before the next poll, given the data from this one.
+        Args:
+            raw_data: All of the raw data from the website.
+            now (datetime): The current time, if None datetime.now() is used.
+        Returns:
+            float: The time in seconds to wait.
+        """
+        now = now or datetime.now()
+        digest = compute_payload_digest(raw_data)
+        if digest == self.last_digest:
+            self.interval = min(
+                max(self.interval * BACKOFF_FACTOR, self.base_interval), self.max_interval
+            )
+        elif self.last_digest is None:
+            # Nothing to compare the first poll with, so it isn't known to have changed
+            self.interval = self.base_interval
+            self.start_dates = get_start_dates(raw_data)
+        else:
+            self.interval = self.min_interval
+            start_dates = get_start_dates(raw_data)
+            self.changed_start_dates.update(start_dates - self.start_dates)
+            self.start_dates = start_dates
+        self.last_digest = digest
+
+        self.changed_start_dates = {
+            (instrument, start) for instrument, start in self.changed_start_dates if start > now
+        }
+        near_change = any(start - now <= NEAR_START_WINDOW for _, start in self.changed_start_dates)
+        interval = min(self.interval, self.base_interval) if near_change else self.interval
+        logging.info("Polling the website again in {:.0f} minutes".format(interval / 60))
+        return interval
@@ -1,18 +1,21 @@
 import logging
+from collections import defaultdict
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 
-from peewee import MySQLDatabase, chunked
+from peewee import JOIN, MySQLDatabase, Tuple, chunked
 
-from exp_db_populator.data_types import CREDS_GROUP
-from exp_db_populator.database_model import Experiment, Experimentteams, User, database_proxy
-
-try:
-    from exp_db_populator.passwords.password_reader import get_credentials
-except ImportError:
-    logging.warn(
-        "Password submodule not found, will not be able to write to databases, "
-        "unless username/password are specified manually"
-    )
+from exp_db_populator.credentials import get_credentials
+from exp_db_populator.data_types import CREDS_GROUP, EXPERIMENT_FIELDS
+from exp_db_populator.database_model import (
+    Experiment,
+    Experimentteams,
+    Role,
+    User,
+    bind_database,
+    database_proxy,
+)
+from exp_db_populator.metrics import metrics
 
 # How old (in days) the startdate of an experiment must be before it is removed from the database
 AGE_OF_EXPIRATION = 100
@@ -20,108 +23,665 @@ AGE_OF_EXPIRATION = 100
 # Time in seconds between polling the website
 POLLING_TIME = 3600
 
+# Timeouts in seconds for talking to an instrument database, so an unreachable host fails quickly
+DB_CONNECT_TIMEOUT = 10
+DB_READ_TIMEOUT = 60
+DB_WRITE_TIMEOUT = 60
+
+# Limits on the size of a single multi-row insert
+SQLITE_MAX_VARIABLES = 999  # The lowest limit on the parameters of a statement in any SQLite
+PACKET_USAGE = 0.5  # The fraction of MySQL's max_allowed_packet that one insert may use
+DEFAULT_MAX_ALLOWED_PACKET = 4 * 1024 * 1024  # The MySQL 5.7 default, used if it can't be read
+
+
+def find_unreferenced(field, team_field, candidates=None):
+    """
+    Finds the values of a field that are no longer referenced by any experiment team, using an
+    anti-join rather than a NOT IN subquery so that the database can use its indexes.
+
+    Args:
+        field: The field to look at, e.g. User.userid.
+        team_field: The field of Experimentteams that references it.
+        candidates: The values to check, if None the whole table is checked.
+
+    Returns:
+        set: The unreferenced values.
+    """
+    query = (
+        field.model.select(field)
+        .join(Experimentteams, JOIN.LEFT_OUTER, on=(team_field == field))
+        .where(team_field.is_null())
+        .distinct()
+    )
+    if candidates is None:
+        return {value for (value,) in query.tuples()}
 
-def remove_users_not_referenced():
-    all_team_user_ids = Experimentteams.select(Experimentteams.userid)
-    User.delete().where(User.userid.not_in(all_team_user_ids)).execute()
+    unreferenced = set()
+    for batch in chunked(candidates, 500):
+        unreferenced.update(value for (value,) in query.where(field.in_(batch)).tuples())
+    return unreferenced
 
 
-def remove_experiments_not_referenced():
-    all_team_experiments = Experimentteams.select(Experimentteams.experimentid)
-    Experiment.delete().where(Experiment.experimentid.not_in(all_team_experiments)).execute()
+def delete_values(field, values):
+    """
+    Deletes the rows where a field has one of the given values, in batches.
 
+    Returns:
+        int: The number of rows deleted.
+    """
+    removed = 0
+    for batch in chunked(sorted(values), 500):
+        removed += field.model.delete().where(field.in_(batch)).execute()
+    return removed
+
+
+def delete_teams(teams):
+    """
+    Deletes experiment team rows, using one statement for each batch of rows rather than one
+    for each row.
+
+    Args:
+        teams (list[tuple]): The rows to delete, as (rb_number, start_date, role_id, user_id).
+    """
+    team_columns = Tuple(
+        Experimentteams.experimentid,
+        Experimentteams.startdate,
+        Experimentteams.roleid,
+        Experimentteams.userid,
+    )
+    # Each row uses a parameter for each of its four columns
+    for batch in chunked(teams, SQLITE_MAX_VARIABLES // 4):
+        Experimentteams.delete().where(team_columns.in_(batch)).execute()
+
+
+def remove_users_not_referenced(database=None, candidates=None):
+    """
+    Removes users that are no longer in any experiment team.
 
-def remove_old_experiment_teams(age):
+    Args:
+        database: The database to remove the users from, if None the currently bound database
+            is used.
+        candidates: The ids of the users to check, if None all users are checked.
+
+    Returns:
+        int: The number of users removed.
+    """
+    with bind_database(database):
+        return delete_values(
+            User.userid, find_unreferenced(User.userid, Experimentteams.userid, candidates)
+        )
+
+
+def remove_experiments_not_referenced(database=None, candidates=None):
+    """
+    Removes experiments that no longer have a team.
+
+    Args:
+        database: The database to remove the experiments from, if None the currently bound
+            database is used.
+        candidates: The RB numbers of the experiments to check, if None all experiments are
+            checked.
+
+    Returns:
+        int: The number of experiments removed.
+    """
+    with bind_database(database):
+        unreferenced = find_unreferenced(
+            Experiment.experimentid, Experimentteams.experimentid, candidates
+        )
+        return delete_values(Experiment.experimentid, unreferenced)
+
+
+def remove_old_experiment_teams(age, database=None):
+    """
+    Removes the teams of experiments that started more than the given number of days ago.
+
+    Args:
+        age: The age in days after which to remove teams.
+        database: The database to remove the teams from, if None the currently bound database
+            is used.
+
+    Returns:
+        tuple (int, set, set): The number of team rows removed, and the RB numbers and user ids
+            that they referenced.
+    """
     date = datetime.now() - timedelta(days=age)
-    Experimentteams.delete().where(Experimentteams.startdate < date).execute()
+    with bind_database(database):
+        expired = (
+            Experimentteams.select(Experimentteams.experimentid, Experimentteams.userid)
+            .where(Experimentteams.startdate < date)
+            .tuples()
+        )
+        rb_numbers, user_ids = set(), set()
+        for rb_number, user_id in expired:
+            rb_numbers.add(rb_number)
+            user_ids.add(user_id)
 
+        removed = Experimentteams.delete().where(Experimentteams.startdate < date).execute()
+    return removed, rb_numbers, user_ids
 
-def create_database(instrument_host, credentials):
+
+def create_database(instrument_host, credentials, database_class=MySQLDatabase, **kwargs):
+    """
+    Creates the database for an instrument. No connection is made until it is used.
+
+    Args:
+        instrument_host: The host name of the instrument.
+        credentials: The credentials to write to the database with, in the form (user, password).
+            If None then the credentials are received from the stored git repo
+        database_class: The type of database to create, e.g. a pooled database.
+        kwargs: Any further arguments for the database.
+
+    Returns:
+        The database.
+    """
     if not credentials:
         username, password = get_credentials(CREDS_GROUP, "ExpDatabaseWrite")
     else:
         username, password = credentials
-    return MySQLDatabase("exp_data", user=username, password=password, host=instrument_host)
+    return database_class(
+        "exp_data",
+        user=username,
+        password=password,
+        host=instrument_host,
+        connect_timeout=DB_CONNECT_TIMEOUT,
+        read_timeout=DB_READ_TIMEOUT,
+        write_timeout=DB_WRITE_TIMEOUT,
+        **kwargs,
+    )
+
+
+def cleanup_old_data(database=None, full=False):
+    """
+    Removes old data from the database. Only the experiments and users that were referenced by
+    the expired teams are checked, unless a full cleanup is requested.
+
+    Args:
+        database: The database to remove the data from, if None the currently bound database is
+            used.
+        full: Whether to check every experiment and user, rather than just those that were in
+            the expired teams.
+
+    Returns:
+        dict: The number of teams, experiments and users removed.
+    """
+    with bind_database(database):
+        teams_removed, rb_numbers, user_ids = remove_old_experiment_teams(AGE_OF_EXPIRATION)
+        if full:
+            rb_numbers, user_ids = None, None
+        return {
+            "teams_removed": teams_removed,
+            "experiments_removed": remove_experiments_not_referenced(candidates=rb_numbers),
+            "users_removed": remove_users_not_referenced(candidates=user_ids),
+        }
+
+
+def get_max_allowed_packet(database):
+    """
+    Gets the largest statement that the database server will accept.
+
+    Args:
+        database: The database to check.
+
+    Returns:
+        int: The size in bytes, or None if the database isn't MySQL and so has no such limit.
+    """
+    if not isinstance(database, MySQLDatabase):
+        return None
+    try:
+        return int(database.execute_sql("SELECT @@max_allowed_packet").fetchone()[0])
+    except Exception:
+        logging.exception(
+            "Unable to read max_allowed_packet, assuming {} bytes".format(
+                DEFAULT_MAX_ALLOWED_PACKET
+            )
+        )
+        return DEFAULT_MAX_ALLOWED_PACKET
+
+
+def estimate_row_bytes(row):
+    """
+    Estimates the size of a row once it is written out in an insert statement.
+
+    Args:
+        row: The values in the row, as a tuple or a dictionary keyed by field.
+
+    Returns:
+        int: The estimated size in bytes.
+    """
+    values = row.values() if isinstance(row, dict) else row
+    # Allow for quotes, escaping and the separators between values
+    return sum(len(str(value)) + 4 for value in values) + 4
 
 
-def cleanup_old_data():
+def get_batch_size(rows, column_count, max_allowed_packet):
     """
-    Removes old data from the database.
+    Chooses how many rows to insert in each statement, so that the rows are written in as few
+    statements as possible without going over the database's limits.
+
+    Args:
+        rows (list): The rows to insert.
+        column_count: The number of columns in each row.
+        max_allowed_packet: The largest statement the server accepts in bytes, or None if the
+            database limits the number of parameters instead.
+
+    Returns:
+        int: The number of rows to insert in each statement.
     """
-    remove_old_experiment_teams(AGE_OF_EXPIRATION)
-    remove_experiments_not_referenced()
-    remove_users_not_referenced()
+    if not rows:
+        return 1
+    if max_allowed_packet is None:
+        limit = SQLITE_MAX_VARIABLES // column_count
+    else:
+        largest_row = max(estimate_row_bytes(row) for row in rows)
+        limit = int(max_allowed_packet * PACKET_USAGE) // largest_row
+    return max(1, min(len(rows), limit))
 
 
-def populate(experiments, experiment_teams):
+def get_role_ids():
     """
-    Populates the database with experiment data.
+    Gets the ids of all the roles in the database.
+
+    Returns:
+        dict: The role ids keyed by role name.
+    """
+    return {role.name: role.roleid for role in Role.select(Role.name, Role.roleid)}
+
+
+def user_key(name, organisation):
+    """
+    Creates a key for a user that compares the way the database does, ignoring case and trailing
+    spaces, so that a user is matched to the row the database considers the same.
 
     Args:
-        experiments (list[dict]): A list of dictionaries containing information on experiments.
+        name: The name of the user.
+        organisation: The organisation of the user.
+
+    Returns:
+        tuple: The key.
+    """
+    return tuple(
+        None if value is None else value.rstrip(" ").casefold() for value in (name, organisation)
+    )
+
+
+def find_user_id(user):
+    """
+    Looks up a single user, letting the database decide which rows match.
+
+    Args:
+        user (tuple): The (name, organisation) of the user.
+
+    Returns:
+        int: The id of the user, or None if there is no such user.
+    """
+    name, organisation = user
+    condition = (User.name.is_null() if name is None else User.name == name) & (
+        User.organisation.is_null() if organisation is None else User.organisation == organisation
+    )
+    return User.select(User.userid).where(condition).order_by(User.userid).scalar()
+
+
+def select_user_ids(users):
+    """
+    Gets the ids of the users that already exist in the database, matching them the way the
+    database compares them.
+
+    Args:
+        users (set[tuple]): The (name, organisation) of the users to look for.
+
+    Returns:
+        dict: The user ids keyed by (name, organisation) as given, for the users that were found.
+    """
+    users_by_key = defaultdict(list)
+    for user in users:
+        users_by_key[user_key(*user)].append(user)
+
+    user_ids = {}
+    unmatched_rows = False
+    names = {name for name, _ in users}
+    for batch in chunked(names, 500):
+        condition = User.name.in_([name for name in batch if name is not None])
+        if None in batch:
+            condition |= User.name.is_null()
+        query = User.select(User.userid, User.name, User.organisation).where(condition)
+        for userid, name, organisation in query.order_by(User.userid).tuples():
+            matching = users_by_key.get(user_key(name, organisation))
+            if matching is None:
+                unmatched_rows = True
+            for user in matching or []:
+                user_ids.setdefault(user, userid)
+
+    # The database may consider more values the same than user_key does, e.g. accented letters,
+    # so if it returned rows that weren't matched ask it directly about the users left over
+    if unmatched_rows:
+        for user in users - user_ids.keys():
+            userid = find_user_id(user)
+            if userid is not None:
+                user_ids[user] = userid
+    return user_ids
+
+
+def get_user_ids(users, max_allowed_packet=None):
+    """
+    Gets the ids of the given users in bulk. Will create entries for any users that don't
+    already exist in the database.
+
+    Args:
+        users (iterable[exp_db_populator.data_types.UserData]): The users to get the ids of.
+        max_allowed_packet: The largest statement the server accepts in bytes, see
+            get_batch_size.
+
+    Returns:
+        dict: The user ids keyed by (name, organisation).
+    """
+    # Users are (name, organisation) tuples, so can be used as the keys directly
+    users = set(users)
+    user_ids = select_user_ids(users)
+
+    # Only create one row for users that the database would consider the same
+    missing_users = {}
+    for user in sorted(users - user_ids.keys(), key=str):
+        missing_users.setdefault(user_key(*user), user)
+    if missing_users:
+        new_users = list(missing_users.values())
+        batch_size = get_batch_size(new_users, 2, max_allowed_packet)
+        for batch in chunked(new_users, batch_size):
+            User.insert_many(batch, fields=[User.name, User.organisation]).execute()
+        user_ids.update(select_user_ids(users - user_ids.keys()))
+
+    return user_ids
+
+
+def experiment_key(rb_number, start_date):
+    """
+    Creates a key for an experiment that matches the way it is read back from the database.
+
+    Args:
+        rb_number: The RB number of the experiment.
+        start_date (datetime): The start date of the experiment.
+
+    Returns:
+        tuple: The key for the experiment.
+    """
+    # The database doesn't store the timezone so ignore it when comparing
+    if isinstance(start_date, datetime) and start_date.tzinfo is not None:
+        start_date = start_date.replace(tzinfo=None)
+    return str(rb_number), start_date
+
+
+def select_existing_rows(rb_numbers):
+    """
+    Gets the rows that are currently in the database for the given experiments.
+
+    Args:
+        rb_numbers (set[str]): The RB numbers of the experiments to look for.
+
+    Returns:
+        tuple (dict, set): The durations of the existing experiments, keyed by experiment key,
+            and the existing team rows as (rb_number, start_date, role_id, user_id).
+    """
+    existing_experiments, existing_teams = {}, set()
+    for batch in chunked(rb_numbers, 500):
+        experiment_query = Experiment.select(
+            Experiment.experimentid, Experiment.startdate, Experiment.duration
+        ).where(Experiment.experimentid.in_(batch))
+        for rb_number, start_date, duration in experiment_query.tuples():
+            existing_experiments[experiment_key(rb_number, start_date)] = duration
+
+        team_query = Experimentteams.select(
+            Experimentteams.experimentid,
+            Experimentteams.startdate,
+            Experimentteams.roleid,
+            Experimentteams.userid,
+        ).where(Experimentteams.experimentid.in_(batch))
+        for rb_number, start_date, role_id, user_id in team_query.tuples():
+            existing_teams.add(experiment_key(rb_number, start_date) + (role_id, user_id))
+    return existing_experiments, existing_teams
+
+
+def write_experiments(experiments, max_allowed_packet, upsert=False):
+    """
+    Inserts experiments in batches, replacing any that already exist.
+
+    Args:
+        experiments (list[exp_db_populator.data_types.ExperimentData]): The experiments to
+            write.
+        max_allowed_packet: The largest statement the server accepts in bytes, see
+            get_batch_size.
+        upsert: Whether to only update the duration of experiments that already exist, rather
+            than replacing them.
+    """
+    batch_size = get_batch_size(experiments, len(EXPERIMENT_FIELDS), max_allowed_packet)
+    for batch in chunked(experiments, batch_size):
+        query = Experiment.insert_many(batch, fields=EXPERIMENT_FIELDS)
+        if not upsert:
+            query = query.on_conflict_replace()
+        elif isinstance(database_proxy.obj, MySQLDatabase):
+            query = query.on_conflict(preserve=[Experiment.duration])
+        else:
+            query = query.on_conflict(
+                conflict_target=[Experiment.experimentid, Experiment.startdate],
+                preserve=[Experiment.duration],
+            )
+        query.execute()
+
+
+def populate(experiments, experiment_teams, database=None, upsert=False):
+    """
+    Populates the database with experiment data. Only the rows that differ from what is
+    already in the database are written, using as few statements as possible. This should be
+    called within a transaction so that a failure doesn't leave a partial update behind.
+
+    Args:
+        experiments (list[exp_db_populator.data_types.ExperimentData]): The experiments.
         experiment_teams (list[exp_db_populator.data_types.ExperimentTeamData]): A list containing
             the users for all new experiments.
+        database: The database to populate, if None the currently bound database is used.
+        upsert: Whether to write new and changed experiments together in multi-row
+            INSERT ... ON DUPLICATE KEY UPDATE statements, rather than updating each changed
+            experiment separately.
+
+    Returns:
+        dict: The number of experiments inserted and updated and team rows inserted and deleted.
     """
     if not experiments or not experiment_teams:
         raise KeyError("Experiment without team or vice versa")
 
-    for batch in chunked(experiments, 100):
-        Experiment.insert_many(batch).on_conflict_replace().execute()
+    with bind_database(database):
+        role_ids = get_role_ids()
+        unknown_roles = {exp_team.role for exp_team in experiment_teams} - role_ids.keys()
+        if unknown_roles:
+            raise Role.DoesNotExist(
+                "Roles not found: {}".format(", ".join(map(str, unknown_roles)))
+            )
+
+        max_allowed_packet = get_max_allowed_packet(database_proxy.obj)
+        user_ids = get_user_ids(
+            (exp_team.user for exp_team in experiment_teams), max_allowed_packet
+        )
 
-    teams_update = [
-        {
-            Experimentteams.experimentid: exp_team.rb_number,
-            Experimentteams.roleid: exp_team.role_id,
-            Experimentteams.startdate: exp_team.start_date,
-            Experimentteams.userid: exp_team.user.user_id,
+        new_experiments = {
+            experiment_key(exp.experimentid, exp.startdate): exp for exp in experiments
+        }
+        new_teams = {
+            experiment_key(exp_team.rb_number, exp_team.start_date)
+            + (role_ids[exp_team.role], user_ids[exp_team.user])
+            for exp_team in experiment_teams
         }
-        for exp_team in experiment_teams
-    ]
+        existing_experiments, existing_teams = select_existing_rows(
+            {rb_number for rb_number, _ in new_experiments}
+        )
+
+        experiments_to_insert = [
+            exp for key, exp in new_experiments.items() if key not in existing_experiments
+        ]
+        experiments_to_update = {
+            key: exp.duration
+            for key, exp in new_experiments.items()
+            if key in existing_experiments and existing_experiments[key] != exp.duration
+        }
+        teams_to_insert = sorted(new_teams - existing_teams, key=str)
+        # Only remove team members from experiments that are still in the schedule, old
+        # experiments are removed by the cleanup instead
+        teams_to_delete = [
+            team
+            for team in existing_teams - new_teams
+            if experiment_key(team[0], team[1]) in new_experiments
+        ]
+
+        if upsert:
+            changed_experiments = experiments_to_insert + [
+                new_experiments[key] for key in experiments_to_update
+            ]
+            write_experiments(changed_experiments, max_allowed_packet, upsert=True)
+        else:
+            write_experiments(experiments_to_insert, max_allowed_packet)
+            for (rb_number, start_date), duration in experiments_to_update.items():
+                Experiment.update({Experiment.duration: duration}).where(
+                    (Experiment.experimentid == rb_number) & (Experiment.startdate == start_date)
+                ).execute()
+
+        team_fields = [
+            Experimentteams.experimentid,
+            Experimentteams.startdate,
+            Experimentteams.roleid,
+            Experimentteams.userid,
+        ]
+        batch_size = get_batch_size(teams_to_insert, len(team_fields), max_allowed_packet)
+        for batch in chunked(teams_to_insert, batch_size):
+            Experimentteams.insert_many(batch, fields=team_fields).on_conflict_ignore().execute()
+
+        delete_teams(teams_to_delete)
 
-    for batch in chunked(teams_update, 100):
-        Experimentteams.insert_many(batch).on_conflict_ignore().execute()
+        # Users taken off a team may no longer be in any team
+        users_deleted = remove_users_not_referenced(
+            candidates={team[3] for team in teams_to_delete}
+        )
+
+    return {
+        "experiments_inserted": len(experiments_to_insert),
+        "experiments_updated": len(experiments_to_update),
+        "teams_inserted": len(teams_to_insert),
+        "teams_deleted": len(teams_to_delete),
+        "users_deleted": users_deleted,
+    }
+
+
+@contextmanager
+def timed_connection(database, instrument_name):
+    """
+    Connects to an instrument's database for the duration of the context, timing how long the
+    connection takes to make.
+
+    Args:
+        database: The database to connect to.
+        instrument_name: The name of the instrument, for the metrics.
+    """
+    with metrics.timer("database_connect", instrument=instrument_name):
+        if database.is_closed():
+            database.connect()
+    try:
+        yield
+    finally:
+        database.close()
+
+
+def format_counts(counts):
+    """
+    Formats a dictionary of counts for logging, e.g. "1 teams inserted, 0 teams deleted".
+    """
+    return ", ".join(
+        "{} {}".format(count, name.replace("_", " ")) for name, count in counts.items()
+    )
 
 
 def update(
     instrument_name,
     instrument_host,
-    db_lock,
     instrument_data,
     run_continuous=False,
     credentials=None,
+    upsert=False,
+    database=None,
 ):
     """
-    Populates the database with this experiment's data.
+    Populates the database with this experiment's data in a single transaction. Each call uses
+    its own database connection, so several instruments can be updated at the same time from
+    different threads. Old data is not removed, see cleanup.
 
     Args:
         instrument_name: The name of the instrument to update.
         instrument_host: The host name of the instrument to update.
-        db_lock: A lock for writing to the database.
-        instrument_data: The data to send to the instrument, if None the data will just be
-            cleared instead.
+        instrument_data: The data to send to the instrument, if None nothing is written.
         run_continuous: Whether the program is running in continuous mode.
         credentials: The credentials to write to the database with, in the form (user, password).
             If None then the credentials are received from the stored git repo
+        upsert: Whether to write experiments using INSERT ... ON DUPLICATE KEY UPDATE, see
+            populate.
+        database: The database to write to, e.g. from a DatabasePool. If None a new one is
+            created for this update.
+    Returns:
+        bool: True if the database was updated successfully, False otherwise.
     """
-    database = create_database(instrument_host, credentials)
+    if database is None:
+        database = create_database(instrument_host, credentials)
     logging.info(
         "Performing {} update for {}".format(
             "hourly" if run_continuous else "single", instrument_name
         )
     )
     try:
-        with db_lock:
-            database_proxy.initialize(database)
-            if instrument_data is not None:
-                experiments, experiment_teams = instrument_data
-                populate(experiments, experiment_teams)
-            cleanup_old_data()
-            database_proxy.initialize(None)  # Ensure no other populators send to the wrong database
+        with timed_connection(database, instrument_name):
+            with metrics.timer("populate", instrument=instrument_name), database.atomic():
+                if instrument_data is not None:
+                    experiments, experiment_teams = instrument_data
+                    changes = populate(experiments, experiment_teams, database, upsert)
+                    logging.info(
+                        "{} changes written: {}".format(instrument_name, format_counts(changes))
+                    )
+                    metrics.record_counts(changes, instrument=instrument_name)
 
         logging.info("{} experiment data updated successfully".format(instrument_name))
+        return True
     except Exception:
+        metrics.increment("failures", stage="populate", instrument=instrument_name)
         logging.exception(
             "{} unable to populate database, will try again in {} seconds".format(
                 instrument_name, POLLING_TIME
             )
         )
+        return False
+
+
+def cleanup(instrument_name, instrument_host, credentials=None, database=None, full=False):
+    """
+    Removes old data from an instrument's database in a single transaction.
+
+    Args:
+        instrument_name: The name of the instrument to clean up.
+        instrument_host: The host name of the instrument to clean up.
+        credentials: The credentials to write to the database with, in the form (user, password).
+            If None then the credentials are received from the stored git repo
+        database: The database to clean up, e.g. from a DatabasePool. If None a new one is
+            created.
+        full: Whether to check every experiment and user, see cleanup_old_data.
+    Returns:
+        datetime: The start date of the oldest experiment team left in the database, or None if
+            there are none.
+    """
+    if database is None:
+        database = create_database(instrument_host, credentials)
+    with timed_connection(database, instrument_name):
+        with metrics.timer("cleanup", instrument=instrument_name), database.atomic():
+            with bind_database(database):
+                removed = cleanup_old_data(full=full)
+                oldest_start_date = (
+                    Experimentteams.select(Experimentteams.startdate)
+                    .order_by(Experimentteams.startdate)
+                    .limit(1)
+                    .scalar()
+                )
+    logging.info("{} old data removed: {}".format(instrument_name, format_counts(removed)))
+    metrics.record_counts(removed, instrument=instrument_name)
+    return oldest_start_date
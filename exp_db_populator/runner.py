@@ -0,0 +1,227 @@
+import json
+import logging
+import zlib
+from time import time
+
+from exp_db_populator.cleanup_scheduler import CleanupScheduler
+from exp_db_populator.credentials import credentials_cache
+from exp_db_populator.database_pool import DatabasePool
+from exp_db_populator.digest_store import DigestStore
+from exp_db_populator.gatherer import DEFAULT_MAX_WORKERS, UPDATE_TIMEOUT, Gatherer
+from exp_db_populator.metrics import metrics
+from exp_db_populator.poll_scheduler import MAX_POLL_INTERVAL, PollScheduler
+from exp_db_populator.schedule_cache import ScheduleCache
+from exp_db_populator.snapshot import ScheduleSnapshot
+from exp_db_populator.webservices_reader import clear_clients, web_session
+
+# PV that contains the instrument list
+INST_LIST_PV = "CS:INSTLIST"
+
+# Longest time in seconds between cycles finishing while the populator is healthy: the longest wait
+# between polls, plus time to gather the data and to update and clean up the instruments
+MAX_CYCLE_AGE = MAX_POLL_INTERVAL + 3 * UPDATE_TIMEOUT
+
+
+def convert_inst_list(value_from_pv):
+    """
+    Converts the instrument list coming from the PV into a dictionary.
+    Args:
+        value_from_pv: The raw value from the PV.
+    Returns:
+        dict: The instrument information.
+    """
+    json_string = zlib.decompress(bytes.fromhex(value_from_pv)).decode("utf-8")
+    return json.loads(json_string)
+
+
+def compress_json(value):
+    """
+    Compresses a value as JSON in the same way as the instrument list, for writing to a PV.
+    Args:
+        value: The value to compress.
+    Returns:
+        str: The compressed value, as hex.
+    """
+    return zlib.compress(json.dumps(value).encode("utf-8")).hex()
+
+
+def publish_metrics_to_pv(pv_name, registry):
+    """
+    Writes the metrics to a PV, compressed in the same way as the instrument list.
+    Args:
+        pv_name: The name of the PV to write to.
+        registry: The metrics to write.
+    """
+    import epics
+
+    epics.caput(pv_name, compress_json(registry.to_dict()), wait=False)
+
+
+class InstrumentPopulatorRunner:
+    """
+    Responsible for managing the thread that will gather the data and populate each instrument.
+    """
+
+    gatherer = None
+    gatherer_started = None
+    prev_inst_list = None
+
+    def __init__(
+        self,
+        run_continuous=False,
+        max_workers=DEFAULT_MAX_WORKERS,
+        digest_file=None,
+        incremental=False,
+        cleanup_file=None,
+        upsert=False,
+        adaptive=False,
+        snapshot_file=None,
+    ):
+        self.run_continuous = run_continuous
+        self.max_workers = max_workers
+        # Kept between gatherers so instruments whose data hasn't changed are not rewritten
+        self.digest_store = DigestStore(digest_file)
+        # Kept between gatherers so only the parts of the schedule that are due are fetched
+        self.schedule_cache = ScheduleCache() if incremental else None
+        # Kept between gatherers so old data is only looked for when some could have expired
+        self.cleanup_scheduler = CleanupScheduler(cleanup_file)
+        self.upsert = upsert
+        # Kept between gatherers so connections to the instruments are reused from one hour to the
+        # next, there's nothing to reuse in a single run
+        self.database_pool = DatabasePool() if run_continuous else None
+        # Kept between gatherers so the poll interval carries on backing off
+        self.poll_scheduler = PollScheduler() if adaptive else None
+        self.snapshot = ScheduleSnapshot(snapshot_file) if snapshot_file else None
+
+    def start_inst_list_monitor(self):
+        # pyepics takes a while to import and load libca, so only do so when there's a PV to read
+        import epics
+
+        logging.info("Setting up monitors on {}".format(INST_LIST_PV))
+        self.inst_list_callback(char_value=epics.caget(INST_LIST_PV, as_string=True))
+        epics.camonitor(INST_LIST_PV, callback=self.inst_list_callback)
+
+    def inst_list_callback(self, char_value, **kw):
+        """
+        Called when the instrument list PV changes value.
+        Args:
+            char_value: The string representation of the PV data.
+            **kw: The module will also send other info about the PV, we capture this and don't
+                use it.
+        """
+        new_inst_list = convert_inst_list(char_value)
+        if new_inst_list != self.prev_inst_list:
+            self.prev_inst_list = new_inst_list
+            self.inst_list_changes(new_inst_list)
+
+    def remove_gatherer(self):
+        """
+        Stops the gatherer and clears the cache.
+        """
+        # Faster if thread is stopped first, then joined after.
+        if self.gatherer is not None:
+            self.gatherer.running = False
+            self.wait_for_gatherer_to_finish()
+            self.gatherer = None
+
+    def inst_list_changes(self, inst_list):
+        """
+        Passes a new instrument list to the running gatherer, which updates just the instruments
+        that have been newly scheduled. Starts a new gatherer if there isn't one running
+        continuously.
+        Args:
+            inst_list (list): Information about all instruments.
+        """
+        if self.run_continuous and self.gatherer is not None and self.gatherer.is_alive():
+            logging.info("Instrument list changed")
+            self.gatherer.set_inst_list(inst_list)
+        else:
+            self.start_gatherer(inst_list)
+
+    def start_gatherer(self, inst_list):
+        """
+        Starts a new gatherer thread, stopping any existing one, which gathers all the data and
+        updates every scheduled instrument.
+        Args:
+            inst_list (list): Information about all instruments.
+        """
+        self.remove_gatherer()
+
+        new_gatherer = Gatherer(
+            inst_list,
+            self.run_continuous,
+            self.max_workers,
+            self.digest_store,
+            self.schedule_cache,
+            self.cleanup_scheduler,
+            self.upsert,
+            self.database_pool,
+            self.poll_scheduler,
+            self.snapshot,
+        )
+        new_gatherer.start()
+        self.gatherer = new_gatherer
+        self.gatherer_started = time()
+
+    def request_refresh(self, inst_name=None):
+        """
+        Asks the running gatherer to update an instrument straight away.
+        Args:
+            inst_name: The IBEX name of the instrument, if None all instruments are updated.
+        """
+        if self.gatherer is None:
+            logging.warning("Unable to refresh, the gatherer is not running")
+        else:
+            self.gatherer.request_refresh(inst_name)
+
+    def reload(self):
+        """
+        Forgets the credentials, web clients and connections to the instruments so that they are
+        set up again, then rereads the instrument list and updates every scheduled instrument.
+        """
+        import epics
+
+        logging.info("Reloading credentials and instrument list")
+        self.remove_gatherer()
+        credentials_cache.invalidate()
+        web_session.invalidate()
+        clear_clients()
+        if self.database_pool is not None:
+            self.database_pool.close_all()
+        self.prev_inst_list = convert_inst_list(epics.caget(INST_LIST_PV, as_string=True))
+        self.start_gatherer(self.prev_inst_list)
+
+    def stop(self, timeout=None):
+        """
+        Stops the gatherer and closes the connections to the instruments.
+        Args:
+            timeout: The longest time in seconds to wait for the gatherer to finish its cycle, if
+                None wait for as long as it takes.
+        """
+        if self.gatherer is not None:
+            self.gatherer.running = False
+            self.gatherer.join(timeout)
+            if self.gatherer.is_alive():
+                logging.warning("Gatherer still running after {} seconds".format(timeout))
+            self.gatherer = None
+        if self.database_pool is not None:
+            self.database_pool.close_all()
+
+    def get_health(self):
+        """
+        Checks that the gatherer is running and has recently finished a cycle.
+        Returns:
+            tuple: Whether the populator is healthy and a dictionary of details about it.
+        """
+        gatherer_alive = self.gatherer is not None and self.gatherer.is_alive()
+        last_cycle_time = metrics.get("last_cycle_time")
+        # A new gatherer is given as long as a cycle takes before it must have finished one
+        since = max(filter(None, [last_cycle_time, self.gatherer_started]), default=None)
+        healthy = gatherer_alive and since is not None and time() - since <= MAX_CYCLE_AGE
+        return healthy, {"gatherer_alive": gatherer_alive, "last_cycle_time": last_cycle_time}
+
+    def wait_for_gatherer_to_finish(self):
+        """
+        Blocks until gatherer is finished.
+        """
+        self.gatherer.join()
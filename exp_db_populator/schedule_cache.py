@@ -0,0 +1,137 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from time import time
+
+from exp_db_populator.webservices_reader import (
+    RELEVANT_DATE_RANGE,
+    gather_data_between,
+    get_start_and_end,
+)
+
+WINDOW_DAYS = 10  # The number of days of the schedule fetched from the website in one request
+NEAR_DAYS = 14  # Windows this many days either side of now are refreshed every time
+DISTANT_REFRESH_INTERVAL = 24 * 60 * 60  # Time in seconds between refreshing the other windows
+FETCH_WORKERS = 4  # Number of windows to fetch from the website at the same time
+
+# Windows are aligned to this date so that they are the same from one cycle to the next
+WINDOW_EPOCH = datetime(2000, 1, 1)
+
+
+def get_windows(now):
+    """
+    Splits the relevant range of dates into windows. The first and last windows are cut short
+    at the ends of the range, so that together they cover exactly the range that would be
+    fetched in a single request.
+    Args:
+        now (datetime): The current time.
+    Returns:
+        list[tuple]: The start and end of each window.
+    """
+    range_start, range_end = get_start_and_end(now, RELEVANT_DATE_RANGE)
+    window_size = timedelta(days=WINDOW_DAYS)
+    window_start = WINDOW_EPOCH + ((range_start - WINDOW_EPOCH) // window_size) * window_size
+
+    windows = []
+    while window_start < range_end:
+        windows.append((max(window_start, range_start), min(window_start + window_size, range_end)))
+        window_start += window_size
+    return windows
+
+
+class ScheduleCache:
+    """
+    Holds a copy of the schedule from the website, split into windows of dates. The windows close
+    to now are fetched again every time the schedule is gathered, but the distant ones, which
+    rarely change, are only fetched occasionally.
+    """
+
+    def __init__(self, fetch_window=gather_data_between):
+        """
+        Args:
+            fetch_window: Called with the start and end of a window to get its data from the web.
+        """
+        self.fetch_window = fetch_window
+        self.windows = {}  # The data and time it was fetched, keyed by (start, end)
+        self.lock = threading.Lock()
+
+    def is_due(self, window, now):
+        """
+        Checks whether a window needs to be fetched.
+        Args:
+            window (tuple): The start and end of the window.
+            now (datetime): The current time.
+        Returns:
+            bool: True if the window should be fetched.
+        """
+        if window not in self.windows:
+            return True
+        near_start, near_end = get_start_and_end(now, NEAR_DAYS)
+        start, end = window
+        if start < near_end and end > near_start:
+            return True
+        fetched_at = self.windows[window][1]
+        return time() - fetched_at > DISTANT_REFRESH_INTERVAL
+
+    def fetch(self, window):
+        """
+        Fetches a window from the website, logging rather than raising any errors.
+        Args:
+            window (tuple): The start and end of the window.
+        Returns:
+            list: The data in the window, or None if it could not be fetched.
+        """
+        try:
+            return self.fetch_window(*window)
+        except Exception:
+            logging.exception("Unable to fetch schedule from {} to {}".format(*window))
+            return None
+
+    def refresh(self, now):
+        """
+        Fetches all the windows that are due, in parallel.
+        Args:
+            now (datetime): The current time.
+        """
+        windows = get_windows(now)
+        due = [window for window in windows if self.is_due(window, now)]
+        logging.info("Fetching {} of {} windows of the schedule".format(len(due), len(windows)))
+
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+            results = list(zip(due, executor.map(self.fetch, due)))
+
+        missing = []
+        for window, data in results:
+            if data is not None:
+                self.windows[window] = (data, time())
+            elif window not in self.windows:
+                missing.append(window)
+
+        # Forget about windows that are no longer relevant
+        for window in set(self.windows) - set(windows):
+            del self.windows[window]
+
+        if missing:
+            raise IOError("Unable to fetch schedule for {} windows".format(len(missing)))
+
+    def gather_data(self):
+        """
+        Brings the schedule up to date and gets all of the data in the relevant range of dates.
+        Windows that could not be fetched this time use the data from the last time they were.
+        Returns:
+            list: The data from the website
+        """
+        with self.lock:
+            now = datetime.now()
+            self.refresh(now)
+
+            all_data, seen = [], set()
+            for window in sorted(self.windows):
+                for data in self.windows[window][0]:
+                    # An experiment can be returned in more than one window
+                    key = (data["instrument"], data["rbNumber"], data["scheduledDate"])
+                    if key not in seen:
+                        seen.add(key)
+                        all_data.append(data)
+            return all_data
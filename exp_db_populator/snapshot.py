@@ -0,0 +1,100 @@
+import gzip
+import json
+import logging
+import os
+from datetime import datetime
+from time import time
+
+SNAPSHOT_VERSION = 1  # Increase when the format of the snapshot changes
+MAX_SNAPSHOT_AGE = 7 * 24 * 60 * 60  # Time in seconds after which a snapshot is too old to use
+DATE_FIELDS = ["scheduledDate"]  # The fields of the web data that are dates
+
+
+def encode_data(data):
+    """
+    Converts an experiment from the web into a form that can be written as JSON.
+    """
+    return {
+        name: value.isoformat() if name in DATE_FIELDS and value is not None else value
+        for name, value in data.items()
+    }
+
+
+def decode_data(data):
+    """
+    Converts an experiment written by encode_data back into the form it came from the web in.
+    """
+    for name in DATE_FIELDS:
+        if data.get(name) is not None:
+            data[name] = datetime.fromisoformat(data[name])
+    return data
+
+
+class ScheduleSnapshot:
+    """
+    Keeps a compressed copy on disk of the last schedule successfully gathered from the website,
+    so that the instruments can be populated before the website responds when starting up, or
+    while it is down.
+    """
+
+    def __init__(self, file_path, max_age=MAX_SNAPSHOT_AGE):
+        """
+        Args:
+            file_path: The file to keep the snapshot in.
+            max_age: The time in seconds after which the snapshot is too old to use.
+        """
+        self.file_path = file_path
+        self.max_age = max_age
+
+    def save(self, raw_data):
+        """
+        Saves the schedule, replacing the file in one go so that it is never read half written.
+        Args:
+            raw_data: All of the raw data from the website.
+        """
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "created": time(),
+            "data": [encode_data(data) for data in raw_data],
+        }
+        temp_path = self.file_path + ".tmp"
+        try:
+            with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+                json.dump(snapshot, f, separators=(",", ":"))
+            os.replace(temp_path, self.file_path)
+        except OSError:
+            logging.exception("Unable to save schedule snapshot to {}".format(self.file_path))
+
+    def load(self):
+        """
+        Loads the schedule, if there is a snapshot that can be used.
+        Returns:
+            list: All of the raw data from the website when the snapshot was saved, or None if
+                there is no snapshot or it is unreadable, from another version or too old.
+        """
+        if not os.path.exists(self.file_path):
+            return None
+        try:
+            with gzip.open(self.file_path, "rt", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            if snapshot["version"] != SNAPSHOT_VERSION:
+                logging.warning(
+                    "Ignoring schedule snapshot from version {}".format(snapshot["version"])
+                )
+                return None
+            age = time() - snapshot["created"]
+            if age > self.max_age:
+                logging.warning(
+                    "Ignoring schedule snapshot from {:.1f} days ago".format(age / 86400)
+                )
+                return None
+            data = [decode_data(data) for data in snapshot["data"]]
+        except (OSError, EOFError, ValueError, KeyError, TypeError):
+            logging.exception("Unable to load schedule snapshot from {}".format(self.file_path))
+            return None
+        logging.info(
+            "Loaded schedule snapshot from {:.0f} minutes ago with {} experiments".format(
+                age / 60, len(data)
+            )
+        )
+        return data
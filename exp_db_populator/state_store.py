@@ -0,0 +1,59 @@
+import json
+import logging
+import os
+import threading
+
+
+class StateStore:
+    """
+    Keeps some state about each instrument, optionally persisted to a JSON file so that it
+    survives between runs.
+    """
+
+    def __init__(self, file_path=None):
+        """
+        Args:
+            file_path: The file to persist the state to, if None it is only kept in memory.
+        """
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        self.entries = self.load()
+
+    def load(self):
+        """
+        Loads the state from file.
+        Returns:
+            dict: The state keyed by instrument host name.
+        """
+        if self.file_path is None or not os.path.exists(self.file_path):
+            return {}
+        try:
+            with open(self.file_path) as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError):
+            logging.exception("Unable to load {}, starting afresh".format(self.file_path))
+            return {}
+
+    def forget(self, instrument_host):
+        """
+        Forgets the state of an instrument, e.g. because it is no longer scheduled.
+        Args:
+            instrument_host: The host name of the instrument.
+        """
+        with self.lock:
+            if self.entries.pop(instrument_host, None) is not None:
+                self.save()
+
+    def save(self):
+        """
+        Saves the state to file, if a file is being used. Should be called with the lock held.
+        """
+        if self.file_path is None:
+            return
+        temp_path = self.file_path + ".tmp"
+        try:
+            with open(temp_path, "w") as state_file:
+                json.dump(self.entries, state_file)
+            os.replace(temp_path, self.file_path)
+        except OSError:
+            logging.exception("Unable to save {}".format(self.file_path))
@@ -1,18 +1,23 @@
 # -*- coding: utf-8 -*-
 import logging
 import math
+import os
+import re
+import threading
 from datetime import datetime, timedelta
+from time import time
+from xml.etree.ElementTree import iterparse
 
 import requests
-from suds.client import Client
 
-from exp_db_populator.data_types import CREDS_GROUP, ExperimentTeamData, UserData
-from exp_db_populator.database_model import Experiment
-
-try:
-    from exp_db_populator.passwords.password_reader import get_credentials
-except ImportError:
-    logging.warn("Password submodule not found, will not be able to read from web")
+from exp_db_populator.credentials import get_credentials
+from exp_db_populator.data_types import (
+    CREDS_GROUP,
+    ExperimentData,
+    ExperimentTeamData,
+    UserData,
+)
+from exp_db_populator.metrics import metrics
 
 LOCAL_ORG = "Science and Technology Facilities Council"
 LOCAL_ROLE = "Contact"
@@ -25,6 +30,25 @@ BUS_APPS_API = BUS_APPS_SITE + "ws/ScheduleWebService?wsdl"
 
 SUCCESSFUL_LOGIN_STATUS_CODE = 201
 
+# Where the parsed web service definition is cached and how long for
+WSDL_CACHE_FOLDER = os.path.join(os.path.dirname(os.path.realpath(__file__)), "wsdl_cache")
+WSDL_CACHE_DAYS = 7
+CLIENT_LIFETIME = 24 * 60 * 60  # Time in seconds before a web client is recreated
+SESSION_LIFETIME = 60 * 60  # Time in seconds before logging in to the web services again
+REJECTED_SESSION_STATUS_CODES = (401, 403)
+WEB_TIMEOUT = 300  # Time in seconds to wait for the web service to respond
+
+# How to convert the fields of an experiment from the text in the web service response
+EXPERIMENT_FIELD_TYPES = {"part": int, "timeAllocated": float}
+# The fields of an experiment that can be repeated, which are always given as a list
+LIST_FIELDS = ["experimenters"]
+
+
+class SessionRejectedError(IOError):
+    """
+    Raised when the web service does not accept the session id it has been given.
+    """
+
 
 def get_start_and_end(date, time_range_days):
     days = timedelta(days=time_range_days)
@@ -32,33 +56,197 @@ def get_start_and_end(date, time_range_days):
 
 
 def get_experimenters(team):
+    if isinstance(team, dict):
+        return team.get("experimenters") or []
     try:
-        return team.experimenters
+        return team.experimenters or []
     except AttributeError:
         return []
 
 
-def create_date_range(client):
+def parse_date_time(value):
+    """
+    Parses a date and time from the web service. The timezone is ignored, as the instrument
+    databases don't store it.
+    Args:
+        value (str): The date and time in the xsd:dateTime format.
+    Returns:
+        datetime: The date and time.
+    """
+    match = re.match(r"(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(\.\d+)?", value.strip())
+    if match is None:
+        raise ValueError("Unrecognised date and time: {}".format(value))
+    date_time = datetime.strptime(match.group(1), DATE_TIME_FORMAT)
+    if match.group(2):
+        date_time = date_time.replace(microsecond=int(match.group(2)[1:7].ljust(6, "0")))
+    return date_time
+
+
+def local_name(tag):
+    """
+    Removes the namespace from an XML tag.
+    """
+    return tag.rpartition("}")[2]
+
+
+def element_to_experiment(element):
+    """
+    Converts an experiment element from the web service response into a dictionary.
+    Args:
+        element: The XML element for the experiment.
+    Returns:
+        dict: The experiment, with any experimenters as a list of dictionaries.
+    """
+    experiment = {name: [] for name in LIST_FIELDS}
+    for child in element:
+        name = local_name(child.tag)
+        if name in LIST_FIELDS:
+            if len(child):
+                experiment[name].append({local_name(field.tag): field.text for field in child})
+        elif len(child):
+            member = {local_name(field.tag): field.text for field in child}
+            experiment.setdefault(name, []).append(member)
+        elif child.text is None:
+            experiment[name] = None
+        elif name == "scheduledDate":
+            experiment[name] = parse_date_time(child.text)
+        else:
+            experiment[name] = EXPERIMENT_FIELD_TYPES.get(name, str)(child.text)
+    return experiment
+
+
+def parse_experiments(stream):
+    """
+    Incrementally parses the experiments out of a getExperimentsByDate response, so that the
+    whole response never needs to be held in memory.
+    Args:
+        stream: A file-like object containing the SOAP response.
+    Returns:
+        generator: The experiments, as dictionaries.
+    """
+    # Envelope > Body > getExperimentsByDateResponse > return
+    experiment_depth = 4
+    depth = 0
+    response_element = None
+    for event, element in iterparse(stream, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if depth == experiment_depth - 1:
+                response_element = element
+            continue
+
+        depth -= 1
+        if local_name(element.tag) == "Fault":
+            fault = {local_name(child.tag): child.text for child in element}
+            fault_string = fault.get("faultstring") or ""
+            error = SessionRejectedError if "session" in fault_string.lower() else IOError
+            raise error("Web service returned a fault: {}".format(fault_string))
+        elif depth == experiment_depth - 1 and local_name(response_element.tag) != "Fault":
+            yield element_to_experiment(element)
+            # Discard experiments once they have been parsed
+            response_element.remove(element)
+
+
+class CountingStream:
+    """
+    Wraps a file-like object, counting the bytes read from it.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+# The web clients that have been created, and when, keyed by the url of their definition
+web_clients = {}
+web_clients_lock = threading.Lock()
+
+
+def get_client(wsdl_url=BUS_APPS_API, cache_folder=WSDL_CACHE_FOLDER):
+    """
+    Gets a client for the web service. The client is reused between calls and its definition is
+    cached on disk, so the definition doesn't need to be downloaded and parsed every time.
+    Args:
+        wsdl_url: The url of the web service definition.
+        cache_folder: The folder to cache the web service definition in.
+    Returns:
+        Client: The web client.
+    """
+    # suds is only needed once the schedule is gathered, not e.g. when reformatting test data
+    from suds.cache import ObjectCache
+    from suds.client import Client
+
+    with web_clients_lock:
+        client, created = web_clients.get(wsdl_url, (None, 0))
+        if client is None or time() - created > CLIENT_LIFETIME:
+            cache = ObjectCache(location=cache_folder, days=WSDL_CACHE_DAYS)
+            # Caching policy 1 caches the fully parsed definition, rather than the raw documents
+            client = Client(wsdl_url, cache=cache, cachingpolicy=1)
+            web_clients[wsdl_url] = (client, time())
+        return client
+
+
+def clear_clients():
+    """
+    Forgets all the web clients, so that new ones are created next time.
+    """
+    with web_clients_lock:
+        web_clients.clear()
+
+
+def create_date_range(client, start=None, end=None):
     """
     Creates a date range in a format for the web client to understand.
+    Args:
+        client: The client that has connected to the web.
+        start (datetime): The start of the range, if None the whole relevant range is used.
+        end (datetime): The end of the range, if None the whole relevant range is used.
     """
     date_range = client.factory.create("dateRange")
-    start, end = get_start_and_end(datetime.now(), RELEVANT_DATE_RANGE)
+    if start is None or end is None:
+        start, end = get_start_and_end(datetime.now(), RELEVANT_DATE_RANGE)
     date_range.startDate = start.strftime(DATE_TIME_FORMAT)
     date_range.endDate = end.strftime(DATE_TIME_FORMAT)
     return date_range
 
 
-def connect():
+class WebSession:
     """
-    Connects to the busapps website.
-    Returns:
-        tuple: the client and the associated session id.
+    Keeps a session with the busapps web services between calls. The HTTP connection is pooled
+    and the session id reused, only logging in again when the session has expired or has been
+    rejected by the web service.
     """
-    try:
+
+    def __init__(self, lifetime=SESSION_LIFETIME):
+        """
+        Args:
+            lifetime: The time in seconds after which to log in again.
+        """
+        self.lifetime = lifetime
+        self.http_session = requests.Session()
+        self.session_id = None
+        self.logged_in_at = 0
+        self.lock = threading.Lock()
+
+    def login(self):
+        """
+        Logs in to the busapps web services.
+        Returns:
+            str: The new session id.
+        """
         username, password = get_credentials(CREDS_GROUP, "WebRead")
 
-        response = requests.post(BUS_APPS_AUTH, json={"username": username, "password": password})
+        with metrics.timer("web_auth"):
+            response = self.http_session.post(
+                BUS_APPS_AUTH,
+                json={"username": username, "password": password},
+                timeout=WEB_TIMEOUT,
+            )
 
         if response.status_code != SUCCESSFUL_LOGIN_STATUS_CODE:
             raise IOError(
@@ -66,31 +254,111 @@ def connect():
                 f"code={response.status_code}, resp={response.text}"
             )
 
-        session_id = response.json()["sessionId"]
-        client = Client(BUS_APPS_API)
+        self.session_id = response.json()["sessionId"]
+        self.logged_in_at = time()
+        return self.session_id
+
+    def get_session_id(self):
+        """
+        Gets the id of the current session, logging in if there isn't a valid one.
+        Returns:
+            str: The session id.
+        """
+        with self.lock:
+            if self.session_id is None or time() - self.logged_in_at > self.lifetime:
+                logging.info("Logging in to web services")
+                self.login()
+            return self.session_id
+
+    def invalidate(self, session_id=None):
+        """
+        Forgets the current session, so that the next request logs in again.
+        Args:
+            session_id: The session that was rejected. If given, the session is only forgotten
+                if it is still the current one, so that when several threads have it rejected
+                only the first logs in again and the rest use its new session.
+        """
+        with self.lock:
+            if session_id is None or session_id == self.session_id:
+                self.session_id = None
+
+
+# The session shared by everything talking to the busapps web services
+web_session = WebSession()
+
+
+def connect():
+    """
+    Connects to the busapps website.
+    Returns:
+        tuple: the client and the associated session id.
+    """
+    try:
+        session_id = web_session.get_session_id()
+        client = get_client()
 
         return client, session_id
     except Exception:
+        metrics.increment("failures", stage="web_connect")
         logging.exception("Error whilst trying to connect to web services:")
         raise
 
 
-def get_all_data_from_web(client, session_id):
+def stream_all_data_from_web(client, session_id, http_session=None, date_range=None):
     """
+    Gets the data from the website, parsing it as it arrives rather than building the whole
+    response in memory first.
     Args:
         client: The client that has connected to the web.
         session_id: The id of the web session.
+        http_session: The requests session to send the request with, if None a new connection
+            is made.
+        date_range: The range of dates to get the data for, if None the whole relevant range is
+            used.
 
     Returns:
-        list: The data from the website
+        generator: The data from the website
     """
     try:
-        date_range = create_date_range(client)
+        if date_range is None:
+            date_range = create_date_range(client)
+        method = client.service.getExperimentsByDate.method
+        envelope = method.binding.input.get_message(method, (session_id, "ISIS", date_range), {})
 
         logging.info("Gathering updated experiment data from server")
-        experiments = client.service.getExperimentsByDate(session_id, "ISIS", date_range)
-        return experiments
+        with metrics.timer("web_fetch"):
+            response = (http_session or requests).post(
+                method.location,
+                data=envelope.plain().encode("utf-8"),
+                headers={
+                    "Content-Type": "text/xml; charset=utf-8",
+                    "SOAPAction": method.soap.action,
+                },
+                stream=True,
+                timeout=WEB_TIMEOUT,
+            )
+            with response:
+                if response.status_code in REJECTED_SESSION_STATUS_CODES:
+                    raise SessionRejectedError(
+                        f"Web service rejected session, code={response.status_code}"
+                    )
+                # Faults are returned with a server error code, but still need to be parsed
+                if response.status_code not in (200, 500):
+                    raise IOError(
+                        f"Failed to get data from busapps web service, code={response.status_code}"
+                    )
+                response.raw.decode_content = True
+                payload = CountingStream(response.raw)
+                for experiment in parse_experiments(payload):
+                    metrics.increment("web_experiments")
+                    yield experiment
+                metrics.increment("web_payload_bytes", payload.bytes_read)
+                metrics.set("web_last_payload_bytes", payload.bytes_read)
+    except SessionRejectedError:
+        metrics.increment("failures", stage="web_fetch")
+        raise
     except Exception:
+        metrics.increment("failures", stage="web_fetch")
         logging.exception("Error gathering data from web services:")
         raise
 
@@ -103,6 +371,23 @@ def create_exp_team(user, role, rb_number, date):
     return ExperimentTeamData(user, role, rb_number, date)
 
 
+def intern_user(users, name, organisation):
+    """
+    Gets the record for a user, reusing the existing one if the user has been seen before.
+    Args:
+        users (dict): The records seen so far, keyed by (name, organisation).
+        name: The name of the user.
+        organisation: The organisation of the user.
+    Returns:
+        UserData: The record for the user.
+    """
+    key = (name, organisation)
+    user_data = users.get(key)
+    if user_data is None:
+        user_data = users[key] = UserData(name, organisation)
+    return user_data
+
+
 def reformat_data(instrument_data_list):
     """
     Reformats the data from the way the website returns it to the way the database wants it.
@@ -110,30 +395,29 @@ def reformat_data(instrument_data_list):
         instrument_data_list (list): List of an instrument's data from the website.
 
     Returns:
-        tuple (list, list): A list of the experiments and their associated data and a
-            list of the experiment teams, and a dictionary of rb_numbers and their associated
-            instrument.
+        tuple (list, list): A list of the experiments, as rows ready to insert into the
+            experiment table, and a list of the experiment teams.
     """
     try:
         experiments = []
         exp_teams = []
+        # Each user is only created once, however many experiments they are in
+        users = {}
 
         for data in instrument_data_list:
             experiments.append(
-                {
-                    Experiment.experimentid: data["rbNumber"],
-                    Experiment.startdate: data["scheduledDate"],
-                    Experiment.duration: math.ceil(data["timeAllocated"]),
-                }
+                ExperimentData(
+                    data["rbNumber"], data["scheduledDate"], math.ceil(data["timeAllocated"])
+                )
             )
 
-            user_data = UserData(data["lcName"], LOCAL_ORG)
+            user_data = intern_user(users, data["lcName"], LOCAL_ORG)
             exp_teams.append(
                 create_exp_team(user_data, "Contact", data["rbNumber"], data["scheduledDate"])
             )
 
             for user in get_experimenters(data):
-                user_data = UserData(user["name"], user["organisation"])
+                user_data = intern_user(users, user["name"], user["organisation"])
                 exp_teams.append(
                     create_exp_team(
                         user_data, user["role"], data["rbNumber"], data["scheduledDate"]
@@ -148,5 +432,42 @@ def reformat_data(instrument_data_list):
 
 def gather_data():
     client, session_id = connect()
-    data = get_all_data_from_web(client, session_id)
-    return data
+    return stream_data_with_session(client, session_id)
+
+
+def gather_data_between(start, end):
+    """
+    Gets the data from the website for a range of dates.
+    Args:
+        start (datetime): The start of the range.
+        end (datetime): The end of the range.
+    Returns:
+        list: The data from the website
+    """
+    client, session_id = connect()
+    date_range = create_date_range(client, start, end)
+    return list(stream_data_with_session(client, session_id, date_range))
+
+
+def stream_data_with_session(client, session_id, date_range=None):
+    """
+    Streams the data from the website using the shared web session. If the web service rejects
+    the session, logs in again and retries once.
+    Args:
+        client: The client that has connected to the web.
+        session_id: The id of the web session.
+        date_range: The range of dates to get the data for, if None the whole relevant range is
+            used.
+    Returns:
+        generator: The data from the website
+    """
+    try:
+        yield from stream_all_data_from_web(
+            client, session_id, web_session.http_session, date_range
+        )
+    except SessionRejectedError:
+        logging.info("Web session was rejected, logging in again")
+        web_session.invalidate(session_id)
+        yield from stream_all_data_from_web(
+            client, web_session.get_session_id(), web_session.http_session, date_range
+        )
@@ -3,5 +3,9 @@ venv="exp_db_populator_venv" # Name of the virtual environment
 
 . /home/epics/EPICS/config_env.sh
 source /home/epics/RB_num_populator/$venv/bin/activate # activate the virtual environment
-exp_db_populator
+# The digest and cleanup files keep track of what each run did, so that the next hourly run can
+# skip instruments whose data hasn't changed and only clean up instruments when it is due
+exp_db_populator --snapshot_file /home/epics/RB_num_populator/schedule_snapshot.json.gz \
+    --digest_file /home/epics/RB_num_populator/digests.json \
+    --cleanup_file /home/epics/RB_num_populator/cleanup.json
 deactivate # deactivate the virtual environment
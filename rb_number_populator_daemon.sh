@@ -0,0 +1,10 @@
+#!/bin/bash
+venv="exp_db_populator_venv" # Name of the virtual environment
+
+. /home/epics/EPICS/config_env.sh
+source /home/epics/RB_num_populator/$venv/bin/activate # activate the virtual environment
+# exec so that signals from the service manager reach the populator
+exec exp_db_populator --daemon --metrics_port 8000 \
+    --snapshot_file /home/epics/RB_num_populator/schedule_snapshot.json.gz \
+    --digest_file /home/epics/RB_num_populator/digests.json \
+    --cleanup_file /home/epics/RB_num_populator/cleanup.json
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from exp_db_populator.cleanup_scheduler import (
+    CLEANUP_INTERVAL,
+    FULL_CLEANUP_INTERVAL,
+    CleanupScheduler,
+)
+from exp_db_populator.populator import AGE_OF_EXPIRATION
+from mock import patch
+
+TEST_HOST = "NDXTEST"
+TEST_NOW = datetime(2020, 6, 1, 12, 0)
+
+
+@patch("exp_db_populator.cleanup_scheduler.time")
+class CleanupSchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = CleanupScheduler()
+
+    def expire_date(self, seconds_from_now):
+        return TEST_NOW + timedelta(seconds=seconds_from_now) - timedelta(days=AGE_OF_EXPIRATION)
+
+    def test_GIVEN_instrument_never_cleaned_WHEN_checked_THEN_cleanup_due(self, time):
+        time.return_value = TEST_NOW.timestamp()
+
+        self.assertTrue(self.scheduler.is_due(TEST_HOST))
+
+    def test_GIVEN_instrument_just_cleaned_WHEN_checked_THEN_cleanup_not_due(self, time):
+        time.return_value = TEST_NOW.timestamp()
+        self.scheduler.record_cleanup(TEST_HOST, self.expire_date(60))
+
+        self.assertFalse(self.scheduler.is_due(TEST_HOST))
+
+    def test_GIVEN_instrument_with_no_data_cleaned_long_ago_WHEN_checked_THEN_cleanup_due(
+        self, time
+    ):
+        time.return_value = TEST_NOW.timestamp()
+        self.scheduler.record_cleanup(TEST_HOST, None)
+
+        time.return_value = TEST_NOW.timestamp() + CLEANUP_INTERVAL
+        self.assertTrue(self.scheduler.is_due(TEST_HOST))
+
+    def test_GIVEN_oldest_data_has_expired_WHEN_checked_THEN_cleanup_due(self, time):
+        time.return_value = TEST_NOW.timestamp()
+        self.scheduler.record_cleanup(TEST_HOST, self.expire_date(60))
+
+        time.return_value = TEST_NOW.timestamp() + 60
+        self.assertTrue(self.scheduler.is_due(TEST_HOST))
+
+    def test_GIVEN_older_data_written_after_cleanup_WHEN_it_expires_THEN_cleanup_due(self, time):
+        time.return_value = TEST_NOW.timestamp()
+        self.scheduler.record_cleanup(TEST_HOST, self.expire_date(3600))
+        self.scheduler.record_start_date(TEST_HOST, self.expire_date(60))
+
+        time.return_value = TEST_NOW.timestamp() + 60
+        self.assertTrue(self.scheduler.is_due(TEST_HOST))
+
+    def test_GIVEN_newer_data_written_after_cleanup_WHEN_checked_THEN_expiry_unchanged(self, time):
+        time.return_value = TEST_NOW.timestamp()
+        self.scheduler.record_cleanup(TEST_HOST, self.expire_date(60))
+        self.scheduler.record_start_date(TEST_HOST, self.expire_date(3600))
+
+        time.return_value = TEST_NOW.timestamp() + 60
+        self.assertTrue(self.scheduler.is_due(TEST_HOST))
+
+    def test_GIVEN_instrument_never_cleaned_WHEN_checked_THEN_full_cleanup_due(self, time):
+        time.return_value = TEST_NOW.timestamp()
+
+        self.assertTrue(self.scheduler.is_full_cleanup_due(TEST_HOST))
+
+    def test_GIVEN_full_cleanup_then_partial_cleanups_WHEN_interval_passes_THEN_full_cleanup_due(
+        self, time
+    ):
+        time.return_value = TEST_NOW.timestamp()
+        self.scheduler.record_cleanup(TEST_HOST, None, full=True)
+        self.assertFalse(self.scheduler.is_full_cleanup_due(TEST_HOST))
+
+        time.return_value = TEST_NOW.timestamp() + FULL_CLEANUP_INTERVAL / 2
+        self.scheduler.record_cleanup(TEST_HOST, None)
+        self.assertFalse(self.scheduler.is_full_cleanup_due(TEST_HOST))
+
+        time.return_value = TEST_NOW.timestamp() + FULL_CLEANUP_INTERVAL
+        self.assertTrue(self.scheduler.is_full_cleanup_due(TEST_HOST))
+
+    def test_GIVEN_only_partial_cleanups_WHEN_checked_THEN_full_cleanup_due(self, time):
+        time.return_value = TEST_NOW.timestamp()
+        self.scheduler.record_cleanup(TEST_HOST, None)
+
+        self.assertTrue(self.scheduler.is_full_cleanup_due(TEST_HOST))
+
+    def test_GIVEN_cleanup_file_WHEN_new_scheduler_created_THEN_cleanups_loaded_from_file(
+        self, time
+    ):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        file_path = os.path.join(temp_dir.name, "cleanups.json")
+        time.return_value = TEST_NOW.timestamp()
+
+        CleanupScheduler(file_path).record_cleanup(TEST_HOST, self.expire_date(60))
+
+        self.assertFalse(CleanupScheduler(file_path).is_due(TEST_HOST))
@@ -0,0 +1,25 @@
+import subprocess
+import sys
+import unittest
+
+
+def run_cli(*args):
+    return subprocess.run(
+        [sys.executable, "-m", "exp_db_populator.cli"] + list(args),
+        capture_output=True,
+        text=True,
+    )
+
+
+class CliTests(unittest.TestCase):
+    def test_GIVEN_no_workers_WHEN_run_THEN_usage_error(self):
+        result = run_cli("--workers", "0")
+
+        self.assertEqual(2, result.returncode)
+        self.assertIn("--workers must be at least 1", result.stderr)
+
+    def test_GIVEN_negative_workers_WHEN_run_THEN_usage_error(self):
+        result = run_cli("--workers", "-1")
+
+        self.assertEqual(2, result.returncode)
+        self.assertIn("--workers must be at least 1", result.stderr)
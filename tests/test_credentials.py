@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+
+from exp_db_populator.credentials import CredentialsCache
+from mock import Mock
+
+
+class CredentialsCacheTests(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.password_file = os.path.join(temp_dir.name, "passwords.kdbx")
+        self.write_password_file(1)
+        self.reader = Mock(return_value=("user", "password"))
+        self.cache = CredentialsCache(self.reader, temp_dir.name)
+
+    def write_password_file(self, modified_time):
+        with open(self.password_file, "w") as password_file:
+            password_file.write("encrypted")
+        os.utime(self.password_file, (modified_time, modified_time))
+
+    def test_WHEN_credentials_requested_THEN_credentials_read(self):
+        self.assertEqual(("user", "password"), self.cache.get("GROUP", "ENTRY"))
+        self.reader.assert_called_once_with("GROUP", "ENTRY")
+
+    def test_GIVEN_credentials_read_WHEN_requested_again_THEN_not_read_again(self):
+        for _ in range(40):
+            self.cache.get("GROUP", "ENTRY")
+
+        self.reader.assert_called_once()
+
+    def test_GIVEN_credentials_read_WHEN_other_entry_requested_THEN_other_entry_read(self):
+        self.cache.get("GROUP", "ENTRY")
+        self.cache.get("GROUP", "OTHER")
+
+        self.assertEqual(2, self.reader.call_count)
+
+    def test_GIVEN_password_file_changed_WHEN_credentials_requested_THEN_read_again(self):
+        self.cache.get("GROUP", "ENTRY")
+
+        self.write_password_file(2)
+        self.cache.get("GROUP", "ENTRY")
+
+        self.assertEqual(2, self.reader.call_count)
+
+    def test_GIVEN_cache_invalidated_WHEN_credentials_requested_THEN_read_again(self):
+        self.cache.get("GROUP", "ENTRY")
+
+        self.cache.invalidate()
+        self.cache.get("GROUP", "ENTRY")
+
+        self.assertEqual(2, self.reader.call_count)
+
+    def test_GIVEN_no_password_reader_WHEN_credentials_requested_THEN_exception(self):
+        cache = CredentialsCache(None, self.cache.folder)
+
+        self.assertRaises(IOError, cache.get, "GROUP", "ENTRY")
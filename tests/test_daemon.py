@@ -0,0 +1,75 @@
+import signal
+import threading
+import unittest
+from time import time
+
+from exp_db_populator.daemon import RESTART_DELAY, SHUTDOWN_TIMEOUT, PopulatorDaemon
+from exp_db_populator.gatherer import Gatherer
+from exp_db_populator.runner import InstrumentPopulatorRunner
+from mock import Mock, patch
+
+
+class PopulatorDaemonTests(unittest.TestCase):
+    def setUp(self):
+        self.runner = Mock(InstrumentPopulatorRunner)
+        self.runner.gatherer = Mock(Gatherer)
+        self.runner.gatherer.is_alive.return_value = True
+        self.runner.prev_inst_list = [{"name": "TEST", "hostName": "NDXTEST", "isScheduled": True}]
+        self.daemon = PopulatorDaemon(self.runner)
+
+    def run_daemon(self):
+        with patch("exp_db_populator.daemon.signal.signal"):
+            thread = threading.Thread(target=self.daemon.run)
+            thread.start()
+        return thread
+
+    def test_WHEN_signal_handlers_installed_THEN_stop_and_reload_handled(self):
+        with patch("exp_db_populator.daemon.signal.signal") as set_handler:
+            self.daemon.install_signal_handlers()
+
+        set_handler.assert_any_call(signal.SIGTERM, self.daemon.handle_stop)
+        set_handler.assert_any_call(signal.SIGINT, self.daemon.handle_stop)
+        if hasattr(signal, "SIGHUP"):
+            set_handler.assert_any_call(signal.SIGHUP, self.daemon.handle_reload)
+
+    def test_GIVEN_daemon_running_WHEN_stop_signalled_THEN_runner_stopped(self):
+        thread = self.run_daemon()
+
+        self.daemon.handle_stop(signal.SIGTERM, None)
+        thread.join(5)
+
+        self.assertFalse(thread.is_alive())
+        self.runner.start_inst_list_monitor.assert_called_once()
+        self.runner.stop.assert_called_once_with(SHUTDOWN_TIMEOUT)
+
+    def test_GIVEN_daemon_running_WHEN_reload_signalled_THEN_runner_reloaded(self):
+        reloaded = threading.Event()
+        self.runner.reload.side_effect = lambda: reloaded.set()
+        thread = self.run_daemon()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(self.daemon.handle_stop, signal.SIGTERM, None)
+
+        self.daemon.handle_reload(signal.SIGHUP, None)
+
+        self.assertTrue(reloaded.wait(5))
+        self.runner.reload.assert_called_once()
+
+    def test_GIVEN_gatherer_stopped_WHEN_checked_THEN_gatherer_restarted(self):
+        self.runner.gatherer.is_alive.return_value = False
+
+        self.daemon.check_gatherer()
+
+        self.runner.start_gatherer.assert_called_once_with(self.runner.prev_inst_list)
+
+    def test_GIVEN_gatherer_recently_restarted_WHEN_stopped_again_THEN_not_restarted(self):
+        self.runner.gatherer.is_alive.return_value = False
+        self.daemon.last_restart = time() - RESTART_DELAY / 2
+
+        self.daemon.check_gatherer()
+
+        self.runner.start_gatherer.assert_not_called()
+
+    def test_GIVEN_gatherer_running_WHEN_checked_THEN_not_restarted(self):
+        self.daemon.check_gatherer()
+
+        self.runner.start_gatherer.assert_not_called()
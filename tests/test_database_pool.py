@@ -0,0 +1,96 @@
+import unittest
+
+from exp_db_populator.database_pool import DatabasePool
+from mock import Mock, patch
+from playhouse.pool import PooledMySQLDatabase
+
+
+@patch("exp_db_populator.database_pool.create_database")
+class DatabasePoolTests(unittest.TestCase):
+    def setUp(self):
+        self.databases = {}
+
+    def create_database(self, instrument_host, credentials, **kwargs):
+        self.databases[instrument_host] = Mock(PooledMySQLDatabase)
+        return self.databases[instrument_host]
+
+    def test_GIVEN_host_used_before_WHEN_database_requested_THEN_same_database_returned(
+        self, create_database
+    ):
+        create_database.side_effect = self.create_database
+        pool = DatabasePool()
+
+        first = pool.get("NDXTEST")
+        second = pool.get("NDXTEST")
+
+        self.assertIs(first, second)
+        create_database.assert_called_once()
+
+    def test_WHEN_database_requested_THEN_pooled_database_with_limited_connections_created(
+        self, create_database
+    ):
+        pool = DatabasePool(("user", "password"), connections_per_host=3)
+
+        pool.get("NDXTEST")
+
+        args, kwargs = create_database.call_args
+        self.assertEqual(("NDXTEST", ("user", "password")), args)
+        self.assertEqual(PooledMySQLDatabase, kwargs["database_class"])
+        self.assertEqual(3, kwargs["max_connections"])
+        self.assertIsNotNone(kwargs["stale_timeout"])
+
+    def test_GIVEN_connection_limit_reached_WHEN_new_host_requested_THEN_least_recently_used_closed(
+        self, create_database
+    ):
+        create_database.side_effect = self.create_database
+        pool = DatabasePool(connections_per_host=2, max_connections=4)
+        with patch("exp_db_populator.database_pool.time") as time:
+            for now, host in enumerate(["NDXONE", "NDXTWO", "NDXONE", "NDXTHREE"]):
+                time.return_value = now
+                pool.get(host)
+
+        self.databases["NDXTWO"].close_idle.assert_called_once()
+        self.databases["NDXONE"].close_idle.assert_not_called()
+        self.assertCountEqual(["NDXONE", "NDXTHREE"], pool.databases)
+
+    def test_GIVEN_many_instruments_WHEN_updated_for_two_cycles_THEN_no_database_recreated(
+        self, create_database
+    ):
+        create_database.side_effect = self.create_database
+        pool = DatabasePool()
+        hosts = ["NDX{}".format(i) for i in range(48)]
+
+        first_cycle = [pool.get(host) for host in hosts]
+        second_cycle = [pool.get(host) for host in hosts]
+
+        self.assertEqual(first_cycle, second_cycle)
+        self.assertEqual(len(hosts), create_database.call_count)
+        for database in first_cycle:
+            database.close_idle.assert_not_called()
+
+    def test_GIVEN_host_not_used_recently_WHEN_idle_removed_THEN_host_closed(self, create_database):
+        create_database.side_effect = self.create_database
+        pool = DatabasePool()
+        with patch("exp_db_populator.database_pool.time") as time:
+            time.return_value = 0
+            pool.get("NDXOLD")
+            time.return_value = 100
+            pool.get("NDXNEW")
+
+            pool.remove_idle(idle_timeout=50)
+
+        self.databases["NDXOLD"].close_idle.assert_called_once()
+        self.assertCountEqual(["NDXNEW"], pool.databases)
+
+    def test_GIVEN_host_in_pool_WHEN_discarded_THEN_connections_closed_and_host_forgotten(
+        self, create_database
+    ):
+        create_database.side_effect = self.create_database
+        pool = DatabasePool()
+        database = pool.get("NDXTEST")
+
+        pool.discard("NDXTEST")
+        pool.discard("NDXOTHER")
+
+        database.close_idle.assert_called_once()
+        self.assertIsNot(database, pool.get("NDXTEST"))
@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from exp_db_populator.digest_store import DigestStore, compute_digest
+from exp_db_populator.webservices_reader import reformat_data
+from exp_db_populator.webservices_test_data import (
+    TEST_DATA,
+    TEST_RBNUMBER,
+    TEST_TIMEALLOCATED,
+    create_data,
+)
+from mock import patch
+
+TEST_HOST = "NDXTEST"
+
+
+class DigestTests(unittest.TestCase):
+    def test_GIVEN_same_data_in_different_order_WHEN_digest_computed_THEN_digests_equal(self):
+        data = TEST_DATA + [create_data("20000", datetime(2018, 2, 1), 3)]
+
+        self.assertEqual(
+            compute_digest(reformat_data(data)), compute_digest(reformat_data(data[::-1]))
+        )
+
+    def test_GIVEN_changed_data_WHEN_digest_computed_THEN_digests_differ(self):
+        changed_data = [create_data(TEST_RBNUMBER, datetime(2018, 1, 1), TEST_TIMEALLOCATED + 1)]
+
+        self.assertNotEqual(
+            compute_digest(reformat_data(TEST_DATA)), compute_digest(reformat_data(changed_data))
+        )
+
+    def test_GIVEN_no_data_WHEN_digest_computed_THEN_digest_is_none(self):
+        self.assertIsNone(compute_digest(None))
+
+
+class DigestStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.digest = compute_digest(reformat_data(TEST_DATA))
+
+    def test_GIVEN_instrument_never_updated_WHEN_needs_update_checked_THEN_update_needed(self):
+        self.assertTrue(DigestStore().needs_update(TEST_HOST, self.digest))
+
+    def test_GIVEN_instrument_updated_with_same_data_WHEN_needs_update_checked_THEN_no_update_needed(
+        self,
+    ):
+        store = DigestStore()
+        store.record_update(TEST_HOST, self.digest)
+
+        self.assertFalse(store.needs_update(TEST_HOST, self.digest))
+
+    def test_GIVEN_instrument_updated_with_other_data_WHEN_needs_update_checked_THEN_update_needed(
+        self,
+    ):
+        store = DigestStore()
+        store.record_update(TEST_HOST, "other digest")
+
+        self.assertTrue(store.needs_update(TEST_HOST, self.digest))
+
+    def test_GIVEN_instrument_forgotten_WHEN_needs_update_checked_THEN_update_needed(self):
+        store = DigestStore()
+        store.record_update(TEST_HOST, self.digest)
+
+        store.forget(TEST_HOST)
+
+        self.assertTrue(store.needs_update(TEST_HOST, self.digest))
+
+    @patch("exp_db_populator.digest_store.time")
+    def test_GIVEN_instrument_updated_long_ago_WHEN_needs_update_checked_THEN_update_needed(
+        self, time
+    ):
+        store = DigestStore()
+        time.return_value = 0
+        store.record_update(TEST_HOST, self.digest)
+
+        time.return_value = 2 * 24 * 60 * 60
+        self.assertTrue(store.needs_update(TEST_HOST, self.digest))
+
+    def test_GIVEN_digest_file_WHEN_new_store_created_THEN_digests_loaded_from_file(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        file_path = os.path.join(temp_dir.name, "digests.json")
+
+        DigestStore(file_path).record_update(TEST_HOST, self.digest)
+
+        self.assertFalse(DigestStore(file_path).needs_update(TEST_HOST, self.digest))
+
+    def test_GIVEN_corrupt_digest_file_WHEN_new_store_created_THEN_update_needed(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        file_path = os.path.join(temp_dir.name, "digests.json")
+        with open(file_path, "w") as digest_file:
+            digest_file.write("not json")
+
+        self.assertTrue(DigestStore(file_path).needs_update(TEST_HOST, self.digest))
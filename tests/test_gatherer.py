@@ -1,13 +1,34 @@
 import threading
 import unittest
+from datetime import datetime
 
-from exp_db_populator.gatherer import Gatherer, filter_instrument_data
-from mock import patch
+from exp_db_populator.cleanup_scheduler import CleanupScheduler
+from exp_db_populator.database_pool import DatabasePool
+from exp_db_populator.digest_store import DigestStore
+from exp_db_populator.gatherer import (
+    Gatherer,
+    get_instrument_data,
+    index_by_instrument,
+)
+from exp_db_populator.snapshot import ScheduleSnapshot
+from exp_db_populator.webservices_reader import reformat_data
+from exp_db_populator.webservices_test_data import TEST_DATA
+from mock import ANY, Mock, patch
+
+
+def create_instrument_data(inst_name, scheduled_date=None):
+    data = dict(TEST_DATA[0], instrument=inst_name)
+    if scheduled_date is not None:
+        data["scheduledDate"] = scheduled_date
+    return [data]
 
 
 class GathererTests(unittest.TestCase):
     def setUp(self):
-        self.lock = threading.Lock()
+        patch_cleanup = patch("exp_db_populator.gatherer.cleanup")
+        self.cleanup = patch_cleanup.start()
+        self.cleanup.return_value = None
+        self.addCleanup(patch_cleanup.stop)
 
     @patch("exp_db_populator.gatherer.update")
     @patch("exp_db_populator.gatherer.gather_data")
@@ -26,7 +47,7 @@ class GathererTests(unittest.TestCase):
             }
         ]
 
-        new_gatherer = Gatherer(inst_list, self.lock, False)
+        new_gatherer = Gatherer(inst_list, False)
         new_gatherer.start()
         new_gatherer.join()
 
@@ -39,11 +60,12 @@ class GathererTests(unittest.TestCase):
         inst_list = [{"name": new_name, "hostName": new_host, "isScheduled": True}]
         gather_data.return_value = []
 
-        new_gatherer = Gatherer(inst_list, self.lock, False)
+        new_gatherer = Gatherer(inst_list, False)
         new_gatherer.start()
         new_gatherer.join()
 
-        update.assert_called_with(new_name, new_host, self.lock, None, False)
+        update.assert_not_called()
+        self.cleanup.assert_called_with(new_name, new_host, database=None, full=True)
 
     @patch("exp_db_populator.gatherer.update")
     @patch("exp_db_populator.gatherer.gather_data")
@@ -54,19 +76,389 @@ class GathererTests(unittest.TestCase):
         inst_list = [{"name": new_name, "hostName": new_host, "isScheduled": False}]
         gather_data.return_value = []
 
-        new_gatherer = Gatherer(inst_list, self.lock, False)
+        new_gatherer = Gatherer(inst_list, False)
+        new_gatherer.start()
+        new_gatherer.join()
+
+        update.assert_not_called()
+
+    @patch("exp_db_populator.gatherer.update")
+    @patch("exp_db_populator.gatherer.gather_data")
+    def test_GIVEN_multiple_scheduled_instruments_WHEN_gatherer_started_THEN_all_updated(
+        self, gather_data, update
+    ):
+        inst_list = [
+            {"name": "TEST_{}".format(i), "hostName": "NDXTEST_{}".format(i), "isScheduled": True}
+            for i in range(5)
+        ]
+        gather_data.return_value = sum(
+            (create_instrument_data(inst["name"]) for inst in inst_list), []
+        )
+
+        new_gatherer = Gatherer(inst_list, False, max_workers=3)
+        new_gatherer.start()
+        new_gatherer.join()
+
+        self.assertEqual(5, update.call_count)
+        updated_hosts = {call.args[1] for call in update.call_args_list}
+        self.assertEqual({inst["hostName"] for inst in inst_list}, updated_hosts)
+
+    @patch("exp_db_populator.gatherer.update")
+    @patch("exp_db_populator.gatherer.gather_data")
+    def test_GIVEN_one_instrument_fails_WHEN_gatherer_started_THEN_other_instruments_updated(
+        self, gather_data, update
+    ):
+        inst_list = [
+            {"name": "BAD", "hostName": "NDXBAD", "isScheduled": True},
+            {"name": "GOOD", "hostName": "NDXGOOD", "isScheduled": True},
+        ]
+        gather_data.return_value = create_instrument_data("BAD") + create_instrument_data("GOOD")
+
+        def fail_for_bad_host(name, host, *args):
+            if host == "NDXBAD":
+                raise IOError("Host unreachable")
+            return True
+
+        update.side_effect = fail_for_bad_host
+
+        new_gatherer = Gatherer(inst_list, False)
+        new_gatherer.start()
+        new_gatherer.join()
+
+        update.assert_any_call("GOOD", "NDXGOOD", ANY, False, upsert=False, database=None)
+
+    @patch("exp_db_populator.gatherer.update")
+    @patch("exp_db_populator.gatherer.gather_data")
+    def test_GIVEN_reformat_raises_for_one_instrument_WHEN_gatherer_started_THEN_others_updated(
+        self, gather_data, update
+    ):
+        inst_list = [
+            {"name": "BAD", "hostName": "NDXBAD", "isScheduled": True},
+            {"name": "GOOD", "hostName": "NDXGOOD", "isScheduled": True},
+        ]
+        gather_data.return_value = create_instrument_data("BAD") + create_instrument_data("GOOD")
+        update.return_value = True
+
+        def reformat_good_data(instrument_data_list):
+            if instrument_data_list[0]["instrument"] == "BAD":
+                raise ValueError("Bad data")
+            return reformat_data(instrument_data_list)
+
+        new_gatherer = Gatherer(inst_list, False)
+        with patch("exp_db_populator.gatherer.reformat_data", side_effect=reformat_good_data):
+            new_gatherer.start()
+            new_gatherer.join()
+
+        update.assert_called_once()
+        self.assertEqual("NDXGOOD", update.call_args.args[1])
+        # The cleanup phase still ran, so the exception didn't stop the gatherer
+        self.assertEqual(2, self.cleanup.call_count)
+
+    def test_GIVEN_task_times_out_WHEN_next_run_THEN_instrument_skipped_until_task_finished(self):
+        inst_list = [
+            {"name": "SLOW", "hostName": "NDXSLOW", "isScheduled": True},
+            {"name": "FAST", "hostName": "NDXFAST", "isScheduled": True},
+        ]
+        release = threading.Event()
+        self.addCleanup(release.set)
+        calls = []
+
+        def task(inst):
+            calls.append(inst["hostName"])
+            if inst["hostName"] == "NDXSLOW":
+                return release.wait(5)
+            return True
+
+        new_gatherer = Gatherer(inst_list, False)
+        with patch("exp_db_populator.gatherer.UPDATE_TIMEOUT", 0.1):
+            new_gatherer.run_for_instruments(task, inst_list, "Test")
+            new_gatherer.run_for_instruments(task, inst_list, "Test")
+        self.assertEqual(["NDXFAST", "NDXSLOW"], sorted(calls[:2]))
+        self.assertEqual(["NDXFAST"], calls[2:])
+
+        release.set()
+        new_gatherer.unfinished_tasks["NDXSLOW"].result(5)
+        new_gatherer.run_for_instruments(task, inst_list, "Test")
+        self.assertEqual(["NDXFAST", "NDXSLOW"], sorted(calls[3:]))
+
+    @patch("exp_db_populator.gatherer.update")
+    @patch("exp_db_populator.gatherer.gather_data")
+    def test_GIVEN_data_unchanged_since_last_update_WHEN_gatherer_rerun_THEN_no_update(
+        self, gather_data, update
+    ):
+        inst_list = [{"name": "TEST", "hostName": "NDXTEST", "isScheduled": True}]
+        gather_data.return_value = create_instrument_data("TEST")
+        update.return_value = True
+        digest_store = DigestStore()
+
+        for _ in range(2):
+            new_gatherer = Gatherer(inst_list, False, digest_store=digest_store)
+            new_gatherer.start()
+            new_gatherer.join()
+
+        update.assert_called_once()
+
+    @patch("exp_db_populator.gatherer.update")
+    @patch("exp_db_populator.gatherer.gather_data")
+    def test_GIVEN_previous_update_failed_WHEN_gatherer_rerun_THEN_update_retried(
+        self, gather_data, update
+    ):
+        inst_list = [{"name": "TEST", "hostName": "NDXTEST", "isScheduled": True}]
+        gather_data.return_value = create_instrument_data("TEST")
+        update.return_value = False
+        digest_store = DigestStore()
+
+        for _ in range(2):
+            new_gatherer = Gatherer(inst_list, False, digest_store=digest_store)
+            new_gatherer.start()
+            new_gatherer.join()
+
+        self.assertEqual(2, update.call_count)
+
+    @patch("exp_db_populator.gatherer.update")
+    @patch("exp_db_populator.gatherer.gather_data")
+    def test_GIVEN_instrument_recently_cleaned_WHEN_gatherer_rerun_THEN_not_cleaned_again(
+        self, gather_data, update
+    ):
+        inst_list = [{"name": "TEST", "hostName": "NDXTEST", "isScheduled": True}]
+        gather_data.return_value = create_instrument_data("TEST", datetime.now())
+        update.return_value = True
+        cleanup_scheduler = CleanupScheduler()
+
+        for _ in range(2):
+            new_gatherer = Gatherer(inst_list, False, cleanup_scheduler=cleanup_scheduler)
+            new_gatherer.start()
+            new_gatherer.join()
+
+        self.assertEqual(2, update.call_count)
+        self.cleanup.assert_called_once_with("TEST", "NDXTEST", database=None, full=True)
+
+    @patch("exp_db_populator.gatherer.update")
+    @patch("exp_db_populator.gatherer.gather_data")
+    def test_GIVEN_recent_full_cleanup_WHEN_instrument_cleaned_again_THEN_partial_cleanup_done(
+        self, gather_data, update
+    ):
+        inst_list = [{"name": "TEST", "hostName": "NDXTEST", "isScheduled": True}]
+        gather_data.return_value = []
+        cleanup_scheduler = CleanupScheduler()
+
+        new_gatherer = Gatherer(inst_list, False, cleanup_scheduler=cleanup_scheduler)
+        for _ in range(2):
+            new_gatherer.cleanup_instrument(inst_list[0])
+
+        self.assertEqual(
+            [True, False], [call.kwargs["full"] for call in self.cleanup.call_args_list]
+        )
+
+    @patch("exp_db_populator.gatherer.update")
+    @patch("exp_db_populator.gatherer.gather_data")
+    def test_GIVEN_cleanup_failed_WHEN_gatherer_rerun_THEN_cleanup_retried(
+        self, gather_data, update
+    ):
+        inst_list = [{"name": "TEST", "hostName": "NDXTEST", "isScheduled": True}]
+        gather_data.return_value = []
+        self.cleanup.side_effect = IOError("Host unreachable")
+        cleanup_scheduler = CleanupScheduler()
+
+        for _ in range(2):
+            new_gatherer = Gatherer(inst_list, False, cleanup_scheduler=cleanup_scheduler)
+            new_gatherer.start()
+            new_gatherer.join()
+
+        self.assertEqual(2, self.cleanup.call_count)
+
+    @patch("exp_db_populator.gatherer.update")
+    @patch("exp_db_populator.gatherer.gather_data")
+    def test_GIVEN_cleanup_failed_WHEN_gatherer_rerun_with_same_data_THEN_instrument_rewritten(
+        self, gather_data, update
+    ):
+        inst_list = [{"name": "TEST", "hostName": "NDXTEST", "isScheduled": True}]
+        gather_data.return_value = create_instrument_data("TEST")
+        update.return_value = True
+        self.cleanup.side_effect = IOError("Host unreachable")
+        digest_store = DigestStore()
+
+        for _ in range(2):
+            new_gatherer = Gatherer(inst_list, False, digest_store=digest_store)
+            new_gatherer.start()
+            new_gatherer.join()
+
+        self.assertEqual(2, update.call_count)
+
+    @patch("exp_db_populator.gatherer.update")
+    @patch("exp_db_populator.gatherer.gather_data")
+    def test_GIVEN_database_pool_WHEN_gatherer_started_THEN_pooled_database_used(
+        self, gather_data, update
+    ):
+        inst_list = [{"name": "TEST", "hostName": "NDXTEST", "isScheduled": True}]
+        gather_data.return_value = create_instrument_data("TEST")
+        database_pool = Mock(DatabasePool)
+
+        new_gatherer = Gatherer(inst_list, False, database_pool=database_pool)
         new_gatherer.start()
         new_gatherer.join()
 
+        database_pool.get.assert_called_with("NDXTEST")
+        self.assertEqual(database_pool.get.return_value, update.call_args.kwargs["database"])
+        self.assertEqual(database_pool.get.return_value, self.cleanup.call_args.kwargs["database"])
+
+    @patch("exp_db_populator.gatherer.update")
+    @patch("exp_db_populator.gatherer.gather_data")
+    def test_GIVEN_data_unchanged_WHEN_instrument_refreshed_THEN_instrument_updated_anyway(
+        self, gather_data, update
+    ):
+        inst_list = [{"name": "TEST", "hostName": "NDXTEST", "isScheduled": True}]
+        gather_data.return_value = create_instrument_data("TEST")
+        update.return_value = True
+        new_gatherer = Gatherer(inst_list, False)
+        new_gatherer.start()
+        new_gatherer.join()
+
+        self.assertTrue(new_gatherer.refresh_instrument("test"))
+
+        self.assertEqual(2, update.call_count)
+
+    @patch("exp_db_populator.gatherer.update")
+    @patch("exp_db_populator.gatherer.gather_data")
+    def test_GIVEN_unknown_instrument_WHEN_instrument_refreshed_THEN_nothing_updated(
+        self, gather_data, update
+    ):
+        inst_list = [{"name": "TEST", "hostName": "NDXTEST", "isScheduled": True}]
+        new_gatherer = Gatherer(inst_list, False)
+
+        self.assertFalse(new_gatherer.refresh_instrument("OTHER"))
+
+        gather_data.assert_not_called()
         update.assert_not_called()
 
-    def test_GIVEN_data_of_correct_instrument_WHEN_filter_called_THEN_data_accepted(self):
-        inst_name = "TEST_INSTRUMENT"
-        data_item = {"instrument": inst_name}
-        self.assertEqual(filter_instrument_data([data_item], inst_name), [data_item])
+    def test_GIVEN_refresh_requested_WHEN_waiting_for_next_cycle_THEN_instrument_refreshed(self):
+        new_gatherer = Gatherer([], True)
+
+        with patch.object(new_gatherer, "refresh_instrument") as refresh_instrument:
+            new_gatherer.request_refresh("TEST")
+            new_gatherer.request_refresh(None)
+            new_gatherer.wait_for_next_cycle(60)
+
+        refresh_instrument.assert_called_once_with("TEST")
+
+    @patch("exp_db_populator.gatherer.gather_data")
+    def test_GIVEN_poll_scheduler_WHEN_gatherer_running_THEN_scheduler_decides_wait(
+        self, gather_data
+    ):
+        gather_data.return_value = []
+        poll_scheduler = Mock()
+        poll_scheduler.next_interval.return_value = 30
+        new_gatherer = Gatherer([], True, poll_scheduler=poll_scheduler)
+
+        with patch.object(new_gatherer, "wait_for_next_cycle") as wait_for_next_cycle:
+            wait_for_next_cycle.side_effect = lambda interval: setattr(
+                new_gatherer, "running", False
+            )
+            new_gatherer.run()
+
+        poll_scheduler.next_interval.assert_called_once_with([])
+        wait_for_next_cycle.assert_called_once_with(30)
+
+    @patch("exp_db_populator.gatherer.update")
+    @patch("exp_db_populator.gatherer.gather_data")
+    def test_GIVEN_instrument_newly_scheduled_WHEN_list_changed_THEN_only_it_updated_from_last_data(
+        self, gather_data, update
+    ):
+        inst_list = [{"name": "OLD", "hostName": "NDXOLD", "isScheduled": True}]
+        gather_data.return_value = create_instrument_data("OLD") + create_instrument_data("NEW")
+        update.return_value = True
+        new_gatherer = Gatherer(inst_list, False)
+        new_gatherer.start()
+        new_gatherer.join()
+        update.reset_mock()
+
+        new_gatherer.set_inst_list(
+            inst_list + [{"name": "NEW", "hostName": "NDXNEW", "isScheduled": True}]
+        )
+        new_gatherer.request_refresh(None)
+        new_gatherer.wait_for_next_cycle(60)
+
+        gather_data.assert_called_once()
+        update.assert_called_once()
+        self.assertEqual("NDXNEW", update.call_args.args[1])
+
+    def test_GIVEN_instrument_no_longer_scheduled_WHEN_list_changed_THEN_it_is_forgotten(self):
+        inst_list = [{"name": "OLD", "hostName": "NDXOLD", "isScheduled": True}]
+        digest_store, database_pool = Mock(DigestStore), Mock(DatabasePool)
+        new_gatherer = Gatherer(
+            inst_list, True, digest_store=digest_store, database_pool=database_pool
+        )
+
+        new_gatherer.set_inst_list([dict(inst_list[0], isScheduled=False)])
+
+        digest_store.forget.assert_called_once_with("NDXOLD")
+        database_pool.discard.assert_called_once_with("NDXOLD")
+        self.assertTrue(new_gatherer.pending_tasks.empty())
+
+    @patch("exp_db_populator.gatherer.update")
+    @patch("exp_db_populator.gatherer.gather_data")
+    def test_GIVEN_website_down_WHEN_gatherer_started_THEN_instruments_updated_from_snapshot(
+        self, gather_data, update
+    ):
+        inst_list = [{"name": "TEST", "hostName": "NDXTEST", "isScheduled": True}]
+        gather_data.side_effect = IOError("Website down")
+        snapshot = Mock(ScheduleSnapshot)
+        snapshot.load.return_value = create_instrument_data("TEST")
+
+        new_gatherer = Gatherer(inst_list, False, snapshot=snapshot)
+        new_gatherer.start()
+        new_gatherer.join()
+
+        update.assert_called_once()
+        snapshot.save.assert_not_called()
+
+    @patch("exp_db_populator.gatherer.gather_data")
+    def test_GIVEN_website_up_WHEN_data_gathered_THEN_snapshot_saved(self, gather_data):
+        gather_data.return_value = create_instrument_data("TEST")
+        snapshot = Mock(ScheduleSnapshot)
+
+        Gatherer([], False, snapshot=snapshot).gather_all_data()
+
+        snapshot.save.assert_called_once_with(gather_data.return_value)
+
+    @patch("exp_db_populator.gatherer.update")
+    @patch("exp_db_populator.gatherer.gather_data")
+    def test_GIVEN_snapshot_WHEN_continuous_gatherer_started_THEN_updated_before_website_responds(
+        self, gather_data, update
+    ):
+        inst_list = [{"name": "TEST", "hostName": "NDXTEST", "isScheduled": True}]
+        snapshot = Mock(ScheduleSnapshot)
+        snapshot.load.return_value = create_instrument_data("TEST")
+        new_gatherer = Gatherer(inst_list, True, snapshot=snapshot)
+
+        def stop_gatherer():
+            new_gatherer.running = False
+            raise IOError("Website down")
+
+        gather_data.side_effect = stop_gatherer
+        new_gatherer.run()
+
+        self.assertEqual(1, update.call_count)
+        self.assertEqual(snapshot.load.return_value, new_gatherer.last_data)
+
+    def test_GIVEN_data_of_several_instruments_WHEN_indexed_THEN_data_grouped_by_instrument(self):
+        first, second, third = (
+            {"instrument": "FIRST", "rbNumber": 1},
+            {"instrument": "SECOND", "rbNumber": 2},
+            {"instrument": "FIRST", "rbNumber": 3},
+        )
+
+        data_index = index_by_instrument([first, second, third])
+
+        self.assertEqual({"FIRST": [first, third], "SECOND": [second]}, data_index)
+
+    def test_GIVEN_instrument_with_different_web_name_WHEN_data_looked_up_THEN_web_name_used(self):
+        data_item = {"instrument": "ENGIN-X"}
+        data_index = index_by_instrument([data_item])
+
+        self.assertEqual([data_item], get_instrument_data(data_index, "ENGINX"))
+
+    def test_GIVEN_instrument_with_no_data_WHEN_data_looked_up_THEN_empty_list(self):
+        data_index = index_by_instrument([{"instrument": "OTHER_INSTRUMENT"}])
 
-    def test_GIVEN_data_of_other_instrument_WHEN_filter_called_THEN_data_rejected(self):
-        inst_name = "TEST_INSTRUMENT"
-        other_name = "OTHER_INSTRUMENT"
-        data_item = {"instrument": other_name}
-        self.assertEqual(filter_instrument_data([data_item], inst_name), [])
+        self.assertEqual([], get_instrument_data(data_index, "TEST_INSTRUMENT"))
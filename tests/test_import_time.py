@@ -0,0 +1,24 @@
+import unittest
+
+from benchmarks.bench_import import (
+    HEAVY_MODULES,
+    IMPORT_TIME_BUDGET,
+    best_import_time,
+    measure_imports,
+)
+
+
+class ImportTimeTests(unittest.TestCase):
+    def test_WHEN_cli_imported_THEN_heavy_modules_not_imported(self):
+        imported = measure_imports("exp_db_populator.cli")
+
+        self.assertEqual([], [module for module in HEAVY_MODULES if module in imported])
+
+    def test_WHEN_cli_imported_THEN_import_within_budget(self):
+        self.assertLess(best_import_time("exp_db_populator.cli"), IMPORT_TIME_BUDGET)
+
+    def test_WHEN_runner_imported_THEN_epics_and_web_client_not_imported(self):
+        imported = measure_imports("exp_db_populator.runner")
+
+        for module in ["epics", "suds", "mock"]:
+            self.assertNotIn(module, imported)
@@ -1,7 +1,10 @@
 import unittest
+from time import time
 
-from exp_db_populator.cli import InstrumentPopulatorRunner
+from exp_db_populator.database_pool import DatabasePool
 from exp_db_populator.gatherer import Gatherer
+from exp_db_populator.metrics import Metrics
+from exp_db_populator.runner import MAX_CYCLE_AGE, InstrumentPopulatorRunner, compress_json
 from mock import Mock, patch
 
 
@@ -9,7 +12,7 @@ class MainTest(unittest.TestCase):
     def setUp(self):
         self.inst_pop_runner = InstrumentPopulatorRunner()
 
-    @patch("exp_db_populator.cli.Gatherer")
+    @patch("exp_db_populator.runner.Gatherer")
     def test_GIVEN_no_gatherer_running_WHEN_instrument_list_has_new_instrument_THEN_gatherer_starts(
         self, gatherer
     ):
@@ -22,8 +25,9 @@ class MainTest(unittest.TestCase):
 
         self.assertEqual(new_gather, self.inst_pop_runner.gatherer)
 
-    @patch("exp_db_populator.cli.InstrumentPopulatorRunner.remove_gatherer")
-    def test_WHEN_instrument_list_updated_THEN_gatherer_stopped_and_cleared(self, stop):
+    @patch("exp_db_populator.runner.Gatherer")
+    @patch("exp_db_populator.runner.InstrumentPopulatorRunner.remove_gatherer")
+    def test_WHEN_instrument_list_updated_THEN_gatherer_stopped_and_cleared(self, stop, gatherer):
         new_name, new_host = "TEST", "NDXTEST"
         self.inst_pop_runner.inst_list_changes(
             [{"name": new_name, "hostName": new_host, "isScheduled": True}]
@@ -43,3 +47,117 @@ class MainTest(unittest.TestCase):
         old_gatherer.join.assert_called()
         self.assertEqual(False, old_gatherer.running)
         self.assertEqual(None, self.inst_pop_runner.gatherer)
+
+    def test_GIVEN_continuous_gatherer_running_WHEN_instrument_list_changes_THEN_list_passed_on(
+        self,
+    ):
+        inst_pop_runner = InstrumentPopulatorRunner(run_continuous=True)
+        old_gatherer = Mock(Gatherer)
+        old_gatherer.is_alive.return_value = True
+        inst_pop_runner.gatherer = old_gatherer
+        new_inst_list = [{"name": "TEST", "hostName": "NDXTEST", "isScheduled": True}]
+
+        inst_pop_runner.inst_list_changes(new_inst_list)
+
+        old_gatherer.set_inst_list.assert_called_once_with(new_inst_list)
+        old_gatherer.join.assert_not_called()
+        self.assertEqual(old_gatherer, inst_pop_runner.gatherer)
+
+    @patch("exp_db_populator.runner.Gatherer")
+    def test_GIVEN_continuous_gatherer_stopped_WHEN_instrument_list_changes_THEN_new_gatherer_starts(
+        self, gatherer
+    ):
+        inst_pop_runner = InstrumentPopulatorRunner(run_continuous=True)
+        old_gatherer = Mock(Gatherer)
+        old_gatherer.is_alive.return_value = False
+        inst_pop_runner.gatherer = old_gatherer
+
+        inst_pop_runner.inst_list_changes([])
+
+        old_gatherer.set_inst_list.assert_not_called()
+        self.assertEqual(gatherer.return_value, inst_pop_runner.gatherer)
+
+    @patch("exp_db_populator.runner.clear_clients")
+    @patch("exp_db_populator.runner.web_session")
+    @patch("exp_db_populator.runner.credentials_cache")
+    @patch("epics.caget")
+    @patch("exp_db_populator.runner.Gatherer")
+    def test_WHEN_reload_THEN_caches_forgotten_and_gatherer_restarted_with_new_list(
+        self, gatherer, caget, credentials_cache, web_session, clear_clients
+    ):
+        inst_pop_runner = InstrumentPopulatorRunner(run_continuous=True)
+        inst_pop_runner.database_pool = Mock(DatabasePool)
+        old_gatherer = Mock(Gatherer)
+        inst_pop_runner.gatherer = old_gatherer
+        new_inst_list = [{"name": "TEST", "hostName": "NDXTEST", "isScheduled": True}]
+        caget.return_value = compress_json(new_inst_list)
+
+        inst_pop_runner.reload()
+
+        old_gatherer.join.assert_called()
+        credentials_cache.invalidate.assert_called()
+        web_session.invalidate.assert_called()
+        clear_clients.assert_called()
+        inst_pop_runner.database_pool.close_all.assert_called()
+        gatherer.assert_called_once()
+        self.assertEqual(new_inst_list, gatherer.call_args.args[0])
+        gatherer.return_value.start.assert_called_once()
+        self.assertEqual(new_inst_list, inst_pop_runner.prev_inst_list)
+        self.assertEqual(gatherer.return_value, inst_pop_runner.gatherer)
+
+    def test_GIVEN_gatherer_running_WHEN_stop_THEN_gatherer_stopped_and_connections_closed(self):
+        inst_pop_runner = InstrumentPopulatorRunner(run_continuous=True)
+        inst_pop_runner.database_pool = Mock(DatabasePool)
+        old_gatherer = Mock(Gatherer)
+        old_gatherer.running = True
+        old_gatherer.is_alive.return_value = False
+        inst_pop_runner.gatherer = old_gatherer
+
+        inst_pop_runner.stop(10)
+
+        old_gatherer.join.assert_called_once_with(10)
+        self.assertEqual(False, old_gatherer.running)
+        self.assertIsNone(inst_pop_runner.gatherer)
+        inst_pop_runner.database_pool.close_all.assert_called()
+
+    def create_running_gatherer(self, started):
+        self.inst_pop_runner.gatherer = Mock(Gatherer)
+        self.inst_pop_runner.gatherer.is_alive.return_value = True
+        self.inst_pop_runner.gatherer_started = started
+
+    @patch("exp_db_populator.runner.metrics", new_callable=Metrics)
+    def test_GIVEN_recent_cycle_WHEN_health_checked_THEN_healthy(self, metrics):
+        self.create_running_gatherer(time() - 2 * MAX_CYCLE_AGE)
+        metrics.set("last_cycle_time", time() - 10)
+
+        healthy, details = self.inst_pop_runner.get_health()
+
+        self.assertTrue(healthy)
+        self.assertTrue(details["gatherer_alive"])
+
+    @patch("exp_db_populator.runner.metrics", new_callable=Metrics)
+    def test_GIVEN_old_cycle_WHEN_health_checked_THEN_unhealthy(self, metrics):
+        self.create_running_gatherer(time() - 2 * MAX_CYCLE_AGE)
+        metrics.set("last_cycle_time", time() - 2 * MAX_CYCLE_AGE)
+
+        healthy, _ = self.inst_pop_runner.get_health()
+
+        self.assertFalse(healthy)
+
+    @patch("exp_db_populator.runner.metrics", new_callable=Metrics)
+    def test_GIVEN_new_gatherer_without_cycle_WHEN_health_checked_THEN_healthy(self, metrics):
+        self.create_running_gatherer(time() - 10)
+
+        healthy, _ = self.inst_pop_runner.get_health()
+
+        self.assertTrue(healthy)
+
+    @patch("exp_db_populator.runner.metrics", new_callable=Metrics)
+    def test_GIVEN_gatherer_stopped_WHEN_health_checked_THEN_unhealthy(self, metrics):
+        self.create_running_gatherer(time() - 10)
+        self.inst_pop_runner.gatherer.is_alive.return_value = False
+
+        healthy, details = self.inst_pop_runner.get_health()
+
+        self.assertFalse(healthy)
+        self.assertFalse(details["gatherer_alive"])
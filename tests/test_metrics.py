@@ -0,0 +1,183 @@
+import json
+import os
+import tempfile
+import unittest
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from exp_db_populator.metrics import Metrics, MetricsServer, write_json
+from mock import Mock, patch
+
+
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def get_timing(self, name, **labels):
+        return self.metrics.timings[(name, tuple(sorted(labels.items())))]
+
+    @patch("exp_db_populator.metrics.perf_counter")
+    def test_WHEN_code_timed_THEN_count_total_and_last_recorded(self, perf_counter):
+        perf_counter.side_effect = [0, 2, 10, 13]
+
+        with self.metrics.timer("populate", instrument="LARMOR"):
+            pass
+        with self.metrics.timer("populate", instrument="LARMOR"):
+            pass
+
+        self.assertEqual((2, 5, 3), self.get_timing("populate", instrument="LARMOR"))
+
+    def test_GIVEN_code_raises_WHEN_timed_THEN_timing_still_recorded(self):
+        with self.assertRaises(IOError):
+            with self.metrics.timer("web_fetch"):
+                raise IOError("Website down")
+
+        self.assertEqual(1, self.get_timing("web_fetch")[0])
+
+    def test_GIVEN_different_labels_WHEN_counter_incremented_THEN_counted_separately(self):
+        self.metrics.increment("failures", stage="populate", instrument="LARMOR")
+        self.metrics.increment("failures", instrument="LARMOR", stage="populate")
+        self.metrics.increment("failures", stage="populate", instrument="IRIS")
+
+        self.assertEqual(
+            {
+                ("failures", (("instrument", "LARMOR"), ("stage", "populate"))): 2,
+                ("failures", (("instrument", "IRIS"), ("stage", "populate"))): 1,
+            },
+            self.metrics.counters,
+        )
+
+    def test_GIVEN_counts_WHEN_recorded_THEN_each_added_to_its_counter(self):
+        self.metrics.record_counts({"teams_inserted": 3, "teams_deleted": 1}, instrument="IRIS")
+
+        data = self.metrics.to_dict()
+
+        self.assertCountEqual(
+            [
+                {"name": "teams_inserted", "labels": {"instrument": "IRIS"}, "value": 3},
+                {"name": "teams_deleted", "labels": {"instrument": "IRIS"}, "value": 1},
+            ],
+            data["counters"],
+        )
+
+    def test_GIVEN_metrics_WHEN_prometheus_text_created_THEN_metrics_included(self):
+        self.metrics.increment("failures", stage="web_fetch")
+        self.metrics.set("web_last_payload_bytes", 100)
+        self.metrics.observe("populate", 1.5, instrument="LARMOR")
+
+        lines = self.metrics.to_prometheus().splitlines()
+
+        self.assertIn("# TYPE exp_db_populator_failures_total counter", lines)
+        self.assertIn('exp_db_populator_failures_total{stage="web_fetch"} 1', lines)
+        self.assertIn("exp_db_populator_web_last_payload_bytes 100", lines)
+        self.assertIn("# TYPE exp_db_populator_populate_seconds summary", lines)
+        self.assertIn('exp_db_populator_populate_seconds_count{instrument="LARMOR"} 1', lines)
+        self.assertIn('exp_db_populator_populate_seconds_sum{instrument="LARMOR"} 1.5', lines)
+        self.assertIn('exp_db_populator_populate_last_seconds{instrument="LARMOR"} 1.5', lines)
+
+    def test_GIVEN_label_with_quotes_WHEN_prometheus_text_created_THEN_label_escaped(self):
+        self.metrics.increment("failures", instrument='A "B"')
+
+        self.assertIn('{instrument="A \\"B\\""}', self.metrics.to_prometheus())
+
+    def test_GIVEN_exporter_fails_WHEN_exported_THEN_other_exporters_still_called(self):
+        failing, working = Mock(side_effect=IOError("Disk full")), Mock()
+        self.metrics.add_exporter(failing)
+        self.metrics.add_exporter(working)
+
+        self.metrics.export()
+
+        working.assert_called_once_with(self.metrics)
+
+    def test_WHEN_written_to_file_THEN_file_contains_metrics_as_json(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        file_path = os.path.join(temp_dir.name, "metrics.json")
+        self.metrics.observe("cycle", 10)
+
+        write_json(file_path, self.metrics)
+
+        with open(file_path) as f:
+            timings = json.load(f)["timings"]
+        self.assertEqual(
+            [{"name": "cycle", "labels": {}, "count": 1, "total": 10, "last": 10}], timings
+        )
+
+    def test_GIVEN_server_running_WHEN_metrics_requested_THEN_metrics_returned(self):
+        self.metrics.increment("failures")
+        server = MetricsServer(self.metrics, 0, "localhost")
+        server.start()
+        self.addCleanup(server.stop)
+        url = "http://localhost:{}".format(server.port)
+
+        with urlopen(url + "/metrics") as response:
+            self.assertIn("exp_db_populator_failures_total 1", response.read().decode())
+        with urlopen(url + "/metrics.json") as response:
+            self.assertEqual(1, json.load(response)["counters"][0]["value"])
+        with self.assertRaises(HTTPError):
+            urlopen(url + "/other")
+
+    def test_GIVEN_server_running_WHEN_refresh_posted_THEN_refresh_requested(self):
+        refresh = Mock()
+        server = MetricsServer(self.metrics, 0, "localhost", refresh=refresh)
+        server.start()
+        self.addCleanup(server.stop)
+        url = "http://localhost:{}/refresh".format(server.port)
+
+        with urlopen(Request(url + "?instrument=LARMOR", method="POST")) as response:
+            self.assertEqual(202, response.status)
+        with urlopen(Request(url, method="POST")):
+            pass
+
+        self.assertEqual([(("LARMOR",),), ((None,),)], refresh.call_args_list)
+
+    def test_GIVEN_remote_client_WHEN_refresh_posted_THEN_refresh_forbidden(self):
+        refresh = Mock()
+        server = MetricsServer(self.metrics, 0, refresh=refresh)
+        server.start()
+        self.addCleanup(server.stop)
+        url = "http://localhost:{}/refresh".format(server.port)
+
+        with patch("exp_db_populator.metrics.ipaddress.ip_address") as ip_address:
+            ip_address.return_value.is_loopback = False
+            with self.assertRaises(HTTPError) as error:
+                urlopen(Request(url, method="POST"))
+
+        self.assertEqual(403, error.exception.code)
+        refresh.assert_not_called()
+
+    def test_WHEN_server_created_THEN_only_listens_on_this_machine(self):
+        server = MetricsServer(self.metrics, 0)
+        self.addCleanup(server.http_server.server_close)
+
+        self.assertEqual("127.0.0.1", server.http_server.server_address[0])
+
+    def test_GIVEN_health_check_WHEN_health_requested_THEN_status_reflects_health(self):
+        health = Mock(return_value=(True, {"gatherer_alive": True}))
+        server = MetricsServer(self.metrics, 0, "localhost", health=health)
+        server.start()
+        self.addCleanup(server.stop)
+        url = "http://localhost:{}/health".format(server.port)
+
+        with urlopen(url) as response:
+            self.assertEqual(200, response.status)
+            self.assertEqual({"gatherer_alive": True, "healthy": True}, json.load(response))
+        health.return_value = (False, {"gatherer_alive": False})
+        with self.assertRaises(HTTPError) as error:
+            urlopen(url)
+        self.assertEqual(503, error.exception.code)
+
+    def test_GIVEN_no_health_check_WHEN_health_requested_THEN_not_found(self):
+        server = MetricsServer(self.metrics, 0, "localhost")
+        server.start()
+        self.addCleanup(server.stop)
+
+        with self.assertRaises(HTTPError) as error:
+            urlopen("http://localhost:{}/health".format(server.port))
+        self.assertEqual(404, error.exception.code)
+
+    def test_GIVEN_gauge_set_WHEN_get_THEN_value_returned(self):
+        self.metrics.set("last_cycle_time", 10, instrument="LARMOR")
+
+        self.assertEqual(10, self.metrics.get("last_cycle_time", instrument="LARMOR"))
+        self.assertIsNone(self.metrics.get("last_cycle_time"))
@@ -0,0 +1,114 @@
+import unittest
+from datetime import datetime, timedelta
+
+from exp_db_populator.poll_scheduler import (
+    BACKOFF_FACTOR,
+    PollScheduler,
+    compute_payload_digest,
+    get_start_dates,
+)
+
+TEST_NOW = datetime(2020, 6, 1, 12, 0)
+MIN_INTERVAL, BASE_INTERVAL, MAX_INTERVAL = 600, 3600, 7200
+
+
+def create_web_data(scheduled_date, rb_number=1000, time_allocated=1, instrument="TEST"):
+    return {
+        "instrument": instrument,
+        "rbNumber": rb_number,
+        "scheduledDate": scheduled_date,
+        "timeAllocated": time_allocated,
+        "lcName": "TEST",
+    }
+
+
+class PollSchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = PollScheduler(MIN_INTERVAL, MAX_INTERVAL, BASE_INTERVAL)
+        self.data = [create_web_data(TEST_NOW + timedelta(days=10))]
+
+    def test_GIVEN_same_data_in_other_order_WHEN_digest_computed_THEN_digests_match(self):
+        data = [create_web_data(TEST_NOW, 1), create_web_data(TEST_NOW, 2)]
+
+        self.assertEqual(compute_payload_digest(data), compute_payload_digest(data[::-1]))
+
+    def test_GIVEN_changed_data_WHEN_digest_computed_THEN_digests_differ(self):
+        changed = [create_web_data(TEST_NOW + timedelta(days=10), time_allocated=2)]
+
+        self.assertNotEqual(compute_payload_digest(self.data), compute_payload_digest(changed))
+
+    def test_GIVEN_experiments_WHEN_start_dates_found_THEN_instrument_and_date_of_each(self):
+        data = [create_web_data(TEST_NOW, 1), create_web_data(TEST_NOW, 2, instrument="OTHER")]
+        data.append(create_web_data(None, 3))
+
+        self.assertEqual({("TEST", TEST_NOW), ("OTHER", TEST_NOW)}, get_start_dates(data))
+
+    def test_GIVEN_first_poll_WHEN_interval_calculated_THEN_hourly(self):
+        self.assertEqual(BASE_INTERVAL, self.scheduler.next_interval(self.data, TEST_NOW))
+
+    def test_GIVEN_data_unchanged_WHEN_interval_calculated_THEN_interval_backs_off(self):
+        self.scheduler.next_interval(self.data, TEST_NOW)
+
+        self.assertEqual(
+            min(BASE_INTERVAL * BACKOFF_FACTOR, MAX_INTERVAL),
+            self.scheduler.next_interval(self.data, TEST_NOW),
+        )
+
+    def test_GIVEN_data_unchanged_after_change_WHEN_interval_calculated_THEN_hourly(self):
+        self.scheduler.next_interval(self.data, TEST_NOW)
+        changed = self.data + [create_web_data(TEST_NOW + timedelta(days=20), 2000)]
+        self.scheduler.next_interval(changed, TEST_NOW)
+
+        self.assertEqual(BASE_INTERVAL, self.scheduler.next_interval(changed, TEST_NOW))
+
+    def test_GIVEN_data_unchanged_for_a_long_time_WHEN_interval_calculated_THEN_longest_interval(
+        self,
+    ):
+        for _ in range(10):
+            interval = self.scheduler.next_interval(self.data, TEST_NOW)
+
+        self.assertEqual(MAX_INTERVAL, interval)
+
+    def test_GIVEN_data_changed_after_backing_off_WHEN_interval_calculated_THEN_shortest_interval(
+        self,
+    ):
+        for _ in range(10):
+            self.scheduler.next_interval(self.data, TEST_NOW)
+
+        changed = self.data + [create_web_data(TEST_NOW + timedelta(days=20), 2000)]
+
+        self.assertEqual(MIN_INTERVAL, self.scheduler.next_interval(changed, TEST_NOW))
+
+    def test_GIVEN_many_instruments_with_experiments_starting_soon_WHEN_unchanged_THEN_backs_off(
+        self,
+    ):
+        # Experiments on 40 instruments, one starting every couple of hours
+        data = [
+            create_web_data(
+                TEST_NOW + timedelta(hours=2 * i), 1000 + i, instrument="INST{}".format(i)
+            )
+            for i in range(40)
+        ]
+        intervals = [self.scheduler.next_interval(data, TEST_NOW) for _ in range(5)]
+
+        self.assertTrue(all(interval >= BASE_INTERVAL for interval in intervals))
+        self.assertEqual(MAX_INTERVAL, intervals[-1])
+
+    def test_GIVEN_start_date_moved_to_soon_WHEN_unchanged_THEN_polled_hourly(self):
+        self.scheduler.next_interval(self.data, TEST_NOW)
+        moved = [create_web_data(TEST_NOW + timedelta(hours=1))]
+
+        intervals = [self.scheduler.next_interval(moved, TEST_NOW) for _ in range(5)]
+
+        self.assertEqual([MIN_INTERVAL] + [BASE_INTERVAL] * 4, intervals)
+
+    def test_GIVEN_moved_experiment_has_started_WHEN_unchanged_THEN_backs_off(self):
+        self.scheduler.next_interval(self.data, TEST_NOW)
+        start = TEST_NOW + timedelta(hours=1)
+        moved = [create_web_data(start)]
+        self.scheduler.next_interval(moved, TEST_NOW)
+
+        for _ in range(5):
+            interval = self.scheduler.next_interval(moved, start + timedelta(minutes=1))
+
+        self.assertEqual(MAX_INTERVAL, interval)
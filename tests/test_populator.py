@@ -1,11 +1,17 @@
+import os
+import tempfile
 import threading
 import unittest
 from datetime import datetime
-from time import sleep
 
 import exp_db_populator.database_model as model
-from exp_db_populator.data_types import ExperimentTeamData, UserData
+from exp_db_populator.data_types import ExperimentData, ExperimentTeamData, UserData
+from exp_db_populator.metrics import Metrics
 from exp_db_populator.populator import (
+    cleanup,
+    cleanup_old_data,
+    get_batch_size,
+    get_user_ids,
     populate,
     remove_experiments_not_referenced,
     remove_old_experiment_teams,
@@ -15,12 +21,13 @@ from exp_db_populator.populator import (
 from exp_db_populator.webservices_test_data import (
     TEST_DATE,
     TEST_INSTRUMENT,
+    TEST_PI_NAME,
     TEST_PI_ROLE,
     TEST_RBNUMBER,
     TEST_TIMEALLOCATED,
     TEST_USER_PI,
 )
-from mock import Mock, patch
+from mock import patch
 from peewee import SqliteDatabase
 
 
@@ -38,8 +45,6 @@ class PopulatorTests(unittest.TestCase):
         patch_db.return_value = database
         patch_db.start()
 
-        self.lock = threading.Lock()
-
         self.addCleanup(patch_db.stop)
 
     def create_full_record(
@@ -117,25 +122,14 @@ class PopulatorTests(unittest.TestCase):
         self.assertEqual(1, model.Experiment.select().count())
 
     def create_experiments_dictionary(self):
-        return [
-            {
-                model.Experiment.experimentid: TEST_RBNUMBER,
-                model.Experiment.duration: TEST_TIMEALLOCATED,
-                model.Experiment.startdate: TEST_DATE,
-            }
-        ]
+        return [ExperimentData(TEST_RBNUMBER, TEST_DATE, TEST_TIMEALLOCATED)]
 
     def create_rb_instrument_dictionary(self):
         return {TEST_RBNUMBER: TEST_INSTRUMENT}
 
     def create_experiment_teams_dictionary(self):
-        exp_team_data = Mock(ExperimentTeamData)
-        exp_team_data.rb_number = TEST_RBNUMBER
-        exp_team_data.role_id = self.role.roleid
-        exp_team_data.start_date = TEST_DATE
-        exp_team_data.user = Mock(UserData)
-        exp_team_data.user.user_id = 1
-        return [exp_team_data]
+        user = UserData(TEST_PI_NAME, "STFC")
+        return [ExperimentTeamData(user, TEST_PI_ROLE, TEST_RBNUMBER, TEST_DATE)]
 
     def test_WHEN_populate_called_with_experiments_and_no_teams_THEN_exception_raised(self):
         experiments = self.create_experiments_dictionary()
@@ -178,6 +172,216 @@ class PopulatorTests(unittest.TestCase):
         self.assertEqual(1, db_experiments.count())
         self.assertEqual(TEST_TIMEALLOCATED, db_experiments[0].duration)
 
+    def test_GIVEN_team_with_unknown_role_WHEN_populate_called_THEN_exception_raised_and_nothing_written(
+        self,
+    ):
+        experiments = self.create_experiments_dictionary()
+        user = UserData(TEST_PI_NAME, "STFC")
+        experiment_teams = [ExperimentTeamData(user, "Unknown", TEST_RBNUMBER, TEST_DATE)]
+
+        self.assertRaises(model.Role.DoesNotExist, populate, experiments, experiment_teams)
+        self.assertEqual(0, model.Experiment.select().count())
+        self.assertEqual(0, model.User.select().count())
+
+    def test_GIVEN_empty_database_WHEN_user_ids_requested_THEN_users_created_once(self):
+        users = [UserData("John Doe", "STFC"), UserData("Jane Doe", "STFC")]
+
+        user_ids = get_user_ids(users + [UserData("John Doe", "STFC")])
+
+        self.assertEqual(2, model.User.select().count())
+        for user in model.User.select():
+            self.assertEqual(user.userid, user_ids[(user.name, user.organisation)])
+
+    def test_GIVEN_user_exists_WHEN_user_ids_requested_THEN_existing_id_used(self):
+        existing_user = model.User.create(name="John Doe", organisation="STFC")
+
+        user_ids = get_user_ids([UserData("John Doe", "STFC"), UserData("John Doe", "ISIS")])
+
+        self.assertEqual(2, model.User.select().count())
+        self.assertEqual(existing_user.userid, user_ids[("John Doe", "STFC")])
+        self.assertNotEqual(existing_user.userid, user_ids[("John Doe", "ISIS")])
+
+    def test_GIVEN_user_exists_with_other_case_and_spaces_WHEN_user_ids_requested_THEN_reused(self):
+        existing_user = model.User.create(name="John Doe", organisation="STFC")
+
+        user_ids = get_user_ids([UserData("John Doe", "stfc"), UserData("John Doe", "STFC  ")])
+
+        self.assertEqual(1, model.User.select().count())
+        self.assertEqual(existing_user.userid, user_ids[("John Doe", "stfc")])
+        self.assertEqual(existing_user.userid, user_ids[("John Doe", "STFC  ")])
+
+    def test_GIVEN_new_users_differing_only_in_case_WHEN_user_ids_requested_THEN_one_user_created(
+        self,
+    ):
+        user_ids = get_user_ids([UserData("John Doe", "STFC"), UserData("John Doe", "Stfc")])
+
+        self.assertEqual(1, model.User.select().count())
+        self.assertEqual(user_ids[("John Doe", "STFC")], user_ids[("John Doe", "Stfc")])
+
+    def test_GIVEN_database_matches_user_key_does_not_WHEN_user_ids_requested_THEN_existing_id_used(
+        self,
+    ):
+        existing_user = model.User.create(name="John Doe", organisation="STFC")
+
+        # Simulates the database considering values the same that user_key doesn't
+        with patch("exp_db_populator.populator.user_key", side_effect=lambda *user: object()):
+            user_ids = get_user_ids([UserData("John Doe", "STFC")])
+
+        self.assertEqual(1, model.User.select().count())
+        self.assertEqual(existing_user.userid, user_ids[("John Doe", "STFC")])
+
+    def test_GIVEN_users_in_many_experiments_WHEN_populate_called_THEN_each_user_added_once(self):
+        user = UserData(TEST_PI_NAME, "STFC")
+        experiments, experiment_teams = [], []
+        for day in range(1, 4):
+            start_date = datetime(2018, 1, day)
+            experiments.append(ExperimentData(TEST_RBNUMBER, start_date, TEST_TIMEALLOCATED))
+            experiment_teams.append(
+                ExperimentTeamData(user, TEST_PI_ROLE, TEST_RBNUMBER, start_date)
+            )
+
+        populate(experiments, experiment_teams)
+
+        self.assertEqual(1, model.User.select().count())
+        self.assertEqual(3, model.Experimentteams.select().count())
+
+    def test_GIVEN_data_already_populated_WHEN_populate_called_again_THEN_nothing_written(self):
+        experiments = self.create_experiments_dictionary()
+        experiment_teams = self.create_experiment_teams_dictionary()
+        populate(experiments, experiment_teams)
+
+        changes = populate(experiments, experiment_teams)
+
+        self.assertEqual(0, sum(changes.values()))
+        self.assertEqual(1, model.Experiment.select().count())
+        self.assertEqual(1, model.Experimentteams.select().count())
+
+    def test_GIVEN_experiment_duration_changed_WHEN_populate_called_THEN_only_experiment_updated(
+        self,
+    ):
+        experiments = self.create_experiments_dictionary()
+        experiment_teams = self.create_experiment_teams_dictionary()
+        populate(experiments, experiment_teams)
+
+        experiments[0] = experiments[0]._replace(duration=TEST_TIMEALLOCATED + 1)
+        changes = populate(experiments, experiment_teams)
+
+        self.assertEqual(1, changes["experiments_updated"])
+        self.assertEqual(0, changes["experiments_inserted"])
+        self.assertEqual(0, changes["teams_inserted"])
+        self.assertEqual(TEST_TIMEALLOCATED + 1, model.Experiment.select()[0].duration)
+
+    def test_GIVEN_user_removed_from_team_WHEN_populate_called_THEN_user_removed_from_experiment(
+        self,
+    ):
+        experiments = self.create_experiments_dictionary()
+        experiment_teams = self.create_experiment_teams_dictionary()
+        removed_user = UserData("Remove Me", "STFC")
+        populate(
+            experiments,
+            experiment_teams
+            + [ExperimentTeamData(removed_user, TEST_PI_ROLE, TEST_RBNUMBER, TEST_DATE)],
+        )
+        self.assertEqual(2, model.Experimentteams.select().count())
+
+        changes = populate(experiments, experiment_teams)
+
+        self.assertEqual(1, changes["teams_deleted"])
+        self.assertEqual(1, changes["users_deleted"])
+        self.assertEqual(1, model.User.select().count())
+        teams = model.Experimentteams.select()
+        self.assertEqual(1, teams.count())
+        self.assertEqual(TEST_PI_NAME, teams[0].userid.name)
+
+    def test_GIVEN_users_removed_from_several_teams_WHEN_populate_called_THEN_removed_in_one_delete(
+        self,
+    ):
+        other_date = datetime(2020, 1, 2)
+        experiments = self.create_experiments_dictionary() + [
+            ExperimentData(TEST_RBNUMBER, other_date, TEST_TIMEALLOCATED)
+        ]
+        experiment_teams = self.create_experiment_teams_dictionary() + [
+            ExperimentTeamData(
+                UserData(TEST_PI_NAME, "STFC"), TEST_PI_ROLE, TEST_RBNUMBER, other_date
+            )
+        ]
+        removed_users = [UserData("Remove Me", "STFC"), UserData("Remove Me Too", "STFC")]
+        populate(
+            experiments,
+            experiment_teams
+            + [
+                ExperimentTeamData(user, TEST_PI_ROLE, TEST_RBNUMBER, date)
+                for user in removed_users
+                for date in [TEST_DATE, other_date]
+            ],
+        )
+        self.assertEqual(6, model.Experimentteams.select().count())
+
+        database = model.database_proxy.obj
+        with patch.object(database, "execute_sql", wraps=database.execute_sql) as execute_sql:
+            changes = populate(experiments, experiment_teams)
+
+        team_deletes = [
+            call
+            for call in execute_sql.call_args_list
+            if call.args[0].startswith('DELETE FROM "experimentteams"')
+        ]
+        self.assertEqual(1, len(team_deletes))
+        self.assertEqual(4, changes["teams_deleted"])
+        self.assertEqual(2, model.Experimentteams.select().count())
+        self.assertEqual(2, changes["users_deleted"])
+
+    def test_GIVEN_experiment_duration_changed_WHEN_populate_called_with_upsert_THEN_experiment_updated(
+        self,
+    ):
+        experiments = self.create_experiments_dictionary()
+        experiment_teams = self.create_experiment_teams_dictionary()
+        populate(experiments, experiment_teams, upsert=True)
+
+        experiments[0] = experiments[0]._replace(duration=TEST_TIMEALLOCATED + 1)
+        experiments.append(ExperimentData("20000", TEST_DATE, 1))
+        changes = populate(experiments, experiment_teams, upsert=True)
+
+        self.assertEqual(1, changes["experiments_updated"])
+        self.assertEqual(1, changes["experiments_inserted"])
+        durations = {exp.experimentid: exp.duration for exp in model.Experiment.select()}
+        self.assertEqual({TEST_RBNUMBER: TEST_TIMEALLOCATED + 1, "20000": 1}, durations)
+
+    def test_GIVEN_many_experiments_WHEN_populate_called_THEN_all_written(self):
+        experiments = [ExperimentData(str(rb_number), TEST_DATE, 1) for rb_number in range(1000)]
+        user = UserData(TEST_PI_NAME, "STFC")
+        experiment_teams = [
+            ExperimentTeamData(user, TEST_PI_ROLE, str(rb_number), TEST_DATE)
+            for rb_number in range(1000)
+        ]
+
+        populate(experiments, experiment_teams)
+
+        self.assertEqual(1000, model.Experiment.select().count())
+        self.assertEqual(1000, model.Experimentteams.select().count())
+
+    def test_GIVEN_no_packet_limit_WHEN_batch_size_chosen_THEN_parameter_limit_respected(self):
+        rows = [("name", "organisation")] * 2000
+
+        self.assertEqual(499, get_batch_size(rows, 2, None))
+
+    def test_GIVEN_packet_limit_WHEN_batch_size_chosen_THEN_batch_fits_in_packet(self):
+        rows = [("a" * 92,)] * 2000
+
+        self.assertEqual(50, get_batch_size(rows, 1, 10000))
+
+    def test_GIVEN_few_rows_WHEN_batch_size_chosen_THEN_all_rows_in_one_batch(self):
+        rows = [("name", "organisation")] * 10
+
+        self.assertEqual(10, get_batch_size(rows, 2, 64 * 1024 * 1024))
+
+    def test_GIVEN_team_of_experiment_not_in_data_WHEN_populate_called_THEN_team_kept(self):
+        self.create_full_record(rb_number="20000")
+
+        populate(self.create_experiments_dictionary(), self.create_experiment_teams_dictionary())
+
+        self.assertEqual(2, model.Experimentteams.select().count())
+
     def test_GIVEN_an_old_experiment_WHEN_remove_old_experiments_called_THEN_experiment_teams_removed(
         self,
     ):
@@ -196,18 +400,191 @@ class PopulatorTests(unittest.TestCase):
         remove_old_experiment_teams(1)
         self.assertEqual(1, model.Experimentteams.select().count())
 
+    def test_GIVEN_unreferenced_user_not_in_candidates_WHEN_unreferenced_removed_THEN_user_remains(
+        self,
+    ):
+        model.User.create(name="Not checked", organisation="STFC")
+        checked = model.User.create(name="Checked", organisation="STFC")
+
+        removed = remove_users_not_referenced(candidates={checked.userid})
+
+        self.assertEqual(1, removed)
+        self.assertEqual("Not checked", model.User.select()[0].name)
+
+    def test_GIVEN_old_and_recent_experiments_WHEN_cleanup_called_THEN_only_old_data_removed(
+        self,
+    ):
+        self.create_full_record(rb_number="1", user_name="Old", startdate=datetime(1980, 1, 1))
+        self.create_full_record(rb_number="2", user_name="New", startdate=datetime.now())
+
+        removed = cleanup_old_data()
+
+        self.assertEqual(
+            {"teams_removed": 1, "experiments_removed": 1, "users_removed": 1}, removed
+        )
+        self.assertEqual("2", model.Experiment.select()[0].experimentid)
+        self.assertEqual("New", model.User.select()[0].name)
+
+    def test_GIVEN_unreferenced_user_not_in_old_team_WHEN_cleanup_called_THEN_only_full_cleanup_removes_it(
+        self,
+    ):
+        self.create_full_record(startdate=datetime.now())
+        model.User.create(name="Unreferenced", organisation="STFC")
+
+        self.assertEqual(0, cleanup_old_data()["users_removed"])
+        self.assertEqual(1, cleanup_old_data(full=True)["users_removed"])
+        self.assertEqual(1, model.User.select().count())
+
+    def test_GIVEN_old_and_recent_experiments_WHEN_instrument_cleaned_up_THEN_oldest_remaining_date_returned(
+        self,
+    ):
+        # Use a database file as the connection is closed after cleaning up
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        database = SqliteDatabase(os.path.join(temp_dir.name, "test.db"))
+        recent_date = datetime.now().replace(microsecond=0)
+        with model.bind_database(database):
+            database.create_tables(
+                [model.User, model.Experimentteams, model.Experiment, model.Role]
+            )
+            self.role = model.Role.create(name=TEST_PI_ROLE, priority=1)
+            self.create_full_record(rb_number="1", user_name="Old", startdate=datetime(1980, 1, 1))
+            self.create_full_record(rb_number="2", user_name="New", startdate=recent_date)
+
+        with patch("exp_db_populator.populator.create_database") as create_database:
+            create_database.return_value = database
+            oldest_start_date = cleanup("", "")
+
+        self.assertEqual(recent_date, oldest_start_date)
+        with model.bind_database(database):
+            self.assertEqual(1, model.Experimentteams.select().count())
+
+    @patch("exp_db_populator.populator.cleanup_old_data")
+    def test_GIVEN_full_cleanup_requested_WHEN_instrument_cleaned_up_THEN_full_cleanup_done(
+        self, cleanup_old_data
+    ):
+        cleanup_old_data.return_value = {}
+
+        cleanup("", "", database=model.database_proxy.obj, full=True)
+
+        cleanup_old_data.assert_called_once_with(full=True)
+
     @patch("exp_db_populator.populator.populate")
     @patch("exp_db_populator.populator.cleanup_old_data")
-    def test_GIVEN_db_locked_WHEN_populate_runs_THEN_does_not_write_to_db(self, clean, pop):
-        clean.side_effect = lambda: 0
-        pop.side_effect = lambda x, y: 0
+    def test_GIVEN_update_succeeds_WHEN_update_called_THEN_returns_true(self, clean, pop):
+        self.assertTrue(update("", "", ([], [])))
 
-        thread_one = threading.Thread(target=update, args=("", "", self.lock, ([], [])))
+    @patch("exp_db_populator.populator.populate")
+    @patch("exp_db_populator.populator.cleanup_old_data")
+    def test_GIVEN_populate_fails_WHEN_update_called_THEN_returns_false(self, clean, pop):
+        pop.side_effect = KeyError("Experiment without team or vice versa")
+        self.assertFalse(update("", "", ([], [])))
+
+    @patch("exp_db_populator.populator.metrics", new_callable=Metrics)
+    def test_GIVEN_update_succeeds_WHEN_update_called_THEN_changes_and_timings_recorded(
+        self, metrics
+    ):
+        data = (self.create_experiments_dictionary(), self.create_experiment_teams_dictionary())
 
-        with self.lock:
-            thread_one.start()
-            sleep(0.5)
-            pop.assert_not_called()
+        self.assertTrue(update("LARMOR", "", data, database=model.database_proxy.obj))
 
-        thread_one.join()
-        pop.assert_called()
+        labels = (("instrument", "LARMOR"),)
+        self.assertEqual(1, metrics.counters[("experiments_inserted", labels)])
+        self.assertEqual(1, metrics.counters[("teams_inserted", labels)])
+        self.assertEqual(1, metrics.timings[("database_connect", labels)][0])
+        self.assertEqual(1, metrics.timings[("populate", labels)][0])
+
+    @patch("exp_db_populator.populator.metrics", new_callable=Metrics)
+    @patch("exp_db_populator.populator.populate")
+    def test_GIVEN_populate_fails_WHEN_update_called_THEN_failure_recorded(self, pop, metrics):
+        pop.side_effect = KeyError("Experiment without team or vice versa")
+
+        update("LARMOR", "", ([], []), database=model.database_proxy.obj)
+
+        labels = (("instrument", "LARMOR"), ("stage", "populate"))
+        self.assertEqual(1, metrics.counters[("failures", labels)])
+
+    def test_GIVEN_database_bound_in_another_thread_WHEN_models_used_THEN_this_threads_database_used(
+        self,
+    ):
+        main_database = model.database_proxy.obj
+        other_database = SqliteDatabase(":memory:")
+
+        other_thread = threading.Thread(
+            target=model.database_proxy.initialize, args=(other_database,)
+        )
+        other_thread.start()
+        other_thread.join()
+
+        self.assertIs(main_database, model.database_proxy.obj)
+        model.User.create(name="John Doe", organisation="STFC")
+        self.assertEqual(1, model.User.select().count())
+
+    def test_GIVEN_explicit_database_WHEN_populate_called_THEN_that_database_populated(self):
+        other_database = SqliteDatabase(":memory:")
+        with model.bind_database(other_database):
+            other_database.create_tables(
+                [model.User, model.Experimentteams, model.Experiment, model.Role]
+            )
+            model.Role.create(name=TEST_PI_ROLE, priority=1)
+
+        populate(
+            self.create_experiments_dictionary(),
+            self.create_experiment_teams_dictionary(),
+            other_database,
+        )
+
+        self.assertEqual(0, model.Experiment.select().count())
+        with model.bind_database(other_database):
+            self.assertEqual(1, model.Experiment.select().count())
+            self.assertEqual(1, model.Experimentteams.select().count())
+
+    def test_GIVEN_populate_fails_part_way_WHEN_update_called_THEN_nothing_written(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        database = SqliteDatabase(os.path.join(temp_dir.name, "test.db"))
+        with model.bind_database(database):
+            database.create_tables(
+                [model.User, model.Experimentteams, model.Experiment, model.Role]
+            )
+            model.Role.create(name=TEST_PI_ROLE, priority=1)
+
+        data = (self.create_experiments_dictionary(), self.create_experiment_teams_dictionary())
+        with patch("exp_db_populator.populator.create_database") as create_database:
+            create_database.return_value = database
+            with patch("exp_db_populator.populator.remove_users_not_referenced") as remove_users:
+                remove_users.side_effect = IOError("Connection lost")
+                self.assertFalse(update("", "", data))
+
+        with model.bind_database(database):
+            self.assertEqual(0, model.Experiment.select().count())
+            self.assertEqual(0, model.Experimentteams.select().count())
+            self.assertEqual(0, model.User.select().count())
+
+    def test_GIVEN_two_instruments_WHEN_updated_at_same_time_THEN_each_database_populated(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        databases = {}
+        for host in ["NDXONE", "NDXTWO"]:
+            databases[host] = SqliteDatabase(os.path.join(temp_dir.name, host + ".db"))
+            with model.bind_database(databases[host]):
+                databases[host].create_tables(
+                    [model.User, model.Experimentteams, model.Experiment, model.Role]
+                )
+                model.Role.create(name=TEST_PI_ROLE, priority=1)
+
+        data = (self.create_experiments_dictionary(), self.create_experiment_teams_dictionary())
+        with patch("exp_db_populator.populator.create_database") as create_database:
+            create_database.side_effect = lambda host, credentials: databases[host]
+            threads = [
+                threading.Thread(target=update, args=(host, host, data)) for host in databases
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        for database in databases.values():
+            with model.bind_database(database):
+                self.assertEqual(1, model.Experiment.select().count())
+                self.assertEqual(1, model.Experimentteams.select().count())
@@ -0,0 +1,137 @@
+import unittest
+from datetime import datetime, timedelta
+
+from exp_db_populator.schedule_cache import (
+    DISTANT_REFRESH_INTERVAL,
+    WINDOW_DAYS,
+    ScheduleCache,
+    get_windows,
+)
+from exp_db_populator.webservices_reader import RELEVANT_DATE_RANGE
+from mock import patch
+
+TEST_NOW = datetime(2020, 6, 1, 12, 0)
+
+
+def create_web_data(scheduled_date, rb_number=1000, instrument="TEST"):
+    return {
+        "instrument": instrument,
+        "rbNumber": rb_number,
+        "scheduledDate": scheduled_date,
+        "timeAllocated": 1,
+        "lcName": "TEST",
+    }
+
+
+class FakeWebsite:
+    def __init__(self, experiments):
+        self.experiments = experiments
+        self.requested = []
+        self.failing = False
+        # Returned whatever the window, like experiments that started earlier but are still running
+        self.extra = []
+
+    def fetch_window(self, start, end):
+        self.requested.append((start, end))
+        if self.failing:
+            raise IOError("Website down")
+        # The website includes experiments that start on the last day of the window
+        in_window = [exp for exp in self.experiments if start <= exp["scheduledDate"] <= end]
+        return self.extra + in_window
+
+
+@patch("exp_db_populator.schedule_cache.datetime")
+class ScheduleCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.website = FakeWebsite([create_web_data(TEST_NOW)])
+        self.cache = ScheduleCache(self.website.fetch_window)
+
+    def test_WHEN_windows_created_THEN_they_cover_exactly_the_relevant_range_without_gaps(self, dt):
+        windows = get_windows(TEST_NOW)
+
+        self.assertEqual(windows[0][0], TEST_NOW - timedelta(days=RELEVANT_DATE_RANGE))
+        self.assertEqual(windows[-1][1], TEST_NOW + timedelta(days=RELEVANT_DATE_RANGE))
+        for (_, previous_end), (next_start, _) in zip(windows, windows[1:]):
+            self.assertEqual(previous_end, next_start)
+
+    def test_GIVEN_time_moves_on_WHEN_windows_created_THEN_existing_windows_are_the_same(self, dt):
+        windows = get_windows(TEST_NOW)
+        later_windows = get_windows(TEST_NOW + timedelta(days=WINDOW_DAYS))
+
+        # Apart from the ones cut short at the ends of the range
+        self.assertEqual(windows[2:-1], later_windows[1:-2])
+
+    def test_GIVEN_empty_cache_WHEN_data_gathered_THEN_all_windows_fetched(self, dt):
+        dt.now.return_value = TEST_NOW
+
+        data = self.cache.gather_data()
+
+        self.assertCountEqual(self.website.requested, get_windows(TEST_NOW))
+        self.assertEqual(data, [create_web_data(TEST_NOW)])
+
+    def test_GIVEN_full_cache_WHEN_data_gathered_again_THEN_only_near_windows_fetched(self, dt):
+        dt.now.return_value = TEST_NOW
+        self.cache.gather_data()
+        self.website.requested = []
+
+        self.cache.gather_data()
+
+        self.assertTrue(self.website.requested)
+        self.assertLess(len(self.website.requested), len(get_windows(TEST_NOW)))
+        for start, end in self.website.requested:
+            self.assertLess(abs(start - TEST_NOW), timedelta(days=30))
+
+    @patch("exp_db_populator.schedule_cache.time")
+    def test_GIVEN_full_cache_WHEN_distant_windows_are_old_THEN_all_windows_fetched(self, time, dt):
+        dt.now.return_value = TEST_NOW
+        time.return_value = 0
+        self.cache.gather_data()
+        self.website.requested = []
+
+        time.return_value = DISTANT_REFRESH_INTERVAL + 1
+        self.cache.gather_data()
+
+        self.assertCountEqual(self.website.requested, get_windows(TEST_NOW))
+
+    def test_GIVEN_experiment_on_window_boundary_WHEN_data_gathered_THEN_returned_once(self, dt):
+        dt.now.return_value = TEST_NOW
+        boundary = get_windows(TEST_NOW)[5][1]
+        self.website.experiments = [create_web_data(boundary)]
+
+        data = self.cache.gather_data()
+
+        self.assertEqual(data, [create_web_data(boundary)])
+
+    def test_GIVEN_website_returns_experiment_outside_window_WHEN_data_gathered_THEN_kept(self, dt):
+        dt.now.return_value = TEST_NOW
+        earlier_date = TEST_NOW - timedelta(days=RELEVANT_DATE_RANGE + 1)
+        self.website.extra = [create_web_data(earlier_date)]
+
+        data = self.cache.gather_data()
+
+        self.assertCountEqual(data, [create_web_data(earlier_date), create_web_data(TEST_NOW)])
+
+    def test_GIVEN_website_down_on_first_fetch_WHEN_data_gathered_THEN_exception(self, dt):
+        dt.now.return_value = TEST_NOW
+        self.website.failing = True
+
+        self.assertRaises(IOError, self.cache.gather_data)
+
+    def test_GIVEN_website_down_after_first_fetch_WHEN_data_gathered_THEN_old_data_used(self, dt):
+        dt.now.return_value = TEST_NOW
+        self.cache.gather_data()
+        self.website.failing = True
+
+        data = self.cache.gather_data()
+
+        self.assertEqual(data, [create_web_data(TEST_NOW)])
+
+    def test_GIVEN_time_moves_on_WHEN_data_gathered_THEN_old_windows_forgotten(self, dt):
+        dt.now.return_value = TEST_NOW
+        self.cache.gather_data()
+
+        later = TEST_NOW + timedelta(days=5 * WINDOW_DAYS)
+        dt.now.return_value = later
+        self.cache.gather_data()
+
+        self.assertCountEqual(self.cache.windows.keys(), get_windows(later))
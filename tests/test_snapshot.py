@@ -0,0 +1,56 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from exp_db_populator.snapshot import SNAPSHOT_VERSION, ScheduleSnapshot
+from exp_db_populator.webservices_test_data import TEST_USER_1, create_data
+from mock import patch
+
+
+class ScheduleSnapshotTests(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.file_path = os.path.join(temp_dir.name, "snapshot.json.gz")
+        self.snapshot = ScheduleSnapshot(self.file_path, max_age=60)
+        self.data = [dict(create_data("1000", datetime(2020, 1, 1, 9, 30), 1.5))]
+        self.data[0]["experimenters"] = [TEST_USER_1]
+
+    def test_GIVEN_no_snapshot_WHEN_loaded_THEN_none(self):
+        self.assertIsNone(self.snapshot.load())
+
+    def test_GIVEN_snapshot_saved_WHEN_loaded_THEN_same_data_returned(self):
+        self.snapshot.save(self.data)
+
+        self.assertEqual(self.data, ScheduleSnapshot(self.file_path).load())
+
+    @patch("exp_db_populator.snapshot.time")
+    def test_GIVEN_old_snapshot_WHEN_loaded_THEN_none(self, time):
+        time.return_value = 1000
+        self.snapshot.save(self.data)
+
+        time.return_value = 1061
+
+        self.assertIsNone(self.snapshot.load())
+
+    def test_GIVEN_snapshot_from_other_version_WHEN_loaded_THEN_none(self):
+        self.snapshot.save(self.data)
+        with gzip.open(self.file_path, "rt") as f:
+            snapshot = json.load(f)
+        snapshot["version"] = SNAPSHOT_VERSION + 1
+        with gzip.open(self.file_path, "wt") as f:
+            json.dump(snapshot, f)
+
+        self.assertIsNone(self.snapshot.load())
+
+    def test_GIVEN_corrupt_snapshot_WHEN_loaded_THEN_none(self):
+        self.snapshot.save(self.data)
+        with open(self.file_path, "rb") as f:
+            contents = f.read()
+        with open(self.file_path, "wb") as f:
+            f.write(contents[: len(contents) // 2])
+
+        self.assertIsNone(self.snapshot.load())
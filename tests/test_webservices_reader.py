@@ -1,15 +1,28 @@
+import io
+import os
+import tempfile
 import unittest
 from datetime import datetime, timedelta
 
 from exp_db_populator.data_types import ExperimentTeamData, UserData
-from exp_db_populator.database_model import Experiment
+from exp_db_populator.metrics import Metrics
 from exp_db_populator.webservices_reader import (
     LOCAL_ORG,
     LOCAL_ROLE,
+    SESSION_LIFETIME,
+    SUCCESSFUL_LOGIN_STATUS_CODE,
+    SessionRejectedError,
+    WebSession,
+    clear_clients,
     create_exp_team,
+    get_client,
     get_experimenters,
     get_start_and_end,
+    parse_date_time,
+    parse_experiments,
     reformat_data,
+    stream_all_data_from_web,
+    stream_data_with_session,
 )
 from exp_db_populator.webservices_test_data import (
     TEST_CONTACT_NAME,
@@ -31,7 +44,10 @@ from exp_db_populator.webservices_test_data import (
     create_web_data_with_experimenters_and_other_date,
     get_test_experiment_team,
 )
-from mock import MagicMock
+from mock import MagicMock, patch
+from suds.client import Client
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
 
 
 class WebServicesReaderTests(unittest.TestCase):
@@ -52,6 +68,33 @@ class WebServicesReaderTests(unittest.TestCase):
         team = MagicMock(spec=["NOT_EXPERIMENTEERS"])
         self.assertEqual([], get_experimenters(team))
 
+    def test_GIVEN_experimenters_none_WHEN_get_experimenters_THEN_empty_list(self):
+        self.assertEqual([], get_experimenters({"experimenters": None}))
+
+    def test_GIVEN_experiment_without_experimenters_WHEN_data_formatted_THEN_contact_still_added(
+        self,
+    ):
+        data = dict(TEST_DATA[0], experimenters=None)
+
+        experiments, experiment_teams = reformat_data([data])
+
+        self.assertEqual(1, len(experiments))
+        self.assertEqual(1, len(experiment_teams))
+
+    def test_GIVEN_empty_experimenters_element_WHEN_experiments_parsed_THEN_experimenters_empty(
+        self,
+    ):
+        response = (
+            b'<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/"><S:Body>'
+            b'<ns2:getExperimentsByDateResponse xmlns:ns2="http://ws.example"><return>'
+            b"<rbNumber>1</rbNumber><experimenters/>"
+            b"</return></ns2:getExperimentsByDateResponse></S:Body></S:Envelope>"
+        )
+
+        (experiment,) = parse_experiments(io.BytesIO(response))
+
+        self.assertEqual([], experiment["experimenters"])
+
     def test_GIVEN_no_data_set_WHEN_data_formatted_THEN_no_data_set(self):
         experiments, experiment_teams = reformat_data([])
 
@@ -63,9 +106,9 @@ class WebServicesReaderTests(unittest.TestCase):
 
         self.assertEqual(len(experiments), 1)
         exp_entry = experiments[0]
-        self.assertEqual(exp_entry[Experiment.experimentid], TEST_RBNUMBER)
-        self.assertEqual(exp_entry[Experiment.startdate], TEST_DATE)
-        self.assertEqual(exp_entry[Experiment.duration], TEST_TIMEALLOCATED)
+        self.assertEqual(exp_entry.experimentid, TEST_RBNUMBER)
+        self.assertEqual(exp_entry.startdate, TEST_DATE)
+        self.assertEqual(exp_entry.duration, TEST_TIMEALLOCATED)
 
     def test_GIVEN_rb_with_multiple_start_dates_WHEN_data_formatted_THEN_two_experiments_added(
         self,
@@ -75,9 +118,9 @@ class WebServicesReaderTests(unittest.TestCase):
 
         self.assertEqual(len(experiments), 2)
         first_exp, second_exp = experiments[0], experiments[1]
-        self.assertEqual(first_exp[Experiment.experimentid], second_exp[Experiment.experimentid])
-        self.assertEqual(first_exp[Experiment.experimentid], TEST_RBNUMBER)
-        self.assertNotEqual(first_exp[Experiment.startdate], second_exp[Experiment.startdate])
+        self.assertEqual(first_exp.experimentid, second_exp.experimentid)
+        self.assertEqual(first_exp.experimentid, TEST_RBNUMBER)
+        self.assertNotEqual(first_exp.startdate, second_exp.startdate)
 
     def test_GIVEN_data_with_different_dates_WHEN_data_formatted_THEN_experiment_list_contains_both(
         self,
@@ -88,13 +131,13 @@ class WebServicesReaderTests(unittest.TestCase):
 
         self.assertEqual(len(experiments), 2)
         for entry in experiments:
-            if entry[Experiment.experimentid] == TEST_RBNUMBER:
-                self.assertEqual(entry[Experiment.startdate], TEST_DATE)
-                self.assertEqual(entry[Experiment.duration], TEST_TIMEALLOCATED)
+            if entry.experimentid == TEST_RBNUMBER:
+                self.assertEqual(entry.startdate, TEST_DATE)
+                self.assertEqual(entry.duration, TEST_TIMEALLOCATED)
             else:
-                self.assertEqual(entry[Experiment.experimentid], rb)
-                self.assertEqual(entry[Experiment.startdate], date)
-                self.assertEqual(entry[Experiment.duration], duration)
+                self.assertEqual(entry.experimentid, rb)
+                self.assertEqual(entry.startdate, date)
+                self.assertEqual(entry.duration, duration)
 
     def test_GIVEN_data_with_local_contacts_and_no_corresponding_date_WHEN_data_formatted_THEN_exception_thrown(
         self,
@@ -169,7 +212,265 @@ class WebServicesReaderTests(unittest.TestCase):
         self.assertEqual(experiment_teams[1].rb_number, experiment_teams[3].rb_number)
         self.assertNotEqual(experiment_teams[1].start_date, experiment_teams[3].start_date)
 
+    def test_GIVEN_user_in_several_experiments_WHEN_data_formatted_THEN_user_record_shared(self):
+        data = [
+            create_web_data_with_experimenters([TEST_USER_1]),
+            create_web_data_with_experimenters_and_other_date([TEST_USER_1], datetime.now()),
+        ]
+        experiments, experiment_teams = reformat_data(data)
+
+        self.assertIs(experiment_teams[1].user, experiment_teams[3].user)
+        self.assertIs(experiment_teams[0].user, experiment_teams[2].user)
+        self.assertEqual(2, len({exp_team.user for exp_team in experiment_teams}))
+
     def test_WHEN_exp_member_created_with_member_role_THEN_becomes_user(self):
         exp_team_data = create_exp_team(MagicMock(), "Member", TEST_RBNUMBER, TEST_DATE)
 
         self.assertEqual("User", exp_team_data.role)
+
+
+class StreamingWebServicesReaderTests(unittest.TestCase):
+    def setUp(self):
+        self.response_path = os.path.join(TEST_DATA_DIR, "getExperimentsByDate_response.xml")
+        self.client = Client("file://" + os.path.join(TEST_DATA_DIR, "ScheduleWebService.wsdl"))
+
+    def test_WHEN_date_time_with_timezone_parsed_THEN_local_time_kept(self):
+        self.assertEqual(
+            datetime(2018, 2, 7, 9, 30, 0, 500000), parse_date_time("2018-02-07T09:30:00.5+01:00")
+        )
+
+    def test_GIVEN_recorded_response_WHEN_experiments_parsed_THEN_all_experiments_returned(self):
+        with open(self.response_path, "rb") as response:
+            experiments = list(parse_experiments(response))
+
+        self.assertEqual(2, len(experiments))
+        first, second = experiments
+        self.assertEqual(TEST_RBNUMBER, first["rbNumber"])
+        self.assertEqual("test_instrument", first["instrument"])
+        self.assertEqual(TEST_CONTACT_NAME, first["lcName"])
+        self.assertEqual(TEST_DATE, first["scheduledDate"])
+        self.assertEqual(6.5, first["timeAllocated"])
+        self.assertEqual(6, first["part"])
+        self.assertEqual(datetime(2018, 2, 7, 9, 30), second["scheduledDate"])
+
+    def test_GIVEN_recorded_response_WHEN_experiments_parsed_THEN_experimenters_parsed(self):
+        with open(self.response_path, "rb") as response:
+            first, second = parse_experiments(response)
+
+        self.assertEqual(
+            [
+                {"name": TEST_PI_NAME, "organisation": TEST_PI_ORG, "role": TEST_PI_ROLE},
+                {"name": TEST_USER_1_NAME, "organisation": TEST_USER_1_ORG, "role": "Member"},
+            ],
+            get_experimenters(first),
+        )
+        self.assertEqual([], get_experimenters(second))
+
+    def test_GIVEN_recorded_response_WHEN_parsed_and_formatted_THEN_experiment_teams_populated(
+        self,
+    ):
+        with open(self.response_path, "rb") as response:
+            experiments, experiment_teams = reformat_data(parse_experiments(response))
+
+        self.assertEqual(2, len(experiments))
+        self.assertEqual(7, experiments[0].duration)
+        self.assertEqual(4, len(experiment_teams))
+        self.assertEqual(
+            ExperimentTeamData(
+                UserData(TEST_USER_1_NAME, TEST_USER_1_ORG), "User", TEST_RBNUMBER, TEST_DATE
+            ),
+            experiment_teams[2],
+        )
+
+    def test_GIVEN_fault_response_WHEN_experiments_parsed_THEN_exception_raised(self):
+        fault = (
+            b'<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/"><S:Body>'
+            b"<S:Fault><faultcode>S:Server</faultcode><faultstring>Invalid session</faultstring>"
+            b"</S:Fault></S:Body></S:Envelope>"
+        )
+
+        with self.assertRaisesRegex(IOError, "Invalid session"):
+            list(parse_experiments(io.BytesIO(fault)))
+
+    @patch("exp_db_populator.webservices_reader.requests")
+    def test_GIVEN_web_service_WHEN_data_streamed_THEN_request_sent_and_response_parsed(
+        self, requests
+    ):
+        requests.post.return_value.status_code = 200
+        requests.post.return_value.raw = open(self.response_path, "rb")
+        self.addCleanup(requests.post.return_value.raw.close)
+
+        experiments = list(stream_all_data_from_web(self.client, "TEST_SESSION"))
+
+        self.assertEqual(2, len(experiments))
+        url = requests.post.call_args.args[0]
+        envelope = requests.post.call_args.kwargs["data"]
+        self.assertEqual("https://localhost/ws/ScheduleWebService", url)
+        self.assertIn(b"<sessionId>TEST_SESSION</sessionId>", envelope)
+        self.assertIn(b"<facility>ISIS</facility>", envelope)
+
+    @patch("exp_db_populator.webservices_reader.metrics", new_callable=Metrics)
+    @patch("exp_db_populator.webservices_reader.requests")
+    def test_GIVEN_web_service_WHEN_data_streamed_THEN_payload_size_recorded(
+        self, requests, metrics
+    ):
+        requests.post.return_value.status_code = 200
+        requests.post.return_value.raw = open(self.response_path, "rb")
+        self.addCleanup(requests.post.return_value.raw.close)
+
+        list(stream_all_data_from_web(self.client, "TEST_SESSION"))
+
+        payload_size = os.path.getsize(self.response_path)
+        self.assertEqual(payload_size, metrics.gauges[("web_last_payload_bytes", ())])
+        self.assertEqual(2, metrics.counters[("web_experiments", ())])
+        self.assertEqual(1, metrics.timings[("web_fetch", ())][0])
+
+    @patch("exp_db_populator.webservices_reader.requests")
+    def test_GIVEN_session_rejected_WHEN_data_streamed_THEN_session_rejected_error_raised(
+        self, requests
+    ):
+        requests.post.return_value.status_code = 401
+
+        with self.assertRaises(SessionRejectedError):
+            list(stream_all_data_from_web(self.client, "TEST_SESSION"))
+
+    @patch("exp_db_populator.webservices_reader.requests")
+    def test_GIVEN_web_service_unavailable_WHEN_data_streamed_THEN_exception_raised(self, requests):
+        requests.post.return_value.status_code = 404
+
+        with self.assertRaises(IOError):
+            list(stream_all_data_from_web(self.client, "TEST_SESSION"))
+
+
+class WebClientTests(unittest.TestCase):
+    def setUp(self):
+        self.wsdl_url = "file://" + os.path.join(TEST_DATA_DIR, "ScheduleWebService.wsdl")
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.cache_folder = temp_dir.name
+        clear_clients()
+        self.addCleanup(clear_clients)
+
+    def test_WHEN_client_requested_twice_THEN_same_client_returned(self):
+        client = get_client(self.wsdl_url, self.cache_folder)
+
+        self.assertIs(client, get_client(self.wsdl_url, self.cache_folder))
+
+    def test_WHEN_client_requested_THEN_definition_cached_on_disk(self):
+        get_client(self.wsdl_url, self.cache_folder)
+
+        self.assertNotEqual([], os.listdir(self.cache_folder))
+
+    def test_GIVEN_cached_definition_WHEN_new_client_created_THEN_definition_read_from_cache(self):
+        get_client(self.wsdl_url, self.cache_folder)
+        clear_clients()
+
+        with patch("suds.reader.DocumentReader.open") as open_document:
+            client = get_client(self.wsdl_url, self.cache_folder)
+
+        open_document.assert_not_called()
+        self.assertIsNotNone(client.factory.create("dateRange"))
+
+    @patch("exp_db_populator.webservices_reader.time")
+    def test_GIVEN_old_client_WHEN_client_requested_THEN_new_client_created(self, time):
+        time.return_value = 0
+        client = get_client(self.wsdl_url, self.cache_folder)
+
+        time.return_value = 2 * 24 * 60 * 60
+        self.assertIsNot(client, get_client(self.wsdl_url, self.cache_folder))
+
+
+@patch("exp_db_populator.webservices_reader.get_credentials", create=True)
+class WebSessionTests(unittest.TestCase):
+    def setUp(self):
+        self.web_session = WebSession()
+        self.web_session.http_session = MagicMock()
+        self.post = self.web_session.http_session.post
+        self.post.return_value.status_code = SUCCESSFUL_LOGIN_STATUS_CODE
+        self.post.return_value.json.return_value = {"sessionId": "TEST_SESSION"}
+
+    def test_WHEN_session_id_requested_THEN_logged_in(self, get_credentials):
+        get_credentials.return_value = ("user", "pass")
+
+        self.assertEqual("TEST_SESSION", self.web_session.get_session_id())
+        self.post.assert_called_once()
+        self.assertEqual(
+            {"username": "user", "password": "pass"}, self.post.call_args.kwargs["json"]
+        )
+
+    def test_GIVEN_logged_in_WHEN_session_id_requested_again_THEN_session_reused(
+        self, get_credentials
+    ):
+        get_credentials.return_value = ("user", "pass")
+
+        self.web_session.get_session_id()
+        self.web_session.get_session_id()
+
+        self.post.assert_called_once()
+
+    @patch("exp_db_populator.webservices_reader.time")
+    def test_GIVEN_session_expired_WHEN_session_id_requested_THEN_logged_in_again(
+        self, time, get_credentials
+    ):
+        get_credentials.return_value = ("user", "pass")
+        time.return_value = 0
+        self.web_session.get_session_id()
+
+        time.return_value = SESSION_LIFETIME + 1
+        self.web_session.get_session_id()
+
+        self.assertEqual(2, self.post.call_count)
+
+    def test_GIVEN_session_invalidated_WHEN_session_id_requested_THEN_logged_in_again(
+        self, get_credentials
+    ):
+        get_credentials.return_value = ("user", "pass")
+        self.web_session.get_session_id()
+
+        self.web_session.invalidate()
+        self.web_session.get_session_id()
+
+        self.assertEqual(2, self.post.call_count)
+
+    def test_GIVEN_rejected_session_already_replaced_WHEN_invalidated_THEN_new_session_kept(
+        self, get_credentials
+    ):
+        get_credentials.return_value = ("user", "pass")
+        old_session_id = self.web_session.get_session_id()
+        self.web_session.invalidate(old_session_id)
+        self.post.return_value.json.return_value = {"sessionId": "NEW_SESSION"}
+        self.web_session.get_session_id()
+
+        self.web_session.invalidate(old_session_id)
+
+        self.assertEqual("NEW_SESSION", self.web_session.get_session_id())
+        self.assertEqual(2, self.post.call_count)
+
+    def test_GIVEN_login_fails_WHEN_session_id_requested_THEN_exception_raised(
+        self, get_credentials
+    ):
+        get_credentials.return_value = ("user", "pass")
+        self.post.return_value.status_code = 401
+
+        self.assertRaises(IOError, self.web_session.get_session_id)
+        self.assertIsNone(self.web_session.session_id)
+
+    @patch("exp_db_populator.webservices_reader.stream_all_data_from_web")
+    @patch("exp_db_populator.webservices_reader.web_session")
+    def test_GIVEN_session_rejected_WHEN_data_streamed_THEN_logged_in_again_and_retried(
+        self, web_session, stream_all_data_from_web, get_credentials
+    ):
+        def reject_session(client, session_id, http_session, date_range):
+            raise SessionRejectedError("Invalid session")
+            yield
+
+        stream_all_data_from_web.side_effect = [
+            reject_session(None, None, None, None),
+            iter(TEST_DATA),
+        ]
+
+        data = list(stream_data_with_session(MagicMock(), "OLD_SESSION"))
+
+        self.assertEqual(TEST_DATA, data)
+        web_session.invalidate.assert_called_once_with("OLD_SESSION")
+        self.assertEqual(2, stream_all_data_from_web.call_count)